@@ -1,13 +1,156 @@
+#define _GNU_SOURCE
+#include <ctype.h>
+#include <errno.h>
+#include <fcntl.h>
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
 #include <unistd.h>
 #include <syslog.h>
+#include <sys/socket.h>
+#include <sys/time.h>
+#include <sys/un.h>
+#include <sys/wait.h>
 #include <security/pam_modules.h>
 #include <security/pam_ext.h>
 
 //#define FACE_AUTH_SCRIPT "/usr/local/bin/face_auth.py"
+#ifndef FACE_AUTH_SCRIPT
 #define FACE_AUTH_SCRIPT "/home/nguynqh/face_auth_system/start_face_auth.sh"
+#endif
+// Socket của dịch vụ thường trú (face_auth.py --service), trong thư mục chỉ root ghi được
+#define FACE_AUTH_SOCKET "/run/face_auth/face_auth.sock"
+#define FACE_AUTH_TIMEOUT_SEC 60
+// Giống MAX_USERNAME_LENGTH trong auth_service.py
+#define FACE_AUTH_MAX_USERNAME 64
+
+// Cùng quy tắc với is_valid_username() trong auth_service.py: chỉ chữ, số và "._-@".
+// Khoảng trắng sẽ tách tên thành nhiều trường của giao thức ("AUTH alice ir" là
+// alice trên camera ir), còn ký tự điều khiển có thể chèn thêm dòng yêu cầu.
+static int is_valid_username(const char *user) {
+    size_t len = strlen(user);
+    if (len == 0 || len > FACE_AUTH_MAX_USERNAME) {
+        return 0;
+    }
+    for (const char *c = user; *c; c++) {
+        if (!isascii((unsigned char)*c) || (!isalnum((unsigned char)*c) && strchr("._-@", *c) == NULL)) {
+            return 0;
+        }
+    }
+    return 1;
+}
+
+// Gửi yêu cầu tới dịch vụ xác thực qua Unix socket.
+// Trả về 1 nếu thành công, 0 nếu thất bại, -1 nếu không kết nối được dịch vụ.
+static int query_face_auth_service(pam_handle_t *pamh, const char *user) {
+    struct sockaddr_un addr;
+    struct timeval tv = { FACE_AUTH_TIMEOUT_SEC, 0 };
+    char request[128];
+    char reply[16];
+    size_t len = 0;
+    ssize_t n;
+
+    int fd = socket(AF_UNIX, SOCK_STREAM, 0);
+    if (fd < 0) {
+        return -1;
+    }
+    setsockopt(fd, SOL_SOCKET, SO_RCVTIMEO, &tv, sizeof(tv));
+    setsockopt(fd, SOL_SOCKET, SO_SNDTIMEO, &tv, sizeof(tv));
+
+    memset(&addr, 0, sizeof(addr));
+    addr.sun_family = AF_UNIX;
+    strncpy(addr.sun_path, FACE_AUTH_SOCKET, sizeof(addr.sun_path) - 1);
+    if (connect(fd, (struct sockaddr *)&addr, sizeof(addr)) < 0) {
+        close(fd);
+        return -1;
+    }
+
+    // Chỉ tin dịch vụ chạy bằng root: không ai khác được trả lời thay nó
+    struct ucred cred;
+    socklen_t cred_len = sizeof(cred);
+    if (getsockopt(fd, SOL_SOCKET, SO_PEERCRED, &cred, &cred_len) < 0 || cred.uid != 0) {
+        pam_syslog(pamh, LOG_ERR, "Face authentication service is not running as root, ignoring it");
+        close(fd);
+        return -1;
+    }
+
+    n = snprintf(request, sizeof(request), "AUTH %s\n", user);
+    if (n < 0 || (size_t)n >= sizeof(request) || write(fd, request, n) != n) {
+        close(fd);
+        return -1;
+    }
+
+    while (len < sizeof(reply) - 1) {
+        n = read(fd, reply + len, sizeof(reply) - 1 - len);
+        if (n <= 0) {
+            break;
+        }
+        len += n;
+        if (memchr(reply, '\n', len) != NULL) {
+            break;
+        }
+    }
+    close(fd);
+    reply[len] = '\0';
+
+    if (len == 0) {
+        pam_syslog(pamh, LOG_ERR, "No reply from face authentication service");
+        return 0;
+    }
+    return strncmp(reply, "SUCCESS", 7) == 0 ? 1 : 0;
+}
+
+// Chạy FACE_AUTH_SCRIPT bằng execv, không qua shell: tên người dùng chỉ là một
+// đối số, không bao giờ là một phần của dòng lệnh. Dòng đầu tiên script in ra
+// được ghi vào result. Trả về 0 nếu đọc được kết quả, -1 nếu không.
+static int run_face_auth_script(pam_handle_t *pamh, const char *user, char *result, size_t size) {
+    int fds[2];
+    if (pipe(fds) < 0) {
+        pam_syslog(pamh, LOG_ERR, "Cannot run face authentication script");
+        return -1;
+    }
+    pid_t pid = fork();
+    if (pid < 0) {
+        close(fds[0]);
+        close(fds[1]);
+        pam_syslog(pamh, LOG_ERR, "Cannot run face authentication script");
+        return -1;
+    }
+    if (pid == 0) {
+        char *const args[] = { FACE_AUTH_SCRIPT, "--fast-start", "--headless", "--username", (char *)user, NULL };
+        int devnull = open("/dev/null", O_WRONLY);
+        dup2(fds[1], STDOUT_FILENO);
+        if (devnull >= 0) {
+            dup2(devnull, STDERR_FILENO);
+            close(devnull);
+        }
+        close(fds[0]);
+        close(fds[1]);
+        execv(FACE_AUTH_SCRIPT, args);
+        _exit(127);
+    }
+    close(fds[1]);
+
+    int ok = 0;
+    FILE *fp = fdopen(fds[0], "r");
+    if (fp != NULL) {
+        ok = fgets(result, size, fp) != NULL;
+        // Đọc hết để script không bị chặn khi ghi vào pipe đã đầy
+        char rest[256];
+        while (fgets(rest, sizeof(rest), fp) != NULL) {
+        }
+        fclose(fp);
+    } else {
+        close(fds[0]);
+    }
+    while (waitpid(pid, NULL, 0) < 0 && errno == EINTR) {
+    }
+    if (!ok) {
+        pam_syslog(pamh, LOG_ERR, "Error reading result from face authentication script");
+        return -1;
+    }
+    return 0;
+}
 
 PAM_EXTERN int pam_sm_authenticate(pam_handle_t *pamh, int flags, int argc, const char **argv) {
     const char *user;
@@ -18,26 +161,25 @@ PAM_EXTERN int pam_sm_authenticate(pam_handle_t *pamh, int flags, int argc, cons
     if (ret != PAM_SUCCESS) {
         return ret;
     }
-    
-    // Thực hiện kiểm tra xác thực khuôn mặt bằng cách gọi script Python
-    char cmd[512];
-    snprintf(cmd, sizeof(cmd), "%s --username %s 2>/dev/null", FACE_AUTH_SCRIPT, user);
-    
-    FILE *fp = popen(cmd, "r");
-    if (fp == NULL) {
-        pam_syslog(pamh, LOG_ERR, "Cannot run face authentication script");
+    if (!is_valid_username(user)) {
+        pam_syslog(pamh, LOG_ERR, "Rejecting username that cannot be sent to face authentication");
         return PAM_AUTH_ERR;
     }
     
+    // Ưu tiên dịch vụ thường trú: model và camera đã được nạp sẵn
+    ret = query_face_auth_service(pamh, user);
+    if (ret >= 0) {
+        return ret == 1 ? PAM_SUCCESS : PAM_AUTH_ERR;
+    }
+    
+    // Không có dịch vụ: thực hiện kiểm tra xác thực khuôn mặt bằng cách gọi script Python.
+    // --headless: tiến trình được chờ tới khi kết thúc, nên không mở cửa sổ nào để khỏi
+    // chờ hiệu ứng và màn hình kết quả sau khi đã có quyết định
     char result[16];
-    if (fgets(result, sizeof(result), fp) == NULL) {
-        pclose(fp);
-        pam_syslog(pamh, LOG_ERR, "Error reading result from face authentication script");
+    if (run_face_auth_script(pamh, user, result, sizeof(result)) < 0) {
         return PAM_AUTH_ERR;
     }
     
-    pclose(fp);
-    
     // Kiểm tra kết quả xác thực
     if (strncmp(result, "SUCCESS", 7) == 0) {
         return PAM_SUCCESS;
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# Unix socket transport for the long-lived face authentication daemon.
+# Only the standard library is imported here so that clients (the PAM
+# helper, face_auth_client.py) start instantly; the heavy face_recognition
+# stack lives in the daemon process started with `face_auth.py --service`.
+#
+# Protocol: one request line per connection, one reply line back.
+#   AUTH <username> [camera]  ->  SUCCESS | FAILURE | BUSY
+#   PING                      ->  PONG
+# BUSY means the service is already handling as many requests as it
+# accepts; clients treat it like FAILURE (the PAM module only accepts SUCCESS).
+#
+# The socket lives in a directory that only its owner (root, for the PAM
+# module) can write to, so nobody else can bind the path while the service
+# is down and answer in its place. The PAM module also checks that the
+# process at the other end runs as root.
+import asyncio
+import os
+import socket
+import struct
+
+DEFAULT_SOCKET_PATH = os.environ.get("FACE_AUTH_SOCKET", "/run/face_auth/face_auth.sock")
+SOCKET_DIR_MODE = 0o750
+SOCKET_MODE = 0o660
+REQUEST_TIMEOUT = 30  # seconds a client may take to send its request line
+MAX_USERNAME_LENGTH = 64
+DEFAULT_MAX_PENDING = 8
+# /proc/<pid>/sessionid of a process that is not part of any login session
+UNSET_SESSION = "4294967295"
+
+def is_valid_username(username):
+    return (0 < len(username) <= MAX_USERNAME_LENGTH
+            and all(c.isalnum() or c in "._-@" for c in username))
+
+def parse_request(line):
+    # ("PING",), ("AUTH", username, camera or None), or None if malformed
+    parts = line.split()
+    if parts == ["PING"]:
+        return ("PING",)
+    if (len(parts) in (2, 3) and parts[0] == "AUTH"
+            and all(is_valid_username(part) for part in parts[1:])):
+        return ("AUTH", parts[1], parts[2] if len(parts) == 3 else None)
+    return None
+
+def peer_session(sock):
+    # Login session of the process at the other end of a Unix socket: the
+    # kernel audit session id of the peer (inherited by sudo, the lock
+    # screen and everything else started in that session), which the peer
+    # cannot choose. None if it cannot be determined.
+    try:
+        creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        pid, _, _ = struct.unpack("3i", creds)
+        with open(f"/proc/{pid}/sessionid") as f:
+            session = f.read().strip()
+    except (AttributeError, OSError, ValueError, struct.error):
+        return None
+    if not session or session == UNSET_SESSION:
+        return None
+    return session
+
+# Requests are handled concurrently on one asyncio loop: authenticate is a
+# coroutine function (username, camera, session) -> bool, and the cameras and workers
+# behind it are shared between requests. At most max_pending requests run
+# at once; further ones are answered BUSY right away instead of queueing.
+class FaceAuthServer:
+    def __init__(self, socket_path, authenticate, max_pending=DEFAULT_MAX_PENDING):
+        self.socket_path = socket_path
+        self.authenticate = authenticate
+        self.max_pending = max_pending
+        self.pending = 0
+        self._server = None
+
+    async def serve_forever(self):
+        _prepare_socket_dir(self.socket_path)
+        _remove_stale_socket(self.socket_path)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        # Access is limited by the directory; PAM runs as root in whichever
+        # service asks (gdm, sudo, ...)
+        os.chmod(self.socket_path, SOCKET_MODE)
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+
+    async def _handle(self, reader, writer):
+        try:
+            line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+            request = parse_request(line[:256].decode("utf-8", "replace"))
+        except (asyncio.TimeoutError, ValueError, OSError):
+            request = None
+
+        if request is None:
+            reply = "FAILURE"
+        elif request[0] == "PING":
+            reply = "PONG"
+        elif self.pending >= self.max_pending:
+            print(f"Busy: {self.pending} requests pending, rejected {request[1]}")
+            reply = "BUSY"
+        else:
+            self.pending += 1
+            try:
+                session = peer_session(writer.get_extra_info("socket"))
+                reply = "SUCCESS" if await self.authenticate(request[1], request[2], session) else "FAILURE"
+            except Exception as e:
+                print(f"Error while authenticating {request[1]}: {e}")
+                reply = "FAILURE"
+            finally:
+                self.pending -= 1
+
+        try:
+            writer.write((reply + "\n").encode("utf-8"))
+            await writer.drain()
+            writer.close()
+        except OSError:
+            pass
+
+def _prepare_socket_dir(socket_path):
+    # Create the socket directory, or refuse one that somebody else could
+    # write to (they could replace the socket)
+    socket_dir = os.path.dirname(os.path.abspath(socket_path))
+    os.makedirs(socket_dir, mode=SOCKET_DIR_MODE, exist_ok=True)
+    st = os.stat(socket_dir)
+    if st.st_uid != os.getuid() or st.st_mode & 0o022:
+        raise RuntimeError(f"Socket directory {socket_dir} must be owned by uid {os.getuid()} "
+                           f"and not writable by group or others")
+
+def _remove_stale_socket(socket_path):
+    if not os.path.exists(socket_path):
+        return
+    try:
+        send_request("PING", socket_path, timeout=1)
+    except OSError:
+        os.unlink(socket_path)
+        return
+    raise RuntimeError(f"Another face authentication service is already listening on {socket_path}")
+
+def send_request(request, socket_path=DEFAULT_SOCKET_PATH, timeout=60):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall((request + "\n").encode("utf-8"))
+        reply = b""
+        while not reply.endswith(b"\n"):
+            chunk = sock.recv(64)
+            if not chunk:
+                break
+            reply += chunk
+    return reply.decode("utf-8", "replace").strip()
+
+def request_authentication(username, socket_path=DEFAULT_SOCKET_PATH, timeout=60, camera=None):
+    # Raises OSError when no service is listening so callers can fall back
+    # to running face_auth.py directly
+    request = f"AUTH {username} {camera}" if camera else f"AUTH {username}"
+    return send_request(request, socket_path, timeout) == "SUCCESS"
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# Visual feedback for authenticate_face.
+#
+# The authentication loop never draws anything itself. When a UI is wanted
+# it publishes each processed frame to an AuthRenderer, which draws the
+# scanning effect on its own thread; if rendering falls behind, stale frames
+# are skipped instead of slowing down the decision. Headless callers (PAM,
+# the service) simply do not create a renderer.
+import threading
+from collections import namedtuple
+
+import cv2
+
+from overlay_assets import RESULT_STYLES, OverlayAssets, result_icon
+
+WINDOW_NAME = 'Face Authentication'
+
+FrameEvent = namedtuple("FrameEvent", ["frame", "face_locations", "face_results", "attempt", "max_attempts"])
+
+def show_auth_ui(result, frame=None):
+    # GUI modules are only imported when a window is actually shown
+    import tkinter as tk
+    from PIL import Image, ImageTk
+    
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        # No display (e.g. PAM on a text console)
+        print(f"Warning: Could not show authentication window: {e}")
+        return
+    root.title("Face Authentication")
+    root.geometry("400x450")
+    root.configure(bg='white')
+
+    canvas = tk.Canvas(root, width=400, height=450, bg='white', highlightthickness=0)
+    canvas.pack()
+
+    # Process camera frame if provided
+    if frame is not None:
+        # Downscale with OpenCV before converting the OpenCV frame to PIL format
+        small = cv2.resize(frame, (320, 240), interpolation=cv2.INTER_AREA)
+        pil_img = Image.fromarray(cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+        cam_img_tk = ImageTk.PhotoImage(image=pil_img)
+        
+        # Display camera frame at the top
+        canvas.create_image(200, 120, image=cam_img_tk)
+    
+    # Tinted status icons are built once per process and reused
+    message, color, _ = RESULT_STYLES.get(result, RESULT_STYLES["failure"])
+    icon_img_tk = ImageTk.PhotoImage(result_icon(result))
+
+    # Position the status icon and text below the camera frame
+    canvas.create_image(200, 320, image=icon_img_tk)
+    canvas.create_text(200, 380, text=message, fill=color, font=("Arial", 14, "bold"))
+    
+    # Keep references to prevent garbage collection
+    root.cam_img_tk = cam_img_tk if frame is not None else None
+    root.icon_img_tk = icon_img_tk
+    
+    # Create a smooth fade-in effect
+    root.attributes('-alpha', 0.0)
+    
+    def fade_in():
+        alpha = root.attributes('-alpha')
+        if alpha < 1.0:
+            root.attributes('-alpha', min(alpha + 0.1, 1.0))
+            root.after(50, fade_in)
+            
+    fade_in()
+    root.after(3000, root.destroy)  # Close window after 3 seconds
+    root.mainloop()
+
+class AuthRenderer:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._event = None
+        self._result = None
+        self._finished = False
+        self.last_frame = None
+        
+        # Create scanning animation variables
+        self.scan_position = 0
+        self.scan_direction = 1
+        self.scan_speed = 10
+        
+        self._thread = threading.Thread(target=self._run, name="auth-renderer", daemon=True)
+        self._thread.start()
+
+    def publish(self, frame, face_locations=(), face_results=(), attempt=0, max_attempts=0):
+        # Never blocks: only the most recent frame is kept for rendering
+        with self._cond:
+            self._event = FrameEvent(frame, face_locations, face_results, attempt, max_attempts)
+            self._cond.notify()
+
+    def finish(self, result=None):
+        with self._cond:
+            if result is not None:
+                self._result = result
+            self._finished = True
+            self._cond.notify()
+
+    def close(self):
+        # Waits for the fade-out, then shows the result window. Tk is not
+        # thread-safe, so that part runs on the calling thread.
+        with self._cond:
+            self._finished = True
+            self._cond.notify()
+        self._thread.join()
+        if self._result is not None:
+            show_auth_ui(self._result, self.last_frame)
+
+    def _run(self):
+        # Create a window for smooth scanning effect - with error handling
+        try:
+            cv2.namedWindow(WINDOW_NAME, cv2.WINDOW_NORMAL)
+            cv2.resizeWindow(WINDOW_NAME, 640, 480)
+            window_created = True
+        except Exception as e:
+            print(f"Warning: Could not create window: {e}")
+            window_created = False
+        self.overlay = OverlayAssets() if window_created else None
+        if window_created:
+            # Build every overlay size and the result icons on this thread,
+            # while the user is being scanned, not when a face first shows up
+            self.overlay.precompute()
+            for result in RESULT_STYLES:
+                result_icon(result)
+        
+        while True:
+            with self._cond:
+                while self._event is None and not self._finished:
+                    self._cond.wait()
+                event, self._event = self._event, None
+                finished = self._finished
+            if event is not None:
+                self.last_frame = event.frame
+                if window_created:
+                    window_created = self._render(event)
+            elif finished:
+                break
+        
+        # Fade out the window if possible
+        if window_created and self.last_frame is not None:
+            try:
+                for i in range(10):
+                    alpha = 1.0 - (i / 10.0)
+                    fade_frame = cv2.convertScaleAbs(self.last_frame, alpha=alpha, beta=0)
+                    cv2.imshow(WINDOW_NAME, fade_frame)
+                    cv2.waitKey(30)
+            except Exception:
+                pass
+        
+        # Close any open windows
+        if window_created:
+            try:
+                cv2.destroyAllWindows()
+            except Exception:
+                pass
+
+    def _render(self, event):
+        display_frame = event.frame.copy()
+        
+        if len(event.face_locations) == 0:
+            cv2.putText(display_frame, "Looking for face...", (10, 30), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 165, 0), 2)
+            return self._show(display_frame)
+        
+        # When a face is detected, create smooth scanning effect
+        for (top, right, bottom, left) in event.face_locations:
+            # Draw rectangle around the face
+            cv2.rectangle(display_frame, (left, top), (right, bottom), (0, 255, 0), 2)
+            
+            # Draw scanning line effect
+            if top < bottom:  # Make sure these values are valid
+                if self.scan_position < bottom - top:
+                    y_pos = top + self.scan_position
+                    cv2.line(display_frame, (left, y_pos), (right, y_pos), (0, 255, 255), 2)
+                
+                # Progress indicator
+                progress = min(event.attempt / max(event.max_attempts, 1) * 100, 100)
+                cv2.rectangle(display_frame, (left, bottom + 20), 
+                             (left + int((right-left) * progress/100), bottom + 30), 
+                             (0, 255, 0), -1)
+            
+            # Overlay face template if available - with careful error handling
+            if self.overlay:
+                try:
+                    self.overlay.blend(display_frame, top, right, bottom, left)
+                except Exception as e:
+                    print(f"Overlay error: {e}")
+        
+        # Update scanning animation
+        self.scan_position += self.scan_speed * self.scan_direction
+        if self.scan_position >= (bottom - top) or self.scan_position <= 0:
+            self.scan_direction *= -1
+        
+        # Display attempt counter and confidence info
+        cv2.putText(display_frame, f"Scanning... Attempt {event.attempt+1}/{event.max_attempts}", 
+                   (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+        
+        for (top, right, bottom, left), (matched, confidence) in zip(event.face_locations, event.face_results):
+            # Show confidence score on frame
+            cv2.putText(display_frame, f"Confidence: {confidence:.2f}", (10, 60), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
+            # Green checkmark or red X next to the face
+            mark, color = ("✓", (0, 255, 0)) if matched else ("✗", (0, 0, 255))
+            cv2.putText(display_frame, mark, (right + 10, top + 20), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 1, color, 2)
+        
+        return self._show(display_frame)
+
+    def _show(self, display_frame):
+        # Show the frame with effects - with error handling
+        try:
+            cv2.imshow(WINDOW_NAME, display_frame)
+            cv2.waitKey(1)
+            return True
+        except Exception as e:
+            print(f"Display error: {e}")
+            return False
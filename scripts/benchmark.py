@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# Benchmark harness: replays recorded frames (video files or image
+# directories such as data/izzy) through detection, encoding and
+# classification and reports per-stage latency percentiles, throughput,
+# time-to-decision and peak memory as JSON, so detectors, scale factors and
+# classifiers can be compared across commits.
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from embedding_index import MATCHERS
+from face_pipeline import DEFAULT_DETECTOR, DEFAULT_SCALE, DETECTORS, FacePipeline
+from frame_source import ImageDirectorySource, VideoFileSource
+
+PERCENTILES = (50, 90, 99)
+
+def summarize(samples):
+    # Latency statistics in milliseconds
+    if not samples:
+        return {"count": 0}
+    ms = np.asarray(samples) * 1000.0
+    summary = {"count": len(ms), "mean_ms": round(float(ms.mean()), 3), "max_ms": round(float(ms.max()), 3)}
+    for p in PERCENTILES:
+        summary[f"p{p}_ms"] = round(float(np.percentile(ms, p)), 3)
+    return summary
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def benchmark_auth(inputs, pipeline, clf=None, username=None, threshold=0.6, policy="consecutive",
+                   max_frames=10):
+    # Every input is replayed frame by frame. With a classifier, the frames
+    # also drive the decision engine; each time it reaches a verdict it is
+    # restarted, so a long recording yields many time-to-decision samples.
+    from face_auth import make_decision_engine, match_user, score_faces
+
+    stages = {name: [] for name in ("read", "detect", "encode", "classify", "total")}
+    frames = faces = frames_with_face = detector_invocations = 0
+    decisions = []
+    pipeline_time = 0.0
+
+    for path in inputs:
+        user = username or os.path.splitext(os.path.basename(os.path.normpath(path)))[0]
+        engine = None
+        if clf is not None:
+            engine = make_decision_engine(threshold, policy, max_frames=max_frames, clf=clf)
+            engine.start()
+        pipeline.reset()
+        source = ImageDirectorySource(path) if os.path.isdir(path) else VideoFileSource(path)
+        while True:
+            t0 = time.perf_counter()
+            ret, frame = source.read()
+            if not ret:
+                break
+            t1 = time.perf_counter()
+            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            face_locations = pipeline.detect(rgb_frame)
+            t2 = time.perf_counter()
+            encodings = pipeline.encode(rgb_frame, face_locations)
+            t3 = time.perf_counter()
+            scores = score_faces(clf, encodings, user) if clf is not None else []
+            t4 = time.perf_counter()
+
+            frames += 1
+            faces += len(face_locations)
+            frames_with_face += bool(face_locations)
+            stages["read"].append(t1 - t0)
+            stages["detect"].append(t2 - t1)
+            if face_locations:
+                stages["encode"].append(t3 - t2)
+            if scores:
+                stages["classify"].append(t4 - t3)
+            stages["total"].append(t4 - t0)
+            pipeline_time += t4 - t1
+
+            if engine is None:
+                continue
+            matched, confidence = match_user(user, scores, threshold)
+            decision = engine.observe(bool(face_locations), matched, confidence)
+            if decision is not None:
+                decisions.append({"input": path, "user": user, "result": decision.result,
+                                  "frames": decision.frames, "elapsed_s": round(decision.elapsed, 4)})
+                engine.start()
+        source.release()
+        detector_invocations += pipeline.detector_invocations
+
+    report = {
+        "frames": frames,
+        "faces": faces,
+        "frames_with_face": frames_with_face,
+        "fps": round(frames / pipeline_time, 2) if pipeline_time else None,
+        "stages": {name: summarize(samples) for name, samples in stages.items()},
+        "detector_invocations": detector_invocations,
+    }
+    if clf is not None:
+        report["time_to_decision"] = summarize([d["elapsed_s"] for d in decisions])
+        frame_counts = [d["frames"] for d in decisions]
+        report["frames_to_decision"] = {"mean": round(float(np.mean(frame_counts)), 2) if frame_counts else None,
+                                        "max": max(frame_counts, default=None)}
+        report["decisions"] = decisions
+    return report
+
+def benchmark_training(data_dir, classifier="svm", workers=1):
+    # Full retrain without the encoding cache, into a throwaway file
+    from train_model import list_training_images, train_face_model
+
+    images = len(list_training_images(data_dir))
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "model.pkl")
+        start = time.perf_counter()
+        train_face_model(data_dir, output, classifier, use_cache=False, workers=workers)
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(output) if os.path.exists(output) else None
+    return {
+        "images": images,
+        "workers": workers,
+        "classifier": classifier,
+        "elapsed_s": round(elapsed, 3),
+        "images_per_s": round(images / elapsed, 2) if elapsed else None,
+        "model_bytes": size,
+        "peak_rss_children_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Đo hiệu năng nhận diện và huấn luyện trên dữ liệu ghi sẵn")
+    parser.add_argument("inputs", nargs="*", default=["data/izzy", "data/khoi"],
+                        help="Thư mục ảnh hoặc file video (mặc định: data/izzy data/khoi)")
+    parser.add_argument("--model", default="models/face_auth_model.pkl",
+                        help="Model dùng để phân loại; bỏ qua phân loại nếu không tồn tại")
+    parser.add_argument("--matcher", choices=MATCHERS, default="model")
+    parser.add_argument("--username", default=None,
+                        help="Người dùng cần xác thực (mặc định: tên thư mục/file của từng đầu vào)")
+    parser.add_argument("--threshold", type=float, default=None,
+                        help="Ngưỡng độ tin cậy (mặc định: như face_auth.py)")
+    parser.add_argument("--policy", choices=["consecutive", "majority"], default="consecutive")
+    parser.add_argument("--max-frames", type=int, default=10)
+    parser.add_argument("--scale", type=float, default=DEFAULT_SCALE)
+    parser.add_argument("--detector", choices=DETECTORS, default=DEFAULT_DETECTOR)
+    parser.add_argument("--track", action="store_true")
+    parser.add_argument("--train", action="store_true", help="Đo thêm thời gian huấn luyện trên --data-dir")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--classifier", choices=["svm", "index"], default="svm")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--output", default=None, help="Ghi kết quả JSON vào file thay vì stdout")
+    args = parser.parse_args()
+
+    results = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "config": {"inputs": args.inputs, "model": args.model, "matcher": args.matcher, "scale": args.scale,
+                   "detector": args.detector, "track": args.track, "threshold": args.threshold,
+                   "policy": args.policy, "max_frames": args.max_frames},
+    }
+
+    # Progress messages of the scripts under test go to stderr so that
+    # stdout carries only the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        from face_auth import load_model, model_threshold
+
+        pipeline = FacePipeline(args.scale, args.detector, track=args.track)
+        clf = None
+        if os.path.exists(args.model):
+            start = time.perf_counter()
+            clf, metadata = load_model(args.model, args.matcher)
+            results["model_load_s"] = round(time.perf_counter() - start, 4)
+            args.threshold = model_threshold(args.threshold, metadata, args.matcher, clf)
+        else:
+            print(f"Model {args.model} không tồn tại, bỏ qua bước phân loại")
+        results["config"]["threshold"] = args.threshold
+        results["auth"] = benchmark_auth(args.inputs, pipeline, clf, args.username, args.threshold,
+                                         args.policy, args.max_frames)
+        if args.train:
+            workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+            results["train"] = benchmark_training(args.data_dir, args.classifier, workers)
+    results["peak_rss_mb"] = peak_rss_mb()
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
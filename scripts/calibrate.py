@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# Threshold calibration from the enrollment data stored in a trained model.
+#
+# Every stored encoding is used as a probe against every enrolled user,
+# with the score face_auth.py uses for the chosen --matcher, while the probe
+# itself is held out of the gallery:
+#   index, verify  leave-one-out: one distance matrix over all samples (in
+#                  blocks of rows) with the probe's own entry masked out
+#   model          k-fold: a copy of the classifier is refitted without each fold and
+#                  scores the whole fold in one predict_proba call
+# The score against the probe's own user is a genuine attempt, the scores
+# against the other users are impostor attempts.
+#
+# FAR and FRR are per frame. The threshold is chosen on the open-set FAR:
+# every impostor score counts, as it would for a stranger who is not
+# enrolled. The closed-set FAR, where (except with "verify") a face only
+# counts for a user it is also classified as, as in face_auth.py, is lower
+# and only reported. The threshold that meets --target-far with the lowest
+# FRR is stored in the model metadata under the matcher name, and
+# face_auth.py uses it when --threshold is not given; it is not stored when
+# no threshold meets the target or there are too few impostor attempts to
+# check it, unless --force, and never when it would reject every genuine
+# attempt.
+import argparse
+import csv
+import os
+import sys
+
+import numpy as np
+
+from embedding_index import MATCHERS, EmbeddingIndex, pairwise_distances, squared_norms
+from model_format import is_binary_model, load_trained_model, save_trained_model
+
+DEFAULT_TARGET_FAR = 0.001
+DEFAULT_FOLDS = 5
+BLOCK_ROWS = 1024
+# Thresholds printed in the summary table
+REPORT_THRESHOLDS = np.round(np.arange(0.40, 0.951, 0.05), 2)
+
+def model_samples(clf, face_encodings, face_names):
+    # (encodings, names) stored in the model
+    if face_encodings is not None:
+        return np.asarray(face_encodings, dtype=np.float32), np.asarray(face_names)
+    return np.asarray(clf.embeddings, dtype=np.float32), np.repeat(clf.users, clf.counts)
+
+def leave_one_out_scores(encodings, names, users):
+    # (probes, users) matrix of 1 / (1 + d) to the nearest other sample of
+    # each user; a user's only sample never matches itself
+    order = np.argsort(names, kind="stable")
+    gallery = encodings[order]
+    gallery_names = names[order]
+    starts = np.searchsorted(gallery_names, users)
+    sq_norms = squared_norms(gallery)
+    # Position of every probe inside the sorted gallery
+    position = np.empty(len(order), dtype=np.int64)
+    position[order] = np.arange(len(order))
+
+    scores = np.empty((len(encodings), len(users)), dtype=np.float32)
+    for start in range(0, len(encodings), BLOCK_ROWS):
+        rows = np.arange(start, min(start + BLOCK_ROWS, len(encodings)))
+        distances = pairwise_distances(encodings[rows], gallery, sq_norms)
+        distances[np.arange(len(rows)), position[rows]] = np.inf
+        scores[rows] = 1.0 / (1.0 + np.minimum.reduceat(distances, starts, axis=1))
+    return scores
+
+def kfold_scores(clf, encodings, names, users, folds):
+    # Every sample is scored by an unfitted copy of clf (same estimator and
+    # parameters) that was fitted without it
+    from sklearn.base import clone
+    from sklearn.model_selection import StratifiedKFold
+
+    smallest = min(int((names == user).sum()) for user in users)
+    folds = max(2, min(folds, smallest))
+    splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=0)
+    scores = np.zeros((len(encodings), len(users)), dtype=np.float32)
+    for train, test in splitter.split(encodings, names):
+        fold_clf = clone(clf)
+        fold_clf.fit(encodings[train], names[train])
+        columns = [list(users).index(user) for user in fold_clf.classes_]
+        scores[np.ix_(test, columns)] = fold_clf.predict_proba(encodings[test])
+    return scores, folds
+
+def attempt_scores(scores, names, users, identify=True):
+    # Genuine and impostor scores; when identifying, a score only counts if
+    # the probe is also classified as that user
+    own = np.searchsorted(users, names)
+    if identify:
+        scores = np.where(scores == scores.max(axis=1, keepdims=True), scores, 0.0)
+    genuine_mask = np.zeros(scores.shape, dtype=bool)
+    genuine_mask[np.arange(len(names)), own] = True
+    return scores[genuine_mask], scores[~genuine_mask]
+
+def error_curves(genuine, impostor):
+    # FAR(t): impostor scores >= t; FRR(t): genuine scores < t, for every
+    # distinct score t
+    thresholds = np.unique(np.concatenate((genuine, impostor, [0.0, 1.0])))
+    genuine = np.sort(genuine)
+    frr = np.searchsorted(genuine, thresholds, "left") / max(len(genuine), 1)
+    return thresholds, far_curve(impostor, thresholds), frr
+
+def far_curve(impostor, thresholds):
+    impostor = np.sort(impostor)
+    return (len(impostor) - np.searchsorted(impostor, thresholds, "left")) / max(len(impostor), 1)
+
+def choose_threshold(thresholds, far, frr, target_far):
+    # Lowest threshold (hence lowest FRR) whose FAR meets the target; FAR
+    # only falls as the threshold rises
+    meeting = np.flatnonzero(far <= target_far)
+    i = int(meeting[0]) if len(meeting) else len(thresholds) - 1
+    eer = int(np.argmin(np.abs(far - frr)))
+    return {"threshold": round(float(thresholds[i]), 4), "far": float(far[i]), "frr": float(frr[i]),
+            "target_far": target_far, "eer": round(float((far[eer] + frr[eer]) / 2), 4),
+            "eer_threshold": round(float(thresholds[eer]), 4)}
+
+def at_threshold(thresholds, curve, t):
+    return float(curve[min(np.searchsorted(thresholds, t, "left"), len(curve) - 1)])
+
+def calibrate(model_path, matcher="model", target_far=DEFAULT_TARGET_FAR, folds=DEFAULT_FOLDS,
+              curve_path=None, save=True, force=False):
+    clf, face_encodings, face_names, metadata, extra = load_trained_model(model_path)
+    encodings, names = model_samples(clf, face_encodings, face_names)
+    users = np.array(sorted(set(names.tolist())))
+    if len(users) < 2:
+        raise ValueError("cần ít nhất 2 người dùng để ước lượng tỉ lệ chấp nhận sai")
+
+    # .fam files and index models are always matched against the samples
+    if matcher != "model" or isinstance(clf, EmbeddingIndex) or is_binary_model(model_path):
+        scores = leave_one_out_scores(encodings, names, users)
+        method = "leave-one-out"
+    else:
+        scores, used_folds = kfold_scores(clf, encodings, names, users, folds)
+        method = f"{used_folds}-fold"
+    genuine, impostor = attempt_scores(scores, names, users, identify=False)
+    thresholds, far, frr = error_curves(genuine, impostor)
+    result = choose_threshold(thresholds, far, frr, target_far)
+    _, closed_impostor = attempt_scores(scores, names, users, identify=matcher != "verify")
+    closed_far = far_curve(closed_impostor, thresholds)
+    result.update(closed_far=at_threshold(thresholds, closed_far, result["threshold"]), method=method,
+                  users=len(users), genuine=len(genuine), impostor=len(impostor))
+
+    print(f"Hiệu chỉnh {model_path} (matcher {matcher}, {method}): {len(users)} người dùng, "
+          f"{len(genuine)} lần thử đúng người, {len(impostor)} lần thử giả mạo")
+    print(f"{'ngưỡng':>8} {'FAR':>9} {'FAR đóng':>9} {'FRR':>9}")
+    for t in REPORT_THRESHOLDS:
+        print(f"{t:>8.2f} {at_threshold(thresholds, far, t):>9.4f} {at_threshold(thresholds, closed_far, t):>9.4f} "
+              f"{at_threshold(thresholds, frr, t):>9.4f}")
+    print(f"EER {result['eer']:.4f} tại ngưỡng {result['eer_threshold']:.4f}")
+    print(f"Ngưỡng cho FAR <= {target_far}: {result['threshold']:.4f} (FAR {result['far']:.4f}, "
+          f"FAR tập đóng {result['closed_far']:.4f}, FRR {result['frr']:.4f} mỗi khung hình)")
+
+    if curve_path:
+        with open(curve_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["threshold", "far", "closed_far", "frr"])
+            writer.writerows(zip(thresholds.round(6), far.round(6), closed_far.round(6), frr.round(6)))
+        print(f"Đã ghi đường cong FAR/FRR vào {curve_path}")
+
+    if result["far"] > target_far:
+        print(f"CẢNH BÁO: không có ngưỡng nào đạt FAR <= {target_far}")
+        if save and not force:
+            print("Không lưu ngưỡng; dùng --force để lưu ngưỡng cao nhất")
+            save = False
+    if save and result["frr"] >= 1.0:
+        # Even with --force: such a threshold would reject everybody
+        print(f"Không lưu ngưỡng: ngưỡng {result['threshold']:.4f} từ chối mọi lần thử đúng người (FRR 1.0)")
+        save = False
+    if save and len(impostor) * target_far < 1 and not force:
+        print(f"Không lưu ngưỡng: {len(impostor)} lần thử giả mạo không đủ để kiểm chứng FAR {target_far} "
+              f"(cần ít nhất {int(np.ceil(1 / target_far))}); thêm người dùng hoặc dùng --force")
+        save = False
+    if save:
+        metadata = dict(metadata or {})
+        metadata["calibration"] = {**metadata.get("calibration", {}), matcher: result}
+        save_trained_model(model_path, clf, face_encodings, face_names, metadata, extra)
+        print(f"Đã lưu ngưỡng vào {model_path}")
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hiệu chỉnh ngưỡng độ tin cậy từ dữ liệu đăng ký trong mô hình")
+    parser.add_argument("--model", default="models/face_auth_model.pkl", help="Đường dẫn mô hình (.pkl hoặc .fam)")
+    parser.add_argument("--matcher", choices=MATCHERS, default="model",
+                        help="Cách so khớp sẽ dùng trong face_auth.py (model, index hoặc verify)")
+    parser.add_argument("--target-far", type=float, default=DEFAULT_TARGET_FAR,
+                        help="Tỉ lệ chấp nhận sai tối đa cho mỗi khung hình")
+    parser.add_argument("--folds", type=int, default=DEFAULT_FOLDS,
+                        help="Số phần k-fold khi hiệu chỉnh bộ phân loại (matcher model)")
+    parser.add_argument("--curve", default=None, help="Ghi đường cong FAR/FRR ra file CSV")
+    parser.add_argument("--no-save", action="store_true", help="Chỉ in kết quả, không ghi ngưỡng vào mô hình")
+    parser.add_argument("--force", action="store_true",
+                        help="Ghi ngưỡng vào mô hình kể cả khi không đủ lần thử giả mạo để kiểm chứng --target-far")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.model):
+        print(f"Model {args.model} không tồn tại")
+        sys.exit(1)
+    try:
+        calibrate(args.model, args.matcher, args.target_far, args.folds, args.curve, not args.no_save, args.force)
+    except ValueError as e:
+        print(f"Lỗi: {e}")
+        sys.exit(1)
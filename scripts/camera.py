@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# Background camera capture.
+#
+# ThreadedCapture reads frames on its own thread into a small ring buffer so
+# that slow processing (detection, encoding, drawing) never stalls frame
+# acquisition, and read() always returns the freshest frame. It mirrors the
+# parts of the cv2.VideoCapture API used by the scripts (read, grab,
+# isOpened, release) so it can be used as a drop-in replacement.
+import threading
+import time
+from collections import deque
+
+import cv2
+
+class ThreadedCapture:
+    def __init__(self, source=0, buffer_size=2, flush_frames=4):
+        self.source = source
+        self.flush_frames = flush_frames
+        self._cap = cv2.VideoCapture(source)
+        # Ask the driver not to queue frames; our own buffer holds the latest
+        self._cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        self._buffer = deque(maxlen=buffer_size)
+        self._cond = threading.Condition()
+        self._running = False
+        self._paused = False
+        self._flush_pending = 0
+        self._thread = None
+        self._sequence = 0
+        self._last_delivered = 0
+        self.reset_stats()
+
+        if self._cap.isOpened():
+            self._running = True
+            self._thread = threading.Thread(target=self._capture_loop, name="camera-capture", daemon=True)
+            self._thread.start()
+
+    def reset_stats(self):
+        self.frames_captured = 0
+        self.frames_delivered = 0
+        self.frames_dropped = 0
+        self.read_failures = 0
+        self._capture_time_total = 0.0
+        self.capture_latency_max = 0.0
+        self._frame_age_total = 0.0
+        self.frame_age_max = 0.0
+
+    def _capture_loop(self):
+        while True:
+            with self._cond:
+                while self._running and self._paused:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                flush = self._flush_pending
+                self._flush_pending = 0
+
+            # Frames queued by the driver while paused are stale
+            for _ in range(flush):
+                self._cap.grab()
+
+            started = time.monotonic()
+            ret, frame = self._cap.read()
+            captured_at = time.monotonic()
+
+            if not ret:
+                with self._cond:
+                    self.read_failures += 1
+                    self._cond.notify_all()
+                # Back off instead of spinning on a camera that went away
+                time.sleep(0.05)
+                continue
+
+            with self._cond:
+                if self._paused:
+                    continue
+                latency = captured_at - started
+                self.frames_captured += 1
+                self._capture_time_total += latency
+                self.capture_latency_max = max(self.capture_latency_max, latency)
+                if len(self._buffer) == self._buffer.maxlen:
+                    self.frames_dropped += 1
+                self._sequence += 1
+                self._buffer.append((self._sequence, captured_at, frame))
+                self._cond.notify_all()
+
+    def _wait_for_new_frame(self, timeout):
+        deadline = time.monotonic() + timeout
+        while not self._buffer or self._buffer[-1][0] <= self._last_delivered:
+            remaining = deadline - time.monotonic()
+            if not self._running or remaining <= 0:
+                return False
+            self._cond.wait(remaining)
+        return True
+
+    def read(self, timeout=1.0):
+        # Return the newest frame not handed out yet; older buffered frames
+        # are discarded and counted as dropped
+        with self._cond:
+            if not self._wait_for_new_frame(timeout):
+                return False, None
+            sequence, captured_at, frame = self._buffer.pop()
+            self.frames_dropped += len(self._buffer)
+            self._buffer.clear()
+            self._last_delivered = sequence
+            self.frames_delivered += 1
+            age = time.monotonic() - captured_at
+            self._frame_age_total += age
+            self.frame_age_max = max(self.frame_age_max, age)
+        return True, frame
+
+    def grab(self, timeout=1.0):
+        with self._cond:
+            return self._wait_for_new_frame(timeout)
+
+    def pause(self):
+        # Stop pulling frames while idle (service mode between requests)
+        with self._cond:
+            self._paused = True
+            self._buffer.clear()
+
+    def resume(self):
+        with self._cond:
+            if self._paused:
+                self._paused = False
+                self._flush_pending = self.flush_frames
+                self._cond.notify_all()
+
+    def isOpened(self):
+        return self._running and self._cap.isOpened()
+
+    def release(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        self._cap.release()
+
+    def stats(self):
+        with self._cond:
+            captured = self.frames_captured
+            delivered = self.frames_delivered
+            return {
+                "frames_captured": captured,
+                "frames_delivered": delivered,
+                "frames_dropped": self.frames_dropped,
+                "read_failures": self.read_failures,
+                "capture_latency_avg_ms": 1000 * self._capture_time_total / captured if captured else 0.0,
+                "capture_latency_max_ms": 1000 * self.capture_latency_max,
+                "frame_age_avg_ms": 1000 * self._frame_age_total / delivered if delivered else 0.0,
+                "frame_age_max_ms": 1000 * self.frame_age_max,
+            }
+
+    def format_stats(self):
+        s = self.stats()
+        return (f"captured {s['frames_captured']}, delivered {s['frames_delivered']}, "
+                f"dropped {s['frames_dropped']}, read failures {s['read_failures']}, "
+                f"capture latency avg {s['capture_latency_avg_ms']:.1f} ms / max {s['capture_latency_max_ms']:.1f} ms, "
+                f"frame age avg {s['frame_age_avg_ms']:.1f} ms / max {s['frame_age_max_ms']:.1f} ms")
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# Shared cameras and encoding workers for the authentication service
+# (face_auth.py --service).
+#
+# Each camera is opened once, by a CameraHub, however many authentication
+# requests are waiting on it. The hub reads a frame, has a worker process
+# detect and encode the faces in it, and hands the result to every
+# subscribed request. Detection and encoding do not depend on who is being
+# verified, so simultaneous prompts (sudo, lock screen, ssh-agent, ...)
+# share that work and only the cheap classification runs per request.
+#
+# Backpressure: the hub reads the next frame only once a worker is free
+# (ThreadedCapture meanwhile keeps just the freshest frame), results that
+# come back out of order are dropped, and a subscriber only ever holds the
+# newest result, so a slow request skips frames instead of queueing them.
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
+from collections import namedtuple
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+
+from face_pipeline import DEFAULT_DETECTOR, DEFAULT_SCALE, FacePipeline
+
+DEFAULT_CAMERA = "default"
+# Seconds between frames while only passive subscribers (presence checks) listen
+PASSIVE_INTERVAL = 0.2
+# Seconds a warmed-up worker waits for the others to load their models
+WARM_UP_TIMEOUT = 120
+
+# face_locations and encodings of one frame; timings are the seconds the
+# worker spent per pipeline stage
+FrameResult = namedtuple("FrameResult", "sequence face_locations encodings timings")
+
+# Worker process state: one pipeline (and one copy of the dlib models) per process
+_pipeline = None
+_warm_up_barrier = None
+
+def _init_worker(scale, detector, barrier):
+    global _pipeline, _warm_up_barrier
+    _pipeline = FacePipeline(scale, detector)
+    _warm_up_barrier = barrier
+
+def _ready(_):
+    # Holds the worker until every worker has one, so each takes exactly one
+    _warm_up_barrier.wait(WARM_UP_TIMEOUT)
+    return os.getpid()
+
+def _worker_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+def _analyze(frame):
+    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    face_locations = _pipeline.detect(rgb_frame)
+    encodings = _pipeline.encode(rgb_frame, face_locations)
+    timings = {stage: sum(samples) for stage, samples in _pipeline.metrics.samples.items()}
+    _pipeline.metrics.samples.clear()
+    return face_locations, encodings, timings
+
+class FrameAnalyzer:
+    # Process pool for detection and encoding, sized to the number of cores.
+    # A hub takes a slot before reading a frame, so at most one frame per
+    # worker is ever in flight.
+    def __init__(self, workers=0, scale=DEFAULT_SCALE, detector=DEFAULT_DETECTOR):
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self.scale = scale
+        self.detector = detector
+        self.restarts = 0
+        self._pool = self._start_pool()
+        self.slots = asyncio.Semaphore(self.workers)
+
+    def _start_pool(self):
+        # The pool starts its workers lazily, from whatever thread submits
+        # first, by which time the event loop's executor threads (and maybe a
+        # camera thread) exist. Forking then could copy a lock another thread
+        # holds, so the workers come from a forkserver (a fresh, single
+        # threaded process) and never from a fork of the service itself.
+        context = _worker_context()
+        return concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=context, initializer=_init_worker,
+                                                      initargs=(self.scale, self.detector,
+                                                                context.Barrier(self.workers)))
+
+    def warm_up(self):
+        # Start every worker and load its models before the first request
+        return len(set(self._pool.map(_ready, range(self.workers))))
+
+    async def analyze(self, frame):
+        loop = asyncio.get_running_loop()
+        pool = self._pool
+        try:
+            return await loop.run_in_executor(pool, _analyze, frame)
+        except BrokenProcessPool:
+            # A worker died (a crash in dlib, the OOM killer) and the pool is
+            # unusable from then on; replace it, once, so that later frames
+            # are analyzed again instead of every request failing
+            if pool is self._pool:
+                self.restarts += 1
+                print(f"A worker process died, restarting the worker pool (restart {self.restarts})")
+                pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = self._start_pool()
+            raise
+
+    def close(self):
+        self._pool.shutdown(cancel_futures=True)
+
+class Subscription:
+    # Results for one request. Only the newest result is kept; an unread
+    # older one is replaced and counted as dropped. None means the camera
+    # returned no frame. A passive subscriber only watches, so the hub may
+    # read frames for it at a low rate.
+    def __init__(self, since):
+        self.since = since
+        self.passive = False
+        self.dropped = 0
+        self._queue = asyncio.Queue(maxsize=1)
+
+    def put(self, result):
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(result)
+
+    async def get(self, timeout):
+        # Raises asyncio.TimeoutError when nothing arrives in time
+        return await asyncio.wait_for(self._queue.get(), timeout)
+
+class CameraHub:
+    def __init__(self, name, source, analyzer, open_source):
+        # open_source(source) returns an opened capture or None; it blocks,
+        # so it runs on the hub's own thread
+        self.name = name
+        self.source = source
+        self.analyzer = analyzer
+        self.open_source = open_source
+        self.cap = None
+        self.subscribers = set()
+        self._reader = None
+        # Frames being analyzed; the loop only keeps weak references to tasks
+        self._analyzing = set()
+        self._thread = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix=f"camera-{name}")
+        self._sequence = 0
+        self._published = 0
+        self.frames_read = 0
+        self.frames_dropped = 0
+        self.read_failures = 0
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._thread, fn, *args)
+
+    async def open(self):
+        if self.cap is not None and self.cap.isOpened():
+            return False
+        # A replayed source loops so that every request gets frames
+        self.cap = await self._call(self.open_source, self.source)
+        if self.cap is None:
+            raise RuntimeError(f"Không thể mở camera {self.name}")
+        return True
+
+    async def warm_up(self):
+        # Open the camera and wait for its first frame, then let it idle
+        # until the first request
+        await self.open()
+        if self._reader is None or self._reader.done():
+            await self._call(self.cap.grab)
+            self.cap.pause()
+
+    async def subscribe(self):
+        await self.open()
+        subscription = Subscription(self._sequence)
+        self.subscribers.add(subscription)
+        if self._reader is None or self._reader.done():
+            self.cap.resume()
+            self._reader = asyncio.get_running_loop().create_task(self._read_loop())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        # The reader stops and pauses the camera once nobody is left
+        self.subscribers.discard(subscription)
+
+    def _publish(self, result, sequence):
+        for subscription in self.subscribers:
+            if sequence > subscription.since:
+                subscription.put(result)
+
+    async def _read_loop(self):
+        try:
+            while self.subscribers:
+                if all(subscription.passive for subscription in self.subscribers):
+                    await asyncio.sleep(PASSIVE_INTERVAL)
+                    if not self.subscribers:
+                        break
+                await self.analyzer.slots.acquire()
+                try:
+                    ret, frame = await self._call(self.cap.read)
+                except BaseException:
+                    self.analyzer.slots.release()
+                    raise
+                self._sequence += 1
+                if not ret or not self.subscribers:
+                    self.analyzer.slots.release()
+                    if not ret:
+                        self.read_failures += 1
+                        self._publish(None, self._sequence)
+                    continue
+                self.frames_read += 1
+                task = asyncio.get_running_loop().create_task(self._analyze(self._sequence, frame))
+                self._analyzing.add(task)
+                task.add_done_callback(self._analyzing.discard)
+        finally:
+            if self.cap is not None:
+                self.cap.pause()
+
+    async def _analyze(self, sequence, frame):
+        try:
+            face_locations, encodings, timings = await self.analyzer.analyze(frame)
+        except Exception as e:
+            print(f"Error while analyzing a frame from camera {self.name}: {e}")
+            self._publish(None, sequence)
+            return
+        finally:
+            self.analyzer.slots.release()
+        if sequence <= self._published:
+            # A newer frame finished first
+            self.frames_dropped += 1
+            return
+        self._published = sequence
+        self._publish(FrameResult(sequence, face_locations, encodings, timings), sequence)
+
+    def format_stats(self):
+        return (f"camera {self.name}: read {self.frames_read}, out of order {self.frames_dropped}, "
+                f"read failures {self.read_failures}, subscribers {len(self.subscribers)}")
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        for task in self._analyzing:
+            task.cancel()
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+        self._thread.shutdown(wait=False)
@@ -1,22 +1,97 @@
 #!/usr/bin/env python3
 import cv2
 import os
+import queue
+import threading
 import time
 import argparse
+from collections import Counter
 
-def collect_face_data(username, num_samples=40, output_dir="data"):
+from frame_source import DEFAULT_SOURCE, open_frame_source
+from sample_metadata import closest_box, write_sample_metadata
+from sample_quality import MAX_SIMILARITY, MIN_FACE_SIZE, MIN_SHARPNESS, PoseCoverage, SampleQuality
+
+# Seconds of collection after which a pose that could not be filled (the eye
+# cascade misses it, or the head does not turn that far) is given up
+TIME_LIMIT = 120
+
+# Context saved around each Haar box (fraction of the box size) so the
+# landmark model sees the whole chin and forehead during training
+CROP_MARGIN = 0.2
+
+def crop_with_margin(frame, x, y, w, h, margin=CROP_MARGIN):
+    # Returns the crop and the face location (top, right, bottom, left) inside it
+    frame_h, frame_w = frame.shape[:2]
+    x0 = max(0, x - int(w * margin))
+    y0 = max(0, y - int(h * margin))
+    x1 = min(frame_w, x + w + int(w * margin))
+    y1 = min(frame_h, y + h + int(h * margin))
+    return frame[y0:y1, x0:x1], (y - y0, x + w - x0, y + h - y0, x - x0)
+
+def hog_box(face_recognition, face_img, haar_location):
+    # (face_location, detector): the HOG box overlapping the Haar box, in
+    # the geometry dlib's landmark model and authentication use, or the Haar
+    # box itself if HOG finds nothing there
+    if face_recognition is not None:
+        rgb = cv2.cvtColor(face_img, cv2.COLOR_BGR2RGB)
+        box = closest_box(face_recognition.face_locations(rgb), haar_location)
+        if box is not None:
+            return box, "hog"
+    return haar_location, "haar"
+
+class SampleWriter:
+    # Encodes and writes samples on a background thread so that saving
+    # never stalls the preview
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="sample-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        # Loaded here so that the preview does not wait for dlib
+        try:
+            import face_recognition
+        except ImportError:
+            print("Không có face_recognition: lưu vị trí từ Haar cascade, train_model.py sẽ phát hiện lại bằng HOG")
+            face_recognition = None
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            img_path, face_img, face_location, source_box, frame_size = item
+            try:
+                cv2.imwrite(img_path, face_img)
+                # Lưu vị trí khuôn mặt để khi huấn luyện không cần phát hiện lại
+                face_location, detector = hog_box(face_recognition, face_img, face_location)
+                write_sample_metadata(img_path, face_location, detector, source_box, frame_size)
+            except Exception as e:
+                print(f"Lỗi khi lưu {img_path}: {e}")
+
+    def submit(self, img_path, face_img, face_location, source_box, frame_size):
+        self._queue.put((img_path, face_img, face_location, source_box, frame_size))
+
+    def close(self):
+        # Wait until everything submitted is on disk
+        self._queue.put(None)
+        self._thread.join()
+
+def collect_face_data(username, num_samples=40, output_dir="data", source=DEFAULT_SOURCE, per_pose=6,
+                      quality=None, time_limit=TIME_LIMIT):
     # Tạo thư mục cho người dùng
     user_dir = os.path.join(output_dir, username)
     os.makedirs(user_dir, exist_ok=True)
     
     # Khởi tạo camera
-    cap = cv2.VideoCapture(0)
+    cap = open_frame_source(source)
     if not cap.isOpened():
         print("Không thể mở camera!")
+        cap.release()
         return
     
     # Tải bộ nhận diện khuôn mặt
     face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    if quality is None:
+        quality = SampleQuality()
     
     count = 0
     print(f"Thu thập dữ liệu khuôn mặt cho {username}. Nhấn 's' để bắt đầu...")
@@ -39,38 +114,103 @@ def collect_face_data(username, num_samples=40, output_dir="data"):
     
     print("Bắt đầu thu thập dữ liệu...")
     
-    while count < num_samples:
-        ret, frame = cap.read()
-        if not ret:
-            print("Không thể đọc khung hình!")
-            break
-        
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, 1.3, 5)
-        
-        for (x, y, w, h) in faces:
-            cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
+    # Chỉ giữ các mẫu rõ nét, đủ lớn, nhìn thấy mắt và khác với các mẫu đã lưu;
+    # dừng khi đã đủ mẫu cho mọi hướng nhìn (không kiểm tra hướng nhìn: khi đủ num_samples),
+    # hoặc khi hết time_limit giây
+    if quality.check_pose:
+        coverage = PoseCoverage(per_pose)
+    else:
+        coverage = PoseCoverage(num_samples, ("center",))
+    writer = SampleWriter()
+    rejected = Counter()
+    status = ""
+    deadline = time.monotonic() + time_limit if time_limit > 0 else None
+    timed_out = False
+    try:
+        while count < num_samples and not coverage.complete():
+            if deadline is not None and time.monotonic() >= deadline:
+                timed_out = True
+                break
+            ret, frame = cap.read()
+            if not ret:
+                print("Không thể đọc khung hình!")
+                break
             
-            # Chỉ lưu hình ảnh khuôn mặt khi đã phát hiện
-            face_img = frame[y:y+h, x:x+w]
-            img_path = os.path.join(user_dir, f"{username}_{count}.jpg")
-            cv2.imwrite(img_path, face_img)
-            count += 1
-            print(f"Đã thu thập {count}/{num_samples} hình ảnh")
-            time.sleep(0.5)  # Nghỉ giữa các lần chụp
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            faces = face_cascade.detectMultiScale(gray, 1.3, 5)
             
-        cv2.imshow("Collect Face Data", frame)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
+            box_color = None
+            if len(faces):
+                # Chỉ lấy khuôn mặt lớn nhất: người đang đăng ký, không phải người phía sau
+                x, y, w, h = max(faces, key=lambda f: f[2] * f[3])
+                assessment = quality.assess(gray, x, y, w, h)
+                pose_bin = quality.pose_bin(assessment.pose)
+                if assessment.accepted and coverage.counts.get(pose_bin, 0) >= per_pose:
+                    assessment = assessment._replace(accepted=False, reason=f"đủ mẫu hướng {pose_bin}")
+                if assessment.accepted:
+                    face_img, face_location = crop_with_margin(frame, x, y, w, h)
+                    img_path = os.path.join(user_dir, f"{username}_{count}.jpg")
+                    # Ghi file ở luồng nền; bản sao vì khung hình sẽ bị vẽ đè
+                    writer.submit(img_path, face_img.copy(), face_location, (x, y, w, h),
+                                  (frame.shape[1], frame.shape[0]))
+                    quality.keep(assessment)
+                    coverage.add(pose_bin)
+                    count += 1
+                    status = f"Đã lưu ({pose_bin}, độ nét {assessment.sharpness:.0f})"
+                    print(f"Đã thu thập {count}/{num_samples} hình ảnh - {coverage.format()}")
+                    box_color = (0, 255, 0)
+                else:
+                    rejected[assessment.reason] += 1
+                    status = f"Bỏ qua: {assessment.reason}"
+                    box_color = (0, 0, 255)
+                
+                # Vẽ khung sau khi cắt ảnh để khung không lọt vào ảnh đã lưu
+                cv2.rectangle(frame, (x, y), (x+w, y+h), box_color, 2)
+            
+            missing = coverage.missing()
+            cv2.putText(frame, status, (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+            cv2.putText(frame, coverage.format(), (10, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+            if missing:
+                cv2.putText(frame, "Hay nhin: " + ", ".join(missing), (10, 75), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                            (0, 255, 255), 1)
+            cv2.imshow("Collect Face Data", frame)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    finally:
+        writer.close()
     
-    print(f"Đã thu thập đủ {count} hình ảnh khuôn mặt cho {username}")
+    if timed_out:
+        print(f"Hết thời gian ({time_limit:.0f} giây)")
+    print(f"Đã thu thập {count} hình ảnh khuôn mặt cho {username}")
+    print(f"Độ phủ hướng nhìn: {coverage.format()}")
+    missing = coverage.missing()
+    if missing and count < num_samples:
+        print(f"Còn thiếu hướng nhìn: {', '.join(missing)}; chạy lại để bổ sung hoặc dùng --no-pose")
+    if rejected:
+        print("Đã bỏ qua: " + ", ".join(f"{reason} {n}" for reason, n in rejected.most_common()))
+    print(f"Camera: {cap.format_stats()}")
     cap.release()
     cv2.destroyAllWindows()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Thu thập dữ liệu khuôn mặt")
     parser.add_argument("--username", required=True, help="Tên người dùng")
-    parser.add_argument("--samples", type=int, default=30, help="Số lượng mẫu cần thu thập")
+    parser.add_argument("--samples", type=int, default=30, help="Số lượng mẫu tối đa cần thu thập")
+    parser.add_argument("--per-pose", type=int, default=6,
+                        help="Số mẫu cho mỗi hướng nhìn (giữa, trái, phải, lên, xuống); dừng khi đủ")
+    parser.add_argument("--min-face-size", type=int, default=MIN_FACE_SIZE, help="Cạnh khuôn mặt nhỏ nhất (pixel)")
+    parser.add_argument("--min-sharpness", type=float, default=MIN_SHARPNESS,
+                        help="Độ nét tối thiểu (phương sai Laplacian)")
+    parser.add_argument("--max-similarity", type=float, default=MAX_SIMILARITY,
+                        help="Độ tương đồng tối đa với mẫu đã lưu (loại ảnh gần trùng lặp)")
+    parser.add_argument("--no-pose", action="store_true",
+                        help="Không kiểm tra hướng nhìn; chỉ cần đủ mẫu nhìn thẳng")
+    parser.add_argument("--time-limit", type=float, default=TIME_LIMIT,
+                        help="Dừng sau số giây này kể cả khi còn thiếu hướng nhìn (0: không giới hạn)")
+    parser.add_argument("--source", default=DEFAULT_SOURCE,
+                        help="Nguồn khung hình: chỉ số camera, file video hoặc thư mục ảnh (mặc định: CAMERA_INDEX hoặc 0)")
     args = parser.parse_args()
     
-    collect_face_data(args.username, args.samples)
+    quality = SampleQuality(args.min_face_size, args.min_sharpness, args.max_similarity, not args.no_pose)
+    collect_face_data(args.username, args.samples, source=args.source, per_pose=args.per_pose, quality=quality,
+                      time_limit=args.time_limit)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# Convert a pickled model (clf, face_encodings, face_names[, metadata]) written
+# by train_model.py into the memory-mappable .fam format.
+import argparse
+import os
+import sys
+
+from embedding_index import EmbeddingIndex
+from model_format import MODEL_EXTENSION, load_pickled_model, save_model
+
+def convert_model(input_path, output_path=None):
+    if output_path is None:
+        output_path = os.path.splitext(input_path)[0] + MODEL_EXTENSION
+
+    clf, face_encodings, face_names, metadata = load_pickled_model(input_path)
+
+    if isinstance(clf, EmbeddingIndex):
+        index = clf
+    else:
+        # The .fam format stores the enrolled samples, not the fitted
+        # classifier; face_auth.py matches against them directly
+        print(f"Bộ phân loại {type(clf).__name__} không được chuyển đổi; chỉ lưu các mẫu khuôn mặt")
+        index = EmbeddingIndex.from_samples(face_encodings, face_names)
+
+    # Scores change with the classifier, so a calibrated threshold is dropped
+    metadata = {key: value for key, value in metadata.items() if key != "calibration"}
+    save_model(output_path, index, {**metadata, "source": os.path.basename(input_path)})
+    print(f"Đã chuyển đổi {input_path} -> {output_path}")
+    print(f"Số lượng người dùng: {len(index.users)}, tổng số mẫu: {len(index)}")
+    return output_path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chuyển đổi mô hình .pkl sang định dạng .fam")
+    parser.add_argument("input", help="Đường dẫn file .pkl")
+    parser.add_argument("--output", default=None, help="Đường dẫn file .fam (mặc định: cùng tên với .fam)")
+    args = parser.parse_args()
+
+    try:
+        convert_model(args.input, args.output)
+    except Exception as e:
+        print(f"Lỗi khi chuyển đổi mô hình: {e}")
+        sys.exit(1)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# Streaming image loader for train_model.py.
+#
+# Enrollment images are read and decoded on a small thread pool (file reads
+# and cv2.imdecode release the GIL) up to `depth` images ahead of the
+# encoder, so encoding never waits on the disk or the JPEG decoder. Each
+# image is cut down to the face region, the known box from the sidecar plus
+# the same margin face_pipeline.py uses at login, or the whole image when
+# the box is unknown. The region is scaled to fit crop_size and written into
+# one of `depth` preallocated buffers. Samples come out in input order; the
+# consumer hands each buffer back with release() once it is done with it.
+import os
+import queue
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from face_pipeline import CROP_MARGIN
+from frame_source import IMAGE_EXTENSIONS
+
+CROP_SIZE = 256
+PREFETCH_DEPTH = 32
+LOADER_THREADS = 4
+
+# image is a view of the sample's buffer; location is the known face box
+# inside it, or None when the face still has to be detected. A box found in
+# the buffer maps back to the original image as box / scale + origin.
+Sample = namedtuple("Sample", "index image location scale origin slot error seconds")
+
+def scan_training_images(data_dir, users=None):
+    # (user, img_path) for every image in data_dir/<user>/, in name order
+    images = []
+    with os.scandir(data_dir) as entries:
+        user_dirs = sorted(entry.name for entry in entries if entry.is_dir()
+                           and (users is None or entry.name in users))
+    for user_dir in user_dirs:
+        print(f"Đang xử lý dữ liệu cho người dùng: {user_dir}")
+        with os.scandir(os.path.join(data_dir, user_dir)) as entries:
+            files = sorted(entry.path for entry in entries
+                           if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS))
+        images.extend((user_dir, path) for path in files)
+    return images
+
+def decode_image(path):
+    # RGB image as stored, like face_recognition.load_image_file: the EXIF
+    # orientation is ignored so that sidecar boxes keep matching
+    data = np.fromfile(path, dtype=np.uint8)
+    image = cv2.imdecode(data, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is None:
+        raise ValueError(f"không thể giải mã ảnh {path}")
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+def face_region(image_shape, face_location):
+    # (top, right, bottom, left) of the box plus CROP_MARGIN, inside the image
+    height, width = image_shape[:2]
+    top, right, bottom, left = face_location
+    margin_y = int((bottom - top) * CROP_MARGIN)
+    margin_x = int((right - left) * CROP_MARGIN)
+    return (max(0, top - margin_y), min(width, right + margin_x),
+            min(height, bottom + margin_y), max(0, left - margin_x))
+
+def normalize_crop(image, region, out):
+    # Copy region of image into the top-left corner of out, scaled down to
+    # fit if needed, and zero the rest; returns the scale
+    top, right, bottom, left = region
+    crop = image[top:bottom, left:right]
+    size = out.shape[0]
+    scale = min(1.0, size / max(crop.shape[:2]))
+    if scale < 1.0:
+        height = min(size, int(round(crop.shape[0] * scale)))
+        width = min(size, int(round(crop.shape[1] * scale)))
+        cv2.resize(crop, (width, height), dst=out[:height, :width], interpolation=cv2.INTER_AREA)
+    else:
+        height, width = crop.shape[:2]
+        out[:height, :width] = crop
+    out[height:] = 0
+    out[:height, width:] = 0
+    return scale
+
+class DatasetLoader:
+    def __init__(self, tasks, threads=LOADER_THREADS, depth=PREFETCH_DEPTH, crop_size=CROP_SIZE):
+        # tasks are (img_path, face_location or None)
+        self.tasks = tasks
+        self.threads = threads
+        self.depth = depth
+        self.buffers = np.zeros((depth, crop_size, crop_size, 3), dtype=np.uint8)
+        self._free = queue.Queue()
+        for slot in range(depth):
+            self._free.put(slot)
+
+    def release(self, slot):
+        self._free.put(slot)
+
+    def _load(self, index, path, face_location, slot):
+        start = time.perf_counter()
+        try:
+            image = decode_image(path)
+            if face_location is None:
+                region = (0, image.shape[1], image.shape[0], 0)
+            else:
+                region = face_region(image.shape, face_location)
+            out = self.buffers[slot]
+            scale = normalize_crop(image, region, out)
+        except Exception as e:
+            return Sample(index, None, None, 1.0, (0, 0), slot, str(e), time.perf_counter() - start)
+        origin = (region[0], region[3])
+        location = None
+        if face_location is not None:
+            top, right, bottom, left = face_location
+            location = tuple(int(round(v)) for v in ((top - origin[0]) * scale, (right - origin[1]) * scale,
+                                                      (bottom - origin[0]) * scale, (left - origin[1]) * scale))
+        return Sample(index, out, location, scale, origin, slot, None, time.perf_counter() - start)
+
+    def __iter__(self):
+        pending = deque()
+        tasks = iter(enumerate(self.tasks))
+        next_task = next(tasks, None)
+        with ThreadPoolExecutor(self.threads, thread_name_prefix="dataset-loader") as pool:
+            while pending or next_task is not None:
+                # Buffers are claimed in input order, so the image the
+                # consumer waits for always has one
+                while next_task is not None:
+                    try:
+                        slot = self._free.get_nowait()
+                    except queue.Empty:
+                        break
+                    index, (path, face_location) = next_task
+                    pending.append(pool.submit(self._load, index, path, face_location, slot))
+                    next_task = next(tasks, None)
+                if not pending:
+                    # Every buffer is still held by the consumer
+                    self._free.put(self._free.get())
+                    continue
+                yield pending.popleft().result()
+
+def to_image_location(box, scale, origin):
+    # Box found in a sample buffer, in the coordinates of the original image
+    top, right, bottom, left = box
+    return (int(round(top / scale)) + origin[0], int(round(right / scale)) + origin[1],
+            int(round(bottom / scale)) + origin[0], int(round(left / scale)) + origin[1])
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# Sequential decision policies for authenticate_face.
+#
+# The authentication loop feeds one observation per processed frame into a
+# DecisionEngine, which asks its policy whether a verdict can already be
+# reached. Policies accept as soon as the evidence is sufficient and reject
+# as soon as acceptance has become impossible with the frames that are left,
+# so a clear match (or a clear stranger) no longer waits for all frames.
+import math
+import time
+from collections import namedtuple
+
+# Share of max_frames that must match when required_matches is not given
+MAJORITY_FRACTION = 0.6
+
+SUCCESS = "success"
+FAILURE = "failure"
+NOT_RECOGNIZED = "not_recognized"
+
+Decision = namedtuple("Decision", ["result", "reason", "frames", "elapsed"])
+
+class MajorityVotePolicy:
+    # The original rule: at least `required_matches` of `max_frames` frames
+    # must match (by default 60%, i.e. 6 of 10); `no_face_limit` frames
+    # without a face means "not recognized".
+    def __init__(self, max_frames=10, required_matches=None, no_face_limit=7):
+        if required_matches is None:
+            required_matches = math.ceil(MAJORITY_FRACTION * max_frames)
+        if not 1 <= required_matches <= max_frames:
+            raise ValueError(f"required_matches must be between 1 and max_frames ({max_frames}), "
+                             f"got {required_matches}")
+        self.max_frames = max_frames
+        self.required_matches = required_matches
+        self.no_face_limit = no_face_limit
+        self.reset()
+
+    def reset(self):
+        self.frames = 0
+        self.matches = 0
+        self.no_face = 0
+        self.streak = 0
+
+    @property
+    def remaining(self):
+        return self.max_frames - self.frames
+
+    def observe(self, face_found, matched, confidence=None):
+        self.frames += 1
+        if not face_found:
+            self.no_face += 1
+            self.streak = 0
+        elif matched:
+            self.matches += 1
+            self.streak += 1
+        else:
+            self.streak = 0
+        return self.verdict()
+
+    def can_still_accept(self):
+        return self.matches + self.remaining >= self.required_matches
+
+    def verdict(self):
+        if self.matches >= self.required_matches:
+            return SUCCESS, f"{self.matches}/{self.frames} frames matched"
+        if self.no_face >= self.no_face_limit:
+            return NOT_RECOGNIZED, f"no face in {self.no_face}/{self.frames} frames"
+        if not self.can_still_accept():
+            return self.rejection(f"only {self.matches}/{self.frames} frames matched")
+        return None
+
+    def rejection(self, reason):
+        # Most frames without a face reads as "not recognized" in the UI
+        if self.no_face * 2 > self.frames:
+            return NOT_RECOGNIZED, reason
+        return FAILURE, reason
+
+class ConsecutiveMatchPolicy(MajorityVotePolicy):
+    # Additionally accepts after `required_consecutive` back-to-back matches
+    # whose confidence reaches `strong_cutoff`. Weaker matches still count
+    # towards the majority rule but break the streak. strong_confidence is
+    # the cutoff asked for; when it is None, the caller sets strong_cutoff
+    # once the scale of the scores is known, and until then no match is
+    # strong.
+    def __init__(self, max_frames=10, required_matches=None, no_face_limit=7,
+                 required_consecutive=3, strong_confidence=None):
+        self.required_consecutive = required_consecutive
+        self.strong_confidence = strong_confidence
+        self.strong_cutoff = strong_confidence
+        super().__init__(max_frames, required_matches, no_face_limit)
+
+    def observe(self, face_found, matched, confidence=None):
+        strong = (matched and confidence is not None and self.strong_cutoff is not None
+                  and confidence >= self.strong_cutoff)
+        self.frames += 1
+        if not face_found:
+            self.no_face += 1
+        elif matched:
+            self.matches += 1
+        self.streak = self.streak + 1 if strong else 0
+        return self.verdict()
+
+    def can_still_accept(self):
+        return (super().can_still_accept()
+                or self.streak + self.remaining >= self.required_consecutive)
+
+    def verdict(self):
+        if self.streak >= self.required_consecutive:
+            return SUCCESS, f"{self.streak} consecutive strong matches"
+        return super().verdict()
+
+POLICIES = {
+    "majority": MajorityVotePolicy,
+    "consecutive": ConsecutiveMatchPolicy,
+}
+
+class DecisionEngine:
+    # Wraps a policy with a wall-clock budget and time-to-decision reporting.
+    def __init__(self, policy, time_budget=None):
+        self.policy = policy
+        self.time_budget = time_budget
+        self.start_time = None
+
+    def start(self):
+        self.policy.reset()
+        self.skipped = 0
+        self.start_time = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.start_time
+
+    def _decision(self, verdict):
+        result, reason = verdict
+        return Decision(result, reason, self.policy.frames, self.elapsed)
+
+    def observe(self, face_found, matched, confidence=None):
+        verdict = self.policy.observe(face_found, matched, confidence)
+        if verdict is not None:
+            return self._decision(verdict)
+        return self.check_budget()
+
+    def skip(self):
+        # A frame that could not be read does not count as an attempt, but
+        # the clock keeps running
+        self.skipped += 1
+        if self.skipped >= self.policy.max_frames:
+            return self._decision((FAILURE, f"camera returned no frame {self.skipped} times"))
+        return self.check_budget()
+
+    def check_budget(self):
+        if self.time_budget is not None and self.elapsed >= self.time_budget:
+            return self._decision(self.policy.rejection(f"time budget of {self.time_budget:.1f}s exceeded"))
+        return None
+
+def create_engine(policy_name="consecutive", time_budget=None, **policy_args):
+    return DecisionEngine(POLICIES[policy_name](**policy_args), time_budget)
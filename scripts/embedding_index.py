@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# Embedding-index matcher: every enrolled 128-d encoding lives in one
+# contiguous float32 matrix, with each user's samples stored as a contiguous
+# row range. A query is matched against everybody with a single batched
+# distance computation, and users can be added or removed without fitting
+# anything.
+#
+# It exposes the same classes_/predict_proba interface as the sklearn
+# classifiers so face_auth.py can use it unchanged. Scores are 1 / (1 + d)
+# for the nearest sample of each user, the same scale as the single-user
+# model. Without a calibrated threshold, face_auth.py accepts scores of at
+# least DISTANCE_THRESHOLD, i.e. d <= 0.6, face_recognition's own tolerance
+# for "same person"; the classifier default of 0.6 would allow d <= 0.67.
+#
+# Large galleries are matched coarse to fine: every user is summarized by a
+# few prototypes (the centroid, or medoids of their samples), a query is
+# first compared with the prototypes only, and just the `shortlist` nearest
+# users are then compared sample by sample. Users outside the shortlist
+# score 0; galleries of up to COARSE_MIN_USERS users are scanned in full.
+# user_scores() is the 1:1 path for a claimed identity and reads the
+# claimed user's rows only.
+import numpy as np
+
+EMBEDDING_DIM = 128
+PROTOTYPES_PER_USER = 1
+SHORTLIST = 3
+# Below this many users a single pass over all samples is faster
+COARSE_MIN_USERS = 100
+MEDOID_ITERATIONS = 10
+DISTANCE_TOLERANCE = 0.6
+DISTANCE_THRESHOLD = 1.0 / (1.0 + DISTANCE_TOLERANCE)
+# A strong match (for the consecutive policy) lies within this fraction of
+# the threshold distance: d <= 0.45 for the default tolerance
+STRONG_DISTANCE_FRACTION = 0.75
+
+def strong_score(threshold):
+    # Score of a strong match for a threshold on the 1 / (1 + d) scale
+    if threshold <= 0:
+        return 0.0
+    return 1.0 / (1.0 + STRONG_DISTANCE_FRACTION * (1.0 / threshold - 1.0))
+
+def squared_norms(embeddings):
+    return np.einsum("ij,ij->i", embeddings, embeddings)
+
+def pairwise_distances(queries, embeddings, sq_norms):
+    # ||q - e||^2 = ||q||^2 + ||e||^2 - 2 q.e for all pairs in one product
+    queries = np.asarray(queries, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+    sq = squared_norms(queries)[:, None] + sq_norms[None, :] - 2.0 * (queries @ embeddings.T)
+    return np.sqrt(np.maximum(sq, 0.0))
+
+def user_prototypes(samples, k=PROTOTYPES_PER_USER):
+    # The centroid for k=1, otherwise k medoids (actual samples) found with
+    # a few rounds of k-medoids started from farthest-point seeds
+    samples = np.asarray(samples, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+    if k <= 1:
+        return samples.mean(axis=0, keepdims=True)
+    if len(samples) <= k:
+        return samples.copy()
+    sq_norms = squared_norms(samples)
+    distances = pairwise_distances(samples, samples, sq_norms)
+    medoids = [int(np.argmin(distances.sum(axis=1)))]
+    while len(medoids) < k:
+        medoids.append(int(np.argmax(distances[:, medoids].min(axis=1))))
+    for _ in range(MEDOID_ITERATIONS):
+        assignment = np.argmin(distances[:, medoids], axis=1)
+        updated = []
+        for cluster, medoid in enumerate(medoids):
+            members = np.flatnonzero(assignment == cluster)
+            if len(members) == 0:
+                updated.append(medoid)
+                continue
+            within = distances[np.ix_(members, members)].sum(axis=1)
+            updated.append(int(members[np.argmin(within)]))
+        if updated == medoids:
+            break
+        medoids = updated
+    return samples[medoids]
+
+def prune_outliers(encodings, names, max_deviation=3.0, min_samples=4):
+    # Drop enrollment samples that lie unusually far from their user's
+    # centroid (blurred, badly lit or mislabeled images). Distances more
+    # than max_deviation robust standard deviations (MAD) above the median
+    # are outliers. Returns (encodings, names, number of samples removed).
+    encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+    names = np.asarray(names)
+    keep = np.ones(len(encodings), dtype=bool)
+    for user in set(names.tolist()):
+        rows = np.flatnonzero(names == user)
+        if len(rows) < min_samples:
+            continue
+        samples = encodings[rows]
+        centroid = samples.mean(axis=0)
+        distances = np.linalg.norm(samples - centroid, axis=1)
+        median = np.median(distances)
+        spread = 1.4826 * np.median(np.abs(distances - median))
+        if spread == 0:
+            continue
+        keep[rows[distances > median + max_deviation * spread]] = False
+    return list(encodings[keep]), names[keep].tolist(), int((~keep).sum())
+
+class EmbeddingIndex:
+    default_threshold = DISTANCE_THRESHOLD
+
+    def __init__(self, embeddings=None, users=None, counts=None, sq_norms=None,
+                 prototypes=None, prototype_counts=None, prototypes_per_user=PROTOTYPES_PER_USER,
+                 shortlist=SHORTLIST):
+        if embeddings is None:
+            embeddings = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        self.embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        self.users = list(users or [])
+        self.counts = np.asarray(counts if counts is not None else [], dtype=np.int64)
+        if len(self.users) != len(self.counts) or self.counts.sum() != len(self.embeddings):
+            raise ValueError("users, counts and embeddings do not match")
+        self.prototypes_per_user = prototypes_per_user
+        self.shortlist = shortlist
+        # A memory-mapped model file supplies precomputed norms and
+        # prototypes so that loading does not have to touch every row
+        self._update_derived(sq_norms)
+        if prototypes is not None:
+            self._set_prototypes(prototypes, prototype_counts)
+
+    @classmethod
+    def from_samples(cls, encodings, names, prototypes_per_user=PROTOTYPES_PER_USER):
+        # Group samples per user so each user occupies one row range
+        users = sorted(set(names))
+        names = np.asarray(names)
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        blocks = [encodings[names == user] for user in users]
+        embeddings = np.concatenate(blocks) if blocks else None
+        return cls(embeddings, users, [len(block) for block in blocks], prototypes_per_user=prototypes_per_user)
+
+    def _update_derived(self, sq_norms=None):
+        self.starts = np.concatenate(([0], np.cumsum(self.counts)[:-1])).astype(np.int64)
+        if sq_norms is None:
+            sq_norms = squared_norms(self.embeddings)
+        self.sq_norms = sq_norms
+        self.classes_ = np.array(self.users)
+        # Rebuilt on first use after the samples change
+        self._prototypes = None
+
+    def _set_prototypes(self, prototypes, prototype_counts):
+        prototype_counts = np.asarray(prototype_counts, dtype=np.int64)
+        if len(prototype_counts) != len(self.users) or prototype_counts.sum() != len(prototypes):
+            raise ValueError("prototypes do not match the users")
+        prototypes = np.asarray(prototypes, dtype=np.float32)
+        starts = np.concatenate(([0], np.cumsum(prototype_counts)[:-1])).astype(np.int64)
+        self._prototypes = (prototypes, prototype_counts, starts, squared_norms(prototypes))
+
+    def prototypes(self):
+        # (prototypes, prototypes per user), grouped per user like the samples
+        if self._prototypes is None:
+            blocks = [user_prototypes(self.embeddings[self.user_rows(user)], self.prototypes_per_user)
+                      for user in self.users]
+            prototypes = np.concatenate(blocks) if blocks else np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+            self._set_prototypes(prototypes, [len(block) for block in blocks])
+        return self._prototypes[0], self._prototypes[1]
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def __getstate__(self):
+        # Norms are cheap to rebuild; keep the pickle small. Prototypes are
+        # kept so that they are computed once, at training time.
+        prototypes, prototype_counts = self.prototypes()
+        return {"embeddings": self.embeddings, "users": self.users, "counts": self.counts,
+                "prototypes": prototypes, "prototype_counts": prototype_counts,
+                "prototypes_per_user": self.prototypes_per_user, "shortlist": self.shortlist}
+
+    def __setstate__(self, state):
+        self.embeddings = state["embeddings"]
+        self.users = state["users"]
+        self.counts = state["counts"]
+        self.prototypes_per_user = state.get("prototypes_per_user", PROTOTYPES_PER_USER)
+        self.shortlist = state.get("shortlist", SHORTLIST)
+        self._update_derived()
+        if state.get("prototypes") is not None:
+            self._set_prototypes(state["prototypes"], state["prototype_counts"])
+
+    def user_rows(self, user):
+        i = self.users.index(user)
+        return slice(int(self.starts[i]), int(self.starts[i] + self.counts[i]))
+
+    def add_user(self, user, encodings):
+        # Replaces the user's samples if they are already enrolled
+        if user in self.users:
+            self.remove_user(user)
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        if len(encodings) == 0:
+            raise ValueError(f"no encodings for user {user}")
+        self.embeddings = np.concatenate((self.embeddings, encodings))
+        self.users.append(user)
+        self.counts = np.append(self.counts, len(encodings))
+        self._update_derived()
+
+    def remove_user(self, user):
+        rows = self.user_rows(user)
+        i = self.users.index(user)
+        self.embeddings = np.ascontiguousarray(np.delete(self.embeddings, rows, axis=0))
+        del self.users[i]
+        self.counts = np.delete(self.counts, i)
+        self._update_derived()
+
+    def distances(self, queries):
+        return pairwise_distances(queries, self.embeddings, self.sq_norms)
+
+    def user_distances(self, queries):
+        # Distance from each query to the nearest sample of every user; in a
+        # large gallery, users that the prototypes rule out are left at infinity
+        if not self.users:
+            return np.empty((len(np.atleast_2d(queries)), 0), dtype=np.float32)
+        if self.shortlist and len(self.users) > max(self.shortlist, COARSE_MIN_USERS):
+            return self._shortlist_distances(queries)
+        return np.minimum.reduceat(self.distances(queries), self.starts, axis=1)
+
+    def _shortlist_distances(self, queries):
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        self.prototypes()
+        prototypes, _, prototype_starts, prototype_sq_norms = self._prototypes
+        coarse = np.minimum.reduceat(pairwise_distances(queries, prototypes, prototype_sq_norms),
+                                     prototype_starts, axis=1)
+        candidates = np.argpartition(coarse, self.shortlist - 1, axis=1)[:, :self.shortlist]
+        result = np.full(coarse.shape, np.inf, dtype=np.float32)
+        for user in np.unique(candidates):
+            wanted = np.flatnonzero((candidates == user).any(axis=1))
+            rows = slice(int(self.starts[user]), int(self.starts[user] + self.counts[user]))
+            result[wanted, user] = pairwise_distances(queries[wanted], self.embeddings[rows],
+                                                      self.sq_norms[rows]).min(axis=1)
+        return result
+
+    def predict_proba(self, queries):
+        return 1.0 / (1.0 + self.user_distances(queries))
+
+    def user_scores(self, queries, user):
+        # 1:1 verification: 1 / (1 + d) to the nearest sample of user, using
+        # only that user's rows; 0 for a user who is not enrolled
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        if user not in self.users:
+            return np.zeros(len(queries))
+        rows = self.user_rows(user)
+        distances = pairwise_distances(queries, self.embeddings[rows], self.sq_norms[rows])
+        return 1.0 / (1.0 + distances.min(axis=1))
+
+    def predict(self, queries):
+        return self.classes_[np.argmin(self.user_distances(queries), axis=1)]
+
+class ClaimVerifier:
+    # Wraps an index for --matcher verify: face_auth.py scores every face
+    # against the claimed user only (index.user_scores) and never looks at
+    # other users' samples. predict_proba still identifies, for callers
+    # that have no claimed user.
+    default_threshold = DISTANCE_THRESHOLD
+
+    def __init__(self, index):
+        self.index = index
+        self.classes_ = index.classes_
+
+    def verify(self, queries, user):
+        return self.index.user_scores(queries, user)
+
+    def predict_proba(self, queries):
+        return self.index.predict_proba(queries)
+
+SCORING_MODES = ("topk", "centroid")
+# How face_auth.py scores faces: the classifier stored in the model, the
+# embedding index over its samples, or 1:1 against the claimed user only
+MATCHERS = ("model", "index", "verify")
+
+class SingleUserModel:
+    # Gallery scorer used when only one user is enrolled (an SVM needs two
+    # classes). A query scores the mean 1 / (1 + d) over its top_k nearest
+    # samples, or 1 / (1 + d) to the mean encoding with scoring="centroid",
+    # so a few poor enrollment images cannot drag the score of a genuine
+    # match down the way averaging over the whole gallery did. Being
+    # distance based, it defaults to the same threshold as the index.
+    default_threshold = DISTANCE_THRESHOLD
+
+    def __init__(self, encodings, user, top_k=3, scoring="topk"):
+        if scoring not in SCORING_MODES:
+            raise ValueError(f"scoring must be one of {SCORING_MODES}, got {scoring!r}")
+        if top_k < 1:
+            raise ValueError(f"top_k must be at least 1, got {top_k}")
+        self.encodings = np.ascontiguousarray(encodings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        if len(self.encodings) == 0:
+            raise ValueError(f"no encodings for user {user}")
+        self.user = user
+        self.top_k = top_k
+        self.scoring = scoring
+        self._update_derived()
+
+    def _update_derived(self):
+        self.classes_ = np.array([self.user])
+        self.sq_norms = squared_norms(self.encodings)
+        self.centroid = self.encodings.mean(axis=0, keepdims=True)
+        self.centroid_sq_norm = squared_norms(self.centroid)
+
+    def __getstate__(self):
+        return {"encodings": self.encodings, "user": self.user, "top_k": self.top_k, "scoring": self.scoring}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._update_derived()
+
+    def predict_proba(self, queries):
+        # Shape (n_queries, 1), like a classifier with a single class
+        if self.scoring == "centroid":
+            distances = pairwise_distances(queries, self.centroid, self.centroid_sq_norm)
+            return 1.0 / (1.0 + distances)
+        distances = pairwise_distances(queries, self.encodings, self.sq_norms)
+        k = min(self.top_k, distances.shape[1])
+        nearest = np.partition(distances, k - 1, axis=1)[:, :k]
+        return np.mean(1.0 / (1.0 + nearest), axis=1, keepdims=True)
+
+    def predict(self, queries):
+        return np.repeat(self.classes_, len(np.atleast_2d(queries)))
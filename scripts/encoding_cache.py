@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# On-disk cache of face encodings for train_model.py.
+#
+# Entries are keyed by the SHA-1 of the image bytes, so renamed or copied
+# files still hit, and edited files miss. Each entry stores the 128-d
+# encoding and the face box (or None when no face was found, so images
+# without a usable face are not re-detected every run either). The whole
+# cache is discarded when the dlib model files change.
+import hashlib
+import os
+import pickle
+
+import numpy as np
+
+CACHE_VERSION = 1
+CACHE_FILENAME = "encoding_cache.pkl"
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def model_signature(extra=""):
+    # Identify the dlib models by path, size and mtime; hashing ~100 MB of
+    # model weights on every run would cost more than it saves
+    import face_recognition_models
+
+    parts = [extra]
+    for locate in (face_recognition_models.pose_predictor_model_location,
+                   face_recognition_models.pose_predictor_five_point_model_location,
+                   face_recognition_models.face_recognition_model_location,
+                   face_recognition_models.cnn_face_detector_model_location):
+        path = locate()
+        try:
+            st = os.stat(path)
+            parts.append(f"{path}:{st.st_size}:{int(st.st_mtime)}")
+        except OSError:
+            parts.append(f"{path}:missing")
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+class EncodingCache:
+    def __init__(self, path, signature=""):
+        self.path = path
+        self.signature = signature
+        self.entries = {}
+        self.used = set()
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = False
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                data = pickle.load(f)
+        except Exception as e:
+            print(f"Bỏ qua cache mã hóa bị hỏng {self.path}: {e}")
+            return
+        if data.get("version") != CACHE_VERSION or data.get("signature") != self.signature:
+            # Different encoder: every cached vector is suspect
+            self.invalidated = True
+            return
+        self.entries = data.get("entries", {})
+
+    def get(self, key):
+        # Returns (encoding, box) or None on a miss; encoding is None for
+        # images in which no face was found
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.used.add(key)
+        return entry
+
+    def put(self, key, encoding, box):
+        if encoding is not None:
+            encoding = np.asarray(encoding, dtype=np.float64)
+        self.entries[key] = (encoding, tuple(box) if box is not None else None)
+        self.used.add(key)
+
+    def save(self, prune=True):
+        # Keep only entries for images seen in this run so the file does not
+        # grow forever (a run that only saw some users, like enrollment,
+        # passes prune=False); write atomically so an interrupted run cannot
+        # corrupt it
+        entries = {k: v for k, v in self.entries.items() if not prune or k in self.used}
+        cache_dir = os.path.dirname(self.path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"version": CACHE_VERSION, "signature": self.signature, "entries": entries}, f)
+        os.replace(tmp_path, self.path)
+
+    def summary(self):
+        text = f"Cache mã hóa: {self.hits} hit, {self.misses} miss"
+        if self.invalidated:
+            text += " (cache cũ đã bị vô hiệu do model dlib thay đổi)"
+        return text
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# Incremental enrollment: add, replace or remove one user in an existing
+# model without re-encoding everybody else.
+#
+# Only the enrolled user's images are encoded (through the same encoding
+# cache as train_model.py). The rest of the model is reused as stored:
+#   .fam / embedding index   the user's rows are appended or deleted,
+#                            nothing is fitted
+#   pickled SVM/KNN          refitted on the stored encodings, which takes
+#                            milliseconds; no image is touched
+#   single-user model        rebuilt from the stored encodings (it becomes
+#                            an SVM once a second user is enrolled)
+# The model file is replaced atomically, so a running service picks up the
+# new version on its next request.
+import argparse
+import os
+import sys
+
+from embedding_index import EmbeddingIndex, SingleUserModel
+from metrics import METRICS_PATH, Metrics
+from model_format import build_classifier, load_trained_model, save_trained_model
+
+def refit(clf, face_encodings, face_names):
+    # Rebuild the classifier kind stored in the model from the stored samples
+    if isinstance(clf, EmbeddingIndex):
+        return clf
+    if isinstance(clf, SingleUserModel):
+        return build_classifier(face_encodings, face_names, "svm", clf.top_k, clf.scoring)
+    return build_classifier(face_encodings, face_names, "svm")
+
+def update_model(model_path, user, encodings=None, metrics=None):
+    # encodings=None removes the user; otherwise the user's samples are
+    # replaced by encodings
+    if metrics is None:
+        metrics = Metrics()
+    with metrics.time("model_load"):
+        clf, face_encodings, face_names, metadata, extra = load_trained_model(model_path)
+
+    users = clf.users if isinstance(clf, EmbeddingIndex) else sorted(set(face_names))
+    if encodings is None and user not in users:
+        raise ValueError(f"người dùng {user} không có trong mô hình")
+    if encodings is None and len(users) == 1:
+        raise ValueError("không thể xóa người dùng cuối cùng của mô hình")
+
+    with metrics.time("fit"):
+        if face_names is not None:
+            keep = [i for i, name in enumerate(face_names) if name != user]
+            face_encodings = [face_encodings[i] for i in keep] + list(encodings or [])
+            face_names = [face_names[i] for i in keep] + [user] * len(encodings or [])
+        if isinstance(clf, EmbeddingIndex):
+            if encodings is None:
+                clf.remove_user(user)
+            else:
+                clf.add_user(user, encodings)
+        else:
+            clf = refit(clf, face_encodings, face_names)
+
+    if metadata and metadata.pop("calibration", None) is not None:
+        print("Ngưỡng đã hiệu chỉnh không còn đúng với mô hình mới và đã bị xóa, hãy chạy lại calibrate.py")
+    with metrics.time("save"):
+        save_trained_model(model_path, clf, face_encodings, face_names, metadata, extra)
+    return clf
+
+def enroll_user(user, model_path, data_dir="data", cache_path="", use_cache=True, workers=1,
+                assume_cropped=False, metrics=None):
+    if metrics is None:
+        metrics = Metrics()
+    if not os.path.exists(model_path):
+        print(f"Model {model_path} không tồn tại, hãy chạy train_model.py trước")
+        return False
+    # Only enrolling encodes images; train_model pulls in face_recognition
+    # (and its import-time checks), which remove and list do not need
+    from train_model import encode_training_images, list_training_images, open_encoding_cache
+
+    images = list_training_images(data_dir, users={user})
+    if not images:
+        print(f"Không có ảnh nào của {user} trong {data_dir}")
+        return False
+    metrics.count("images", len(images))
+
+    cache = open_encoding_cache(model_path, cache_path) if use_cache else None
+    encodings, _ = encode_training_images(images, cache, workers, assume_cropped, metrics)
+    if cache is not None:
+        # Other users' entries were not looked at; keep them
+        cache.save(prune=False)
+        print(cache.summary())
+    if not encodings:
+        print(f"Không tìm thấy khuôn mặt nào trong ảnh của {user}")
+        metrics.flush(result="failure", reason="no faces", user=user)
+        return False
+
+    clf = update_model(model_path, user, encodings, metrics)
+    print(f"Đã thêm {user} ({len(encodings)} mẫu) vào {model_path} [{type(clf).__name__}]")
+    metrics.count("faces", len(encodings))
+    metrics.flush(result="success", action="enroll", user=user)
+    return True
+
+def remove_user(user, model_path, metrics=None):
+    if metrics is None:
+        metrics = Metrics()
+    clf = update_model(model_path, user, None, metrics)
+    print(f"Đã xóa {user} khỏi {model_path} [{type(clf).__name__}]")
+    metrics.flush(result="success", action="remove", user=user)
+    return True
+
+def list_users(model_path):
+    clf, _, face_names, _, _ = load_trained_model(model_path)
+    if isinstance(clf, EmbeddingIndex):
+        return list(zip(clf.users, (int(n) for n in clf.counts)))
+    return [(user, face_names.count(user)) for user in sorted(set(face_names))]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Thêm hoặc xóa một người dùng mà không huấn luyện lại toàn bộ")
+    parser.add_argument("command", choices=["enroll", "remove", "list"])
+    parser.add_argument("username", nargs="?", help="Tên người dùng (thư mục trong --data-dir)")
+    parser.add_argument("--model", default="models/face_auth_model.pkl", help="Đường dẫn mô hình (.pkl hoặc .fam)")
+    parser.add_argument("--data-dir", default="data", help="Đường dẫn đến thư mục dữ liệu")
+    parser.add_argument("--cache", default="", help="Đường dẫn cache mã hóa (mặc định: encoding_cache.pkl cạnh mô hình)")
+    parser.add_argument("--no-cache", action="store_true", help="Mã hóa lại tất cả ảnh, không dùng cache")
+    parser.add_argument("--workers", type=int, default=1, help="Số tiến trình mã hóa song song (0 = số lõi CPU)")
+    parser.add_argument("--assume-cropped", action="store_true",
+                        help="Ảnh không có file .json và không phát hiện được khuôn mặt được coi là ảnh đã cắt sẵn")
+    parser.add_argument("--metrics", default=METRICS_PATH,
+                        help="Ghi số liệu thời gian từng bước vào file: .prom (Prometheus) hoặc JSON lines")
+    args = parser.parse_args()
+    if args.command != "list" and not args.username:
+        parser.error(f"{args.command} cần tên người dùng")
+
+    metrics = Metrics(args.metrics, prefix="face_auth_enroll")
+    try:
+        if args.command == "enroll":
+            workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+            ok = enroll_user(args.username, args.model, args.data_dir, args.cache, not args.no_cache, workers,
+                             args.assume_cropped, metrics)
+        elif args.command == "remove":
+            ok = remove_user(args.username, args.model, metrics)
+        else:
+            for user, count in list_users(args.model):
+                print(f"{user}: {count} mẫu")
+            ok = True
+    except Exception as e:
+        print(f"Lỗi: {e}")
+        ok = False
+    sys.exit(0 if ok else 1)
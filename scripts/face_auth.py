@@ -1,165 +1,125 @@
 #!/usr/bin/env python3
+import time
+_process_start = time.perf_counter()
+
 import cv2
 import sys
-import pickle
 import numpy as np
 import argparse
+import asyncio
+import copy
+import functools
 import os
-import time
-import tkinter as tk
-from PIL import Image, ImageTk
 
-print("Starting face_auth.py")
-print("Python path:", sys.path)
+from auth_ui import AuthRenderer, show_auth_ui
+from camera import ThreadedCapture
+from camera_hub import DEFAULT_CAMERA, CameraHub, FrameAnalyzer
+from frame_source import DEFAULT_SOURCE, FrameSource, RecordingSource, open_frame_source
+from decision import SUCCESS, NOT_RECOGNIZED, create_engine
+from embedding_index import (DISTANCE_THRESHOLD, DISTANCE_TOLERANCE, MATCHERS, ClaimVerifier, EmbeddingIndex,
+                             strong_score)
+from model_format import ModelFile, is_binary_model, load_pickled_model
+from metrics import METRICS_PATH, Metrics
+from presence_cache import PresenceCache
+from face_pipeline import DEFAULT_DETECTOR, DEFAULT_REDETECT_INTERVAL, DEFAULT_SCALE, DETECTORS, FacePipeline
 
-# Try to fix model paths before importing face_recognition
-try:
-    import face_recognition_models
-    print("Found face_recognition_models at:", face_recognition_models.__file__)
-    
-    # Check if model files exist
-    predictor_path = face_recognition_models.pose_predictor_model_location()
-    face_rec_model_path = face_recognition_models.face_recognition_model_location()
-    
-    print("Pose predictor exists:", os.path.exists(predictor_path))
-    print("Face recognition model exists:", os.path.exists(face_rec_model_path))
-    
-    # Set environment variables to help dlib find the models
-    os.environ["FACE_RECOGNITION_MODELS"] = os.path.dirname(os.path.dirname(face_recognition_models.__file__))
-except ImportError as e:
-    print("Error importing face_recognition_models:", e)
-    sys.exit(1)
+class StartupTimer:
+    # Per-phase startup breakdown: imports, model load, camera open, first frame
+    def __init__(self, start=None):
+        self.start = start if start is not None else time.perf_counter()
+        self.last = self.start
+        self.phases = []
 
-# Now try to import face_recognition
-try:
-    import face_recognition
-    print("Successfully imported face_recognition")
-except ImportError as e:
-    print("Error importing face_recognition:", e)
-    print("\nTrying to install dependencies...")
-    import subprocess
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "dlib", "face_recognition", "git+https://github.com/ageitgey/face_recognition_models"])
-    
-    try:
-        import face_recognition
-        print("Successfully imported face_recognition after installation")
-    except ImportError as e:
-        print("Still cannot import face_recognition:", e)
-        sys.exit(1)
-
-def show_auth_ui(result, frame=None):
-    root = tk.Tk()
-    root.title("Face Authentication")
-    root.geometry("400x450")
-    root.configure(bg='white')
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
 
-    canvas = tk.Canvas(root, width=400, height=450, bg='white', highlightthickness=0)
-    canvas.pack()
+    def report(self):
+        parts = [f"{phase} {1000 * seconds:.0f} ms" for phase, seconds in self.phases]
+        parts.append(f"total {1000 * (self.last - self.start):.0f} ms")
+        return "Startup: " + ", ".join(parts)
 
-    # Use absolute paths to the images directory
-    images_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "images")
+def import_face_recognition(fast_start=False):
+    # The login path (fast_start) skips the diagnostics below and never
+    # tries to install anything; a broken install simply fails
+    if fast_start:
+        import face_recognition
+        return face_recognition
     
-    # Make sure the directory exists
-    if not os.path.exists(images_dir):
-        os.makedirs(images_dir)
+    print("Starting face_auth.py")
+    print("Python path:", sys.path)
     
-    # Process camera frame if provided
-    if frame is not None:
-        # Convert the OpenCV frame to PIL format
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        pil_img = Image.fromarray(rgb_frame)
-        pil_img = pil_img.resize((320, 240), Image.LANCZOS)
-        cam_img_tk = ImageTk.PhotoImage(image=pil_img)
+    # Try to fix model paths before importing face_recognition
+    try:
+        import face_recognition_models
+        print("Found face_recognition_models at:", face_recognition_models.__file__)
         
-        # Display camera frame at the top
-        canvas.create_image(200, 120, image=cam_img_tk)
-    
-    # Always try to use face.png for all states, with different overlays
-    img_path = os.path.join(images_dir, "face.png")
-    message = ""
-    color = ""
-    overlay_color = None
-    
-    if result == "success":
-        message = "Authentication Successful"
-        color = "green"
-        overlay_color = (0, 255, 0)  # Green overlay
-    elif result == "not_recognized":
-        message = "Face Not Recognized"
-        color = "orange"
-        overlay_color = (255, 165, 0)  # Orange overlay
-    else:  # failure
-        message = "Authentication Failed"
-        color = "red"
-        overlay_color = (255, 0, 0)  # Red overlay
+        # Check if model files exist
+        predictor_path = face_recognition_models.pose_predictor_model_location()
+        face_rec_model_path = face_recognition_models.face_recognition_model_location()
+        
+        print("Pose predictor exists:", os.path.exists(predictor_path))
+        print("Face recognition model exists:", os.path.exists(face_rec_model_path))
+        
+        # Set environment variables to help dlib find the models
+        os.environ["FACE_RECOGNITION_MODELS"] = os.path.dirname(os.path.dirname(face_recognition_models.__file__))
+    except ImportError as e:
+        print("Error importing face_recognition_models:", e)
+        sys.exit(1)
     
-    # If face.png doesn't exist, use the fallback approach
-    icon_img_tk = None
-    if not os.path.exists(img_path):
-        # Create a basic image with text
-        img = Image.new('RGB', (100, 100), color = (255, 255, 255))
-        from PIL import ImageDraw
-        draw = ImageDraw.Draw(img)
+    # Now try to import face_recognition
+    try:
+        import face_recognition
+        print("Successfully imported face_recognition")
+    except ImportError as e:
+        print("Error importing face_recognition:", e)
+        print("\nTrying to install dependencies...")
+        import subprocess
+        subprocess.check_call([sys.executable, "-m", "pip", "install", "dlib", "face_recognition", "git+https://github.com/ageitgey/face_recognition_models"])
         
-        if result == "success":
-            draw.text((25, 40), "SUCCESS", fill=(0, 255, 0))
-        elif result == "not_recognized":
-            draw.text((5, 40), "NOT RECOGNIZED", fill=(255, 165, 0))
-        else:
-            draw.text((25, 40), "FAILURE", fill=(255, 0, 0))
-            
-        icon_img_tk = ImageTk.PhotoImage(img)
+        try:
+            import face_recognition
+            print("Successfully imported face_recognition after installation")
+        except ImportError as e:
+            print("Still cannot import face_recognition:", e)
+            sys.exit(1)
+    return face_recognition
+
+DEFAULT_THRESHOLD = 0.6
+# Share of the way from the threshold to 1.0 a classifier probability must
+# go to count as a strong match
+STRONG_MARGIN = 0.5
+
+def load_model(model_path, matcher="model"):
+    # (clf, metadata)
+    if is_binary_model(model_path):
+        # .fam models are memory-mapped: only the user table is read here
+        model = ModelFile(model_path)
+        clf, metadata = model.index(), model.metadata
     else:
-        # Open the face.png image
-        img = Image.open(img_path)
-        img = img.resize((100, 100), Image.LANCZOS)
-        
-        # Add colored overlay based on result
-        if overlay_color:
-            overlay = Image.new('RGBA', img.size, (*overlay_color, 80))  # Semi-transparent color
-            if img.mode != 'RGBA':
-                img = img.convert('RGBA')
-            img = Image.alpha_composite(img, overlay)
-            
-        icon_img_tk = ImageTk.PhotoImage(img)
+        clf, face_encodings, face_names, metadata = load_pickled_model(model_path)
+        if matcher in ("index", "verify") and not isinstance(clf, EmbeddingIndex):
+            # Match against the training samples stored next to the classifier
+            clf = EmbeddingIndex.from_samples(face_encodings, face_names)
+    if matcher == "verify":
+        # 1:1 against the claimed user only
+        clf = ClaimVerifier(clf)
+    return clf, metadata
 
-    # Position the status icon and text below the camera frame
-    canvas.create_image(200, 320, image=icon_img_tk)
-    canvas.create_text(200, 380, text=message, fill=color, font=("Arial", 14, "bold"))
-    
-    # Keep references to prevent garbage collection
-    root.cam_img_tk = cam_img_tk if frame is not None else None
-    root.icon_img_tk = icon_img_tk
-    
-    # Create a smooth fade-in effect
-    root.attributes('-alpha', 0.0)
-    
-    def fade_in():
-        alpha = root.attributes('-alpha')
-        if alpha < 1.0:
-            root.attributes('-alpha', min(alpha + 0.1, 1.0))
-            root.after(50, fade_in)
-            
-    fade_in()
-    root.after(3000, root.destroy)  # Close window after 3 seconds
-    root.mainloop()
+def model_threshold(confidence_threshold, metadata, matcher="model", clf=None):
+    # An explicit --threshold wins; otherwise the threshold calibrate.py
+    # stored in the loaded model for this matcher, or the default for the
+    # kind of scores clf produces
+    if confidence_threshold is not None:
+        return confidence_threshold
+    entry = (metadata or {}).get("calibration", {}).get(matcher)
+    if entry:
+        print(f"Using calibrated threshold {entry['threshold']:.4f} for matcher {matcher}")
+        return entry["threshold"]
+    return getattr(clf, "default_threshold", DEFAULT_THRESHOLD)
 
-def authenticate_face(username, model_path="models/face_auth_model.pkl", confidence_threshold=0.6):
-    # Kiểm tra xem model có tồn tại hay không
-    if not os.path.exists(model_path):
-        print("FAILURE: Model không tồn tại")
-        show_auth_ui("failure")
-        return False
-    
-    # Tải model
-    try:
-        with open(model_path, 'rb') as f:
-            clf, face_encodings, face_names = pickle.load(f)
-    except Exception as e:
-        print(f"FAILURE: Không thể tải model: {e}")
-        show_auth_ui("failure")
-        return False
-    
+def open_camera(source=DEFAULT_SOURCE, loop=False):
     # Try to handle Qt platform issues
     try:
         # Force OpenCV to use a specific backend that's available
@@ -167,262 +127,545 @@ def authenticate_face(username, model_path="models/face_auth_model.pkl", confide
     except Exception as e:
         print(f"Warning: Could not set Qt platform: {e}")
     
-    # Khởi tạo camera
-    cap = cv2.VideoCapture(0)
+    # Cameras are read on a background thread so processing never blocks
+    # acquisition and always sees the freshest frame; files, image
+    # directories and generators are replayed in order
+    cap = open_frame_source(source, loop=loop)
     if not cap.isOpened():
-        print("FAILURE: Không thể mở camera")
-        show_auth_ui("failure")
-        return False
+        cap.release()
+        return None
+    return cap
+
+def wait_for_camera(cap, timeout=1.0):
+    # Return as soon as the camera delivers a frame instead of sleeping blindly
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if cap.grab():
+            return True
+        time.sleep(0.02)
+    return False
+
+def make_decision_engine(confidence_threshold=None, policy="consecutive", time_budget=10.0,
+                         max_frames=10, required_consecutive=3, strong_confidence=None, required_matches=None,
+                         clf=None):
+    # confidence_threshold (and clf) are usually unknown until the model is
+    # loaded; set_strong_cutoff() then fills in the strong cutoff
+    policy_args = {"max_frames": max_frames, "required_matches": required_matches}
+    if policy == "consecutive":
+        policy_args["required_consecutive"] = required_consecutive
+        policy_args["strong_confidence"] = strong_confidence
+    engine = create_engine(policy, time_budget, **policy_args)
+    if confidence_threshold is not None:
+        set_strong_cutoff(engine, confidence_threshold, clf)
+    return engine
+
+def set_strong_cutoff(engine, confidence_threshold, clf=None):
+    # Without --strong-threshold a strong match lies a margin beyond the
+    # threshold on the scale clf scores on: halfway to 1.0 for classifier
+    # probabilities (0.8 for 0.6), a fraction of the threshold distance for
+    # the 1 / (1 + d) scorers. Only matched frames, whose confidence reaches
+    # the threshold, can count as strong.
+    policy = engine.policy
+    if not hasattr(policy, "strong_cutoff"):
+        return
+    if policy.strong_confidence is not None:
+        cutoff = policy.strong_confidence
+    elif hasattr(clf, "default_threshold"):
+        cutoff = strong_score(confidence_threshold)
+    else:
+        cutoff = confidence_threshold + (1.0 - confidence_threshold) * STRONG_MARGIN
+    policy.strong_cutoff = max(cutoff, confidence_threshold)
+
+def authenticate_face(username, model_path="models/face_auth_model.pkl", confidence_threshold=None, show_ui=True,
+                      engine=None, pipeline=None, matcher="model", startup=None, on_decision=None, batch_frames=1,
+                      source=DEFAULT_SOURCE, record_dir=None):
+    if pipeline is None:
+        pipeline = FacePipeline()
+    metrics = pipeline.metrics
     
-    # Đợi camera khởi động
-    time.sleep(1)
+    def fail(message):
+        print(f"FAILURE: {message}")
+        if on_decision is not None:
+            on_decision(False)
+        if show_ui:
+            with metrics.time("ui"):
+                show_auth_ui("failure")
+        metrics.flush(result="failure", reason=message)
+        return False
     
-    # Lấy 10 khung hình để xác thực
-    max_attempts = 10
-    successful_attempts = 0
-    no_face_detected = 0
-    last_frame = None
+    # Kiểm tra xem model có tồn tại hay không
+    if not os.path.exists(model_path):
+        return fail("Model không tồn tại")
     
-    # Create a window for smooth scanning effect - with error handling
+    # Tải model
     try:
-        cv2.namedWindow('Face Authentication', cv2.WINDOW_NORMAL)
-        cv2.resizeWindow('Face Authentication', 640, 480)
-        window_created = True
+        with metrics.time("model_load"):
+            clf, metadata = load_model(model_path, matcher)
     except Exception as e:
-        print(f"Warning: Could not create window: {e}")
-        window_created = False
+        return fail(f"Không thể tải model: {e}")
+    confidence_threshold = model_threshold(confidence_threshold, metadata, matcher, clf)
+    if engine is None:
+        engine = make_decision_engine()
+    set_strong_cutoff(engine, confidence_threshold, clf)
+    if startup is not None:
+        startup.mark("model_load")
     
-    # Load face.png for overlay if possible - with robust error handling
-    images_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "images")
-    face_overlay = None
-    face_img_path = os.path.join(images_dir, "face.png")
+    # Khởi tạo camera
+    with metrics.time("camera_open"):
+        cap = open_camera(source)
+    if startup is not None:
+        startup.mark("camera_open")
+    if cap is None:
+        return fail("Không thể mở camera")
+    if record_dir:
+        # Keep the processed frames so this login can be replayed later
+        cap = RecordingSource(cap, record_dir)
     
+    renderer = AuthRenderer() if show_ui else None
     try:
-        if os.path.exists(face_img_path):
-            face_overlay = cv2.imread(face_img_path)
-            print(f"Loaded face overlay image: {face_img_path}")
-            
-            # Check if image was loaded correctly
-            if face_overlay is None:
-                print("Warning: face.png could not be loaded properly")
-            elif len(face_overlay.shape) < 3:
-                print(f"Warning: Unexpected image shape: {face_overlay.shape}")
-                # Convert grayscale to RGB
-                face_overlay = cv2.cvtColor(face_overlay, cv2.COLOR_GRAY2BGR)
-            
-            # Check and convert if needed
-            if face_overlay is not None:
-                print(f"Face overlay shape: {face_overlay.shape}")
-                # Only try to add alpha channel if shape has 3 dimensions
-                if len(face_overlay.shape) == 3 and face_overlay.shape[2] == 3:
-                    # Convert BGR to BGRA
-                    face_overlay = cv2.cvtColor(face_overlay, cv2.COLOR_BGR2BGRA)
-    except Exception as e:
-        print(f"Error loading face overlay: {e}")
-        face_overlay = None
+        ok = run_authentication(username, clf, cap, confidence_threshold, engine=engine, pipeline=pipeline,
+                                startup=startup, renderer=renderer, batch_frames=batch_frames)
+    finally:
+        cap.release()
+        if renderer is not None:
+            renderer.finish()
     
-    # Create scanning animation variables
-    scan_position = 0
-    scan_direction = 1
-    scan_speed = 10
+    # Report the decision before waiting for the fade-out and result window
+    if on_decision is not None:
+        on_decision(ok)
+    if renderer is not None:
+        with metrics.time("ui"):
+            renderer.close()
+    metrics.flush()
+    return ok
+
+def score_faces(clf, encodings, username=None):
+    # One predict_proba call for every face of a batch; returns
+    # (predicted user, confidence) per encoding. A verifying matcher scores
+    # the faces against the claimed username instead.
+    if not encodings:
+        return []
+    if username is not None and hasattr(clf, "verify"):
+        return [(username, confidence) for confidence in clf.verify(np.asarray(encodings), username)]
+    predictions = clf.predict_proba(np.asarray(encodings))
+    best = np.argmax(predictions, axis=1)
+    return [(clf.classes_[i], predictions[row, i]) for row, i in enumerate(best)]
+
+def match_user(username, scores, confidence_threshold=0.6):
+    # (matched, confidence) for the faces of one frame: the best confident
+    # match for username, otherwise the best confidence of any face
+    matches = [confidence for predicted, confidence in scores
+               if predicted == username and confidence >= confidence_threshold]
+    if matches:
+        return True, max(matches)
+    return False, max((confidence for _, confidence in scores), default=None)
+
+def run_authentication(username, clf, cap, confidence_threshold=0.6, warmup=True, engine=None,
+                       pipeline=None, startup=None, renderer=None, batch_frames=1):
+    # Hot loop: no frame copies, no drawing, no GUI. Visual feedback, if
+    # any, is produced asynchronously by the renderer subscriber.
+    if engine is None:
+        engine = make_decision_engine(confidence_threshold, clf=clf)
+    if pipeline is None:
+        pipeline = FacePipeline()
     
-    for attempt in range(max_attempts):
-        ret, frame = cap.read()
-        if not ret:
-            continue
+    if warmup:
+        # Đợi camera khởi động
+        wait_for_camera(cap)
+    elif not isinstance(cap, (ThreadedCapture, FrameSource)):
+        # Camera is already warm (service mode): drop frames that went stale
+        # in the driver buffer while nobody was reading
+        for _ in range(5):
+            cap.grab()
+    if isinstance(cap, (ThreadedCapture, FrameSource)):
+        cap.reset_stats()
+    # Boxes tracked during a previous request are stale
+    pipeline.reset()
+    metrics = pipeline.metrics
+    
+    # Lấy tối đa max_frames khung hình; dừng ngay khi đã có kết luận
+    max_attempts = engine.policy.max_frames
+    
+    engine.start()
+    decision = None
+    attempt = -1
+    while decision is None:
+        # Detect faces in up to batch_frames frames, then encode and score
+        # all of them at once; the decision engine still sees one frame at
+        # a time and stops at the first conclusive frame of the batch
+        batch = []
+        batch_size = max(1, min(batch_frames, max_attempts - attempt - 1))
+        while len(batch) < batch_size and decision is None:
+            with metrics.time("grab"):
+                ret, frame = cap.read()
+            if not ret:
+                metrics.count("read_failures")
+                decision = engine.skip()
+                continue
+            attempt += 1
+            metrics.count("frames")
+            if startup is not None and attempt == 0:
+                startup.mark("first_frame")
+                print(startup.report())
             
-        last_frame = frame.copy()  # Save the last frame for UI display
-        display_frame = frame.copy()
-        
-        # Tìm khuôn mặt và mã hóa
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        face_locations = face_recognition.face_locations(rgb_frame)
-        
-        if len(face_locations) == 0:
-            no_face_detected += 1
-            if window_created:
-                cv2.putText(display_frame, "Looking for face...", (10, 30), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 165, 0), 2)
-                try:
-                    cv2.imshow('Face Authentication', display_frame)
-                    cv2.waitKey(1)
-                except Exception as e:
-                    print(f"Display error: {e}")
-                    window_created = False
+            # Tìm khuôn mặt
+            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            batch.append((attempt, frame, rgb_frame, pipeline.detect(rgb_frame)))
+        if not batch:
             continue
         
-        # When a face is detected, create smooth scanning effect
-        for (top, right, bottom, left) in face_locations:
-            # Draw rectangle around the face
-            cv2.rectangle(display_frame, (left, top), (right, bottom), (0, 255, 0), 2)
-            
-            # Draw scanning line effect
-            if top < bottom:  # Make sure these values are valid
-                if scan_position < bottom - top:
-                    y_pos = top + scan_position
-                    cv2.line(display_frame, (left, y_pos), (right, y_pos), (0, 255, 255), 2)
-                
-                # Progress indicator
-                progress = min(attempt / max_attempts * 100, 100)
-                cv2.rectangle(display_frame, (left, bottom + 20), 
-                             (left + int((right-left) * progress/100), bottom + 30), 
-                             (0, 255, 0), -1)
-            
-            # Overlay face template if available - with careful error handling
-            if face_overlay is not None:
-                try:
-                    # Resize overlay to match face size
-                    face_width = right - left
-                    face_height = bottom - top
-                    if face_width > 0 and face_height > 0:  # Valid dimensions
-                        resized_overlay = cv2.resize(face_overlay, (face_width, face_height))
-                        
-                        # Create ROI and blend overlay
-                        roi = display_frame[top:bottom, left:right]
-                        # Simple alpha blending
-                        alpha = 0.3  # Transparency factor
-                        beta = 1.0 - alpha
-                        
-                        # Check if overlay has correct shape before accessing channels
-                        if (len(resized_overlay.shape) == 3 and 
-                            resized_overlay.shape[2] == 4 and 
-                            roi.shape[0] == resized_overlay.shape[0] and 
-                            roi.shape[1] == resized_overlay.shape[1]):
-                            
-                            # Extract alpha channel
-                            overlay_alpha = resized_overlay[:, :, 3] / 255.0
-                            # Process each color channel
-                            for c in range(3):
-                                roi[:, :, c] = (beta * roi[:, :, c] + 
-                                              alpha * resized_overlay[:, :, c] * overlay_alpha)
-                        elif (len(resized_overlay.shape) == 3 and 
-                              resized_overlay.shape[2] == 3 and
-                              roi.shape[0] == resized_overlay.shape[0] and 
-                              roi.shape[1] == resized_overlay.shape[1]):
-                              
-                            # Simple overlay without alpha channel
-                            cv2.addWeighted(roi, beta, resized_overlay, alpha, 0, roi)
-                except Exception as e:
-                    print(f"Overlay error: {e}")
-            
-        # Update scanning animation
-        scan_position += scan_speed * scan_direction
-        if scan_position >= (bottom - top) or scan_position <= 0:
-            scan_direction *= -1
-        
-        # Display attempt counter and confidence info
-        cv2.putText(display_frame, f"Scanning... Attempt {attempt+1}/{max_attempts}", 
-                   (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-        
-        # Show the frame with effects - with error handling
-        if window_created:
-            try:
-                cv2.imshow('Face Authentication', display_frame)
-                cv2.waitKey(1)
-            except Exception as e:
-                print(f"Display error: {e}")
-                window_created = False
-        
-        # Process face encodings
-        face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+        # Mã hóa và phân loại tất cả khuôn mặt trong lô bằng một lần gọi
+        batch_encodings = pipeline.encode_batch([(rgb_frame, locations) for _, _, rgb_frame, locations in batch])
+        try:
+            with metrics.time("classify"):
+                scores = iter(score_faces(clf, [e for encodings in batch_encodings for e in encodings], username))
+        except Exception as e:
+            print(f"Attempt {batch[0][0]+1}: Error: {e}")
+            scores = None
         
-        for face_encoding in face_encodings:
-            try:
-                # Check if it's our custom single-user model
-                if hasattr(clf, 'predict_proba') and callable(clf.predict_proba):
-                    predictions = clf.predict_proba([face_encoding])[0]
-                    best_match_index = np.argmax(predictions)
-                    confidence = predictions[best_match_index]
-                    predicted_user = clf.classes_[best_match_index]
-                else:
-                    # It's our custom single-user model
-                    predicted_user = clf.user
-                    similarity_score = clf.predict_proba([face_encoding])[0][0]
-                    confidence = similarity_score
-            
-                # Show confidence score on frame
-                conf_text = f"Confidence: {confidence:.2f}"
-                cv2.putText(display_frame, conf_text, (10, 60), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
-                
-                if window_created:
-                    try:
-                        cv2.imshow('Face Authentication', display_frame)
-                        cv2.waitKey(1)
-                    except Exception as e:
-                        print(f"Display error: {e}")
-                        window_created = False
+        # Frames read before a skip ended the attempt are still evaluated
+        skipped, decision = decision, None
+        for (frame_attempt, frame, _, face_locations), face_encodings in zip(batch, batch_encodings):
+            if len(face_locations) == 0:
+                metrics.count("frames_no_face")
+                decision = engine.observe(False, False)
+                if renderer is not None:
+                    with metrics.time("render"):
+                        renderer.publish(frame, attempt=frame_attempt, max_attempts=max_attempts)
+                if decision is not None:
+                    break
+                continue
             
+            matched = False
+            frame_confidence = None
+            face_results = []
+            for _ in face_encodings:
+                if scores is None:
+                    continue
+                predicted_user, confidence = next(scores)
                 # Kiểm tra xem người dùng dự đoán có khớp với người dùng đăng nhập không
+                if matched:
+                    continue
+                if frame_confidence is None or confidence > frame_confidence:
+                    frame_confidence = confidence
                 if predicted_user == username and confidence >= confidence_threshold:
-                    successful_attempts += 1
-                    print(f"Attempt {attempt+1}: Success (Confidence: {confidence:.2f})")
-                    # Show green checkmark briefly
-                    if window_created:
-                        cv2.putText(display_frame, "✓", (right + 10, top + 20), 
-                                   cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-                        try:
-                            cv2.imshow('Face Authentication', display_frame)
-                            cv2.waitKey(200)
-                        except Exception:
-                            pass
-                    break
+                    matched = True
+                    frame_confidence = confidence
+                    face_results.append((True, confidence))
+                    print(f"Attempt {frame_attempt+1}: Success (Confidence: {confidence:.2f}, {engine.elapsed:.2f}s)")
                 else:
-                    print(f"Attempt {attempt+1}: Wrong user or low confidence ({confidence:.2f})")
-                    # Show red X briefly
-                    if window_created:
-                        cv2.putText(display_frame, "✗", (right + 10, top + 20), 
-                                   cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-                        try:
-                            cv2.imshow('Face Authentication', display_frame)
-                            cv2.waitKey(200)
-                        except Exception:
-                            pass
-            except Exception as e:
-                print(f"Attempt {attempt+1}: Error: {e}")
-                continue
-        
-        # Smoother transition between attempts
-        time.sleep(0.3)
+                    face_results.append((False, confidence))
+                    print(f"Attempt {frame_attempt+1}: Wrong user or low confidence ({confidence:.2f}, {engine.elapsed:.2f}s)")
+            
+            metrics.count("faces", len(face_locations))
+            if not matched:
+                metrics.count("frames_rejected")
+            decision = engine.observe(True, matched, frame_confidence)
+            if renderer is not None:
+                with metrics.time("render"):
+                    renderer.publish(frame, face_locations, face_results, frame_attempt, max_attempts)
+            if decision is not None:
+                break
+        if decision is None:
+            decision = skipped
+    
+    if renderer is not None:
+        renderer.finish(decision.result)
     
-    # Fade out the window if possible
-    if window_created:
+    if isinstance(cap, (ThreadedCapture, FrameSource)):
+        print(f"Camera: {cap.format_stats()}")
+    print(pipeline.format_stats())
+    metrics.observe("decision", decision.elapsed)
+    metrics.annotate(result=decision.result, reason=decision.reason, frames=decision.frames,
+                     detector_invocations=pipeline.detector_invocations)
+    
+    return report_decision(decision)
+
+def report_decision(decision, prefix=""):
+    # Kết luận do chính sách quyết định đưa ra (chấp nhận/từ chối sớm)
+    timing = f"decided in {decision.elapsed:.2f}s after {decision.frames} frames"
+    if decision.result == SUCCESS:
+        print(f"{prefix}SUCCESS: {decision.reason} ({timing})")
+    elif decision.result == NOT_RECOGNIZED:
+        print(f"{prefix}FAILURE: Face not recognized, {decision.reason} ({timing})")
+    else:
+        print(f"{prefix}FAILURE: {decision.reason} ({timing})")
+    return decision.result == SUCCESS
+
+# Deadline of a service request when the decision engine has no time budget
+SERVICE_DEADLINE = 10.0
+
+class ServiceAuthenticator:
+    # Answers concurrent requests for the service. The classifier stays
+    # loaded between requests, every camera is opened once by a CameraHub
+    # that fans its analyzed frames out to all requests waiting on it, and
+    # detection/encoding run in a pool of worker processes. Each request
+    # gets its own decision engine, and its time budget is a hard deadline:
+    # the request is answered even if the camera stops delivering frames.
+    def __init__(self, model_path, confidence_threshold=None, cameras=None, engine=None, pipeline=None,
+                 matcher="model", workers=0, presence_ttl=0):
+        if cameras is None:
+            cameras = {DEFAULT_CAMERA: DEFAULT_SOURCE}
+        if engine is None:
+            engine = make_decision_engine()
+        if pipeline is None:
+            pipeline = FacePipeline()
+        if pipeline.tracker is not None:
+            print("Warning: --track is not used by the service, every frame goes through the detector")
+        self.model_path = model_path
+        self.matcher = matcher
+        # None: use the threshold stored in each loaded model
+        self.confidence_threshold = confidence_threshold
+        self.threshold = None
+        self.engine = engine
+        self.metrics = pipeline.metrics
+        self.clf = None
+        self.model_mtime = None
+        self._model_lock = asyncio.Lock()
+        # Worker processes come from a forkserver, not a fork of this process
+        self.analyzer = FrameAnalyzer(workers, pipeline.scale, pipeline.detector)
+        open_source = functools.partial(open_camera, loop=True)
+        self.cameras = {name: CameraHub(name, source, self.analyzer, open_source)
+                        for name, source in cameras.items()}
+        self.default_camera = next(iter(self.cameras))
+        # Opt-in: without a TTL every request scans
+        self.presence = PresenceCache(presence_ttl) if presence_ttl > 0 else None
+
+    async def _ensure_model(self, metrics):
+        # Pick up a retrained model without restarting the service
+        async with self._model_lock:
+            mtime = os.path.getmtime(self.model_path)
+            if self.clf is None or mtime != self.model_mtime:
+                loop = asyncio.get_running_loop()
+                with metrics.time("model_load"):
+                    self.clf, metadata = await loop.run_in_executor(None, load_model, self.model_path,
+                                                                    self.matcher)
+                self.threshold = model_threshold(self.confidence_threshold, metadata, self.matcher, self.clf)
+                # Requests copy the engine, so they all see the new cutoff
+                set_strong_cutoff(self.engine, self.threshold, self.clf)
+                self.model_mtime = mtime
+                print(f"Loaded model {self.model_path}")
+            return self.clf, self.threshold
+
+    async def warm_up(self, startup=None):
+        metrics = Metrics()
+        await self._ensure_model(metrics)
+        if startup is not None:
+            startup.mark("model_load")
+        loop = asyncio.get_running_loop()
+        workers = await loop.run_in_executor(None, self.analyzer.warm_up)
+        if startup is not None:
+            startup.mark(f"workers x{workers}")
+        with metrics.time("camera_open"):
+            await self.cameras[self.default_camera].warm_up()
+        if startup is not None:
+            startup.mark("camera_open")
+            print(startup.report())
+        self.metrics.merge(metrics)
+        self.metrics.flush(event="warm_up")
+
+    async def __call__(self, username, camera=None, session=None):
+        metrics = Metrics()
+        camera = camera or self.default_camera
+        hub = self.cameras.get(camera)
+        prefix = f"[{username}@{camera}] "
+        if self.presence is not None and self.presence.lookup(username, session, camera):
+            print(f"{prefix}SUCCESS: still present since the last verification")
+            metrics.count("presence_hits")
+            self.metrics.merge(metrics)
+            self.metrics.flush(result=SUCCESS, reason="presence cache", frames=0, user=username, camera=camera)
+            return True
+        try:
+            if hub is None:
+                raise RuntimeError(f"Không có camera {camera}")
+            clf, threshold = await self._ensure_model(metrics)
+            with metrics.time("camera_open"):
+                subscription = await hub.subscribe()
+        except Exception as e:
+            print(f"{prefix}FAILURE: {e}")
+            self.metrics.merge(metrics)
+            self.metrics.flush(result="failure", reason=str(e), user=username, camera=camera)
+            return False
+        release = functools.partial(hub.unsubscribe, subscription)
         try:
-            for i in range(10):
-                alpha = 1.0 - (i / 10.0)
-                fade_frame = cv2.convertScaleAbs(last_frame, alpha=alpha, beta=0)
-                cv2.imshow('Face Authentication', fade_frame)
-                cv2.waitKey(30)
-        except Exception:
-            pass
+            decision = await self._decide(username, clf, threshold, subscription, metrics)
+        except BaseException:
+            release()
+            raise
+        if self.presence is not None and decision.result == SUCCESS:
+            # Keep watching the camera; the entry lasts while the user stays
+            def still_present(result):
+                scores = score_faces(clf, result.encodings, username)
+                return match_user(username, scores, threshold)[0]
+            self.presence.remember(username, session, camera, subscription, still_present, release)
+        else:
+            release()
+        metrics.count("frames_skipped", subscription.dropped)
+        metrics.observe("decision", decision.elapsed)
+        print(f"Camera: {hub.format_stats()}")
+        self.metrics.merge(metrics)
+        self.metrics.flush(result=decision.result, reason=decision.reason, frames=decision.frames,
+                           user=username, camera=camera)
+        return report_decision(decision, prefix)
+
+    async def _decide(self, username, clf, threshold, subscription, metrics):
+        engine = copy.deepcopy(self.engine)
+        if engine.time_budget is None:
+            engine.time_budget = SERVICE_DEADLINE
+        engine.start()
+        decision = None
+        while decision is None:
+            try:
+                result = await subscription.get(max(0.0, engine.time_budget - engine.elapsed))
+            except asyncio.TimeoutError:
+                decision = engine.check_budget()
+                continue
+            if result is None:
+                metrics.count("read_failures")
+                decision = engine.skip()
+                continue
+            metrics.count("frames")
+            metrics.count("faces", len(result.face_locations))
+            for stage, seconds in result.timings.items():
+                metrics.observe(stage, seconds)
+            with metrics.time("classify"):
+                scores = score_faces(clf, result.encodings, username)
+            matched, confidence = match_user(username, scores, threshold)
+            decision = engine.observe(bool(result.face_locations), matched, confidence)
+        return decision
+
+    def close(self):
+        if self.presence is not None:
+            self.presence.clear()
+        for hub in self.cameras.values():
+            hub.close()
+        self.analyzer.close()
+
+async def _serve(authenticator, server, startup=None):
+    try:
+        await authenticator.warm_up(startup)
+    except Exception as e:
+        # Keep serving; the next request retries loading the model/camera
+        print(f"Warning: warm-up failed: {e}")
+    await server.serve_forever()
+
+def run_service(model_path, confidence_threshold, socket_path, engine=None, pipeline=None, matcher="model",
+                startup=None, cameras=None, workers=0, max_pending=None, presence_ttl=0):
+    from auth_service import DEFAULT_MAX_PENDING, FaceAuthServer
     
-    # Close any open windows
+    authenticator = ServiceAuthenticator(model_path, confidence_threshold, cameras, engine=engine,
+                                         pipeline=pipeline, matcher=matcher, workers=workers,
+                                         presence_ttl=presence_ttl)
+    server = FaceAuthServer(socket_path, authenticator, max_pending or DEFAULT_MAX_PENDING)
+    print(f"Face authentication service listening on {socket_path} "
+          f"({authenticator.analyzer.workers} workers, cameras: {', '.join(authenticator.cameras)})")
     try:
-        cv2.destroyAllWindows()
-    except Exception:
+        asyncio.run(_serve(authenticator, server, startup))
+    except KeyboardInterrupt:
         pass
-    
-    cap.release()
-    
-    # Xác thực thành công nếu có ít nhất 6/10 lần thử thành công
-    if successful_attempts >= 6:
-        print(f"SUCCESS: {successful_attempts}/10 attempts were successful")
-        show_auth_ui("success", last_frame)
-        return True
-    elif no_face_detected >= 7:
-        print(f"FAILURE: Face not recognized in {no_face_detected}/10 attempts")
-        show_auth_ui("not_recognized", last_frame)
-        return False
-    else:
-        print(f"FAILURE: Only {successful_attempts}/10 attempts were successful")
-        show_auth_ui("failure", last_frame)
-        return False
+    finally:
+        authenticator.close()
+
+def parse_cameras(default_source, specs):
+    # --camera name=source entries on top of the default camera
+    cameras = {DEFAULT_CAMERA: default_source}
+    for spec in specs or []:
+        name, sep, source = spec.partition("=")
+        if not sep or not name or not source:
+            raise ValueError(f"camera phải có dạng tên=nguồn, nhận được {spec!r}")
+        cameras[name] = source
+    return cameras
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Xác thực khuôn mặt")
-    parser.add_argument("--username", required=True, help="Tên người dùng để xác thực")
+    parser.add_argument("--username", help="Tên người dùng để xác thực")
     parser.add_argument("--model", default="models/face_auth_model.pkl", help="Đường dẫn đến file model")
-    parser.add_argument("--threshold", type=float, default=0.6, help="Ngưỡng độ tin cậy")
+    parser.add_argument("--threshold", type=float, default=None,
+                        help=f"Ngưỡng độ tin cậy (mặc định: ngưỡng đã hiệu chỉnh bằng calibrate.py, nếu không thì "
+                             f"{DEFAULT_THRESHOLD} cho bộ phân loại và {DISTANCE_THRESHOLD} (khoảng cách <= "
+                             f"{DISTANCE_TOLERANCE}) cho chỉ mục embedding và mô hình một người dùng)")
+    parser.add_argument("--service", action="store_true", help="Chạy dịch vụ xác thực thường trú qua Unix socket")
+    parser.add_argument("--socket", default=None, help="Đường dẫn Unix socket cho chế độ --service")
+    parser.add_argument("--policy", choices=["consecutive", "majority"], default="consecutive",
+                        help="Chính sách quyết định (consecutive: chấp nhận sớm sau N lần khớp liên tiếp)")
+    parser.add_argument("--max-frames", type=int, default=10, help="Số khung hình tối đa cho mỗi lần xác thực")
+    parser.add_argument("--required-matches", type=int, default=None,
+                        help="Số khung hình khớp cần để chấp nhận (mặc định: 60%% của --max-frames, làm tròn lên)")
+    parser.add_argument("--consecutive", type=int, default=3, help="Số lần khớp liên tiếp để chấp nhận sớm")
+    parser.add_argument("--strong-threshold", type=float, default=None,
+                        help="Độ tin cậy tối thiểu của một lần khớp được tính vào chuỗi liên tiếp "
+                             "(mặc định: theo ngưỡng và thang điểm của matcher, 0.8 với model)")
+    parser.add_argument("--time-budget", type=float, default=10.0, help="Thời gian tối đa cho mỗi lần xác thực (giây)")
+    parser.add_argument("--scale", type=float, default=DEFAULT_SCALE,
+                        help="Tỉ lệ thu nhỏ khung hình trước khi phát hiện khuôn mặt (0 < scale <= 1)")
+    parser.add_argument("--detector", choices=DETECTORS, default=DEFAULT_DETECTOR,
+                        help="Bộ phát hiện khuôn mặt: hog (CPU) hoặc cnn (GPU, cần CUDA)")
+    parser.add_argument("--track", action="store_true",
+                        help="Theo dõi khuôn mặt giữa các khung hình, chỉ chạy bộ phát hiện khi mất dấu")
+    parser.add_argument("--redetect-interval", type=int, default=DEFAULT_REDETECT_INTERVAL,
+                        help="Số khung hình theo dõi tối đa trước khi phát hiện lại (với --track)")
+    parser.add_argument("--batch-frames", type=int, default=1,
+                        help="Số khung hình được mã hóa và phân loại cùng lúc trong một lô")
+    parser.add_argument("--matcher", choices=MATCHERS, default="model",
+                        help="model: dùng bộ phân loại đã huấn luyện; index: so khớp trực tiếp với các mẫu đã lưu; "
+                             "verify: chỉ so khớp với các mẫu của người dùng cần xác thực")
+    parser.add_argument("--source", default=DEFAULT_SOURCE,
+                        help="Nguồn khung hình: chỉ số camera, file video hoặc thư mục ảnh (mặc định: CAMERA_INDEX hoặc 0)")
+    parser.add_argument("--camera", action="append", default=[], metavar="TÊN=NGUỒN",
+                        help="Thêm camera cho chế độ --service (có thể lặp lại); yêu cầu chọn camera bằng AUTH <user> <tên>")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Số tiến trình phát hiện/mã hóa của chế độ --service (0 = số lõi CPU)")
+    parser.add_argument("--presence-ttl", type=float, default=0,
+                        help="Chế độ --service: ghi nhớ lần xác thực thành công trong số giây này, theo người dùng "
+                             "và phiên đăng nhập, chừng nào khuôn mặt còn trước camera (0 = tắt)")
+    parser.add_argument("--max-pending", type=int, default=None,
+                        help="Số yêu cầu xử lý đồng thời tối đa của chế độ --service; yêu cầu vượt quá nhận BUSY")
+    parser.add_argument("--record", default=None,
+                        help="Lưu các khung hình đã xử lý vào thư mục này để phát lại bằng --source")
+    parser.add_argument("--metrics", default=METRICS_PATH,
+                        help="Ghi số liệu thời gian từng bước vào file: .prom (Prometheus) hoặc JSON lines "
+                             "(mặc định: FACE_AUTH_METRICS)")
+    parser.add_argument("--headless", action="store_true",
+                        help="Không hiển thị giao diện: trả kết quả ngay khi có quyết định")
+    parser.add_argument("--fast-start", action="store_true",
+                        help="Khởi động nhanh cho PAM: bỏ chẩn đoán, không cài đặt gói, chỉ in SUCCESS/FAILURE ra stdout")
     args = parser.parse_args()
+    if not args.service and not args.username:
+        parser.error("--username is required unless --service is given")
     
-    authenticate_face(args.username, args.model, args.threshold)
+    # In fast-start mode stdout carries only the final SUCCESS/FAILURE line
+    # that the PAM module reads; progress messages go to stderr
+    result_out = sys.stdout
+    if args.fast_start:
+        sys.stdout = sys.stderr
+    
+    try:
+        engine = make_decision_engine(args.threshold, args.policy, args.time_budget, args.max_frames,
+                                      args.consecutive, args.strong_threshold, args.required_matches)
+    except ValueError as e:
+        parser.error(str(e))
+    
+    startup = StartupTimer(_process_start)
+    import_face_recognition(args.fast_start)
+    metrics = Metrics(args.metrics)
+    pipeline = FacePipeline(args.scale, args.detector, track=args.track, redetect_interval=args.redetect_interval,
+                            metrics=metrics)
+    startup.mark("imports")
+    metrics.observe("imports", startup.phases[-1][1])
+    
+    if args.service:
+        from auth_service import DEFAULT_SOCKET_PATH
+        try:
+            cameras = parse_cameras(args.source, args.camera)
+        except ValueError as e:
+            parser.error(str(e))
+        run_service(args.model, args.threshold, args.socket or DEFAULT_SOCKET_PATH, engine, pipeline, args.matcher,
+                    startup, cameras, args.workers, args.max_pending, args.presence_ttl)
+    else:
+        def report_result(ok):
+            if args.fast_start:
+                print("SUCCESS" if ok else "FAILURE", file=result_out, flush=True)
+        
+        authenticate_face(args.username, args.model, args.threshold, show_ui=not args.headless, engine=engine,
+                          pipeline=pipeline, matcher=args.matcher, startup=startup, on_decision=report_result,
+                          batch_frames=args.batch_frames, source=args.source, record_dir=args.record)
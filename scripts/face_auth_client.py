@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+# Thin client for the face authentication service (face_auth.py --service).
+# Prints SUCCESS or FAILURE on the first line, like face_auth.py, and exits
+# with status 0 on success.
+import argparse
+import sys
+
+from auth_service import DEFAULT_SOCKET_PATH, request_authentication
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gửi yêu cầu xác thực tới dịch vụ face_auth")
+    parser.add_argument("--username", required=True, help="Tên người dùng để xác thực")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH, help="Đường dẫn Unix socket của dịch vụ")
+    parser.add_argument("--camera", default=None, help="Tên camera của dịch vụ (mặc định: camera mặc định)")
+    parser.add_argument("--timeout", type=float, default=60, help="Thời gian chờ tối đa (giây)")
+    args = parser.parse_args()
+
+    try:
+        ok = request_authentication(args.username, args.socket, args.timeout, args.camera)
+    except OSError as e:
+        print(f"FAILURE: Không thể kết nối tới dịch vụ: {e}")
+        sys.exit(2)
+
+    print("SUCCESS" if ok else "FAILURE")
+    sys.exit(0 if ok else 1)
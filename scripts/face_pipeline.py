@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# Frame pipeline used by authenticate_face: detect faces on a downscaled copy
+# of the frame, map the boxes back to full resolution, and compute encodings
+# from a crop around the faces only.
+#
+# With tracking enabled the detector only runs on the first frame, every
+# redetect_interval frames, and whenever the tracker loses the face; in
+# between, the boxes are propagated with optical flow and handed to the
+# encoder as known face locations. Every frame is still encoded and
+# verified, so tracking only saves detection work.
+import os
+import sys
+
+import cv2
+import numpy as np
+
+from metrics import Metrics
+
+DEFAULT_SCALE = 0.5
+DETECTORS = ("hog", "cnn")
+# argparse does not check defaults against choices, so an unknown value
+# falls back to hog, with a warning, instead of failing at login
+DEFAULT_DETECTOR = os.environ.get("FACE_AUTH_DETECTOR", "hog")
+if DEFAULT_DETECTOR not in DETECTORS:
+    print(f"Warning: unknown FACE_AUTH_DETECTOR {DEFAULT_DETECTOR!r} (expected one of {', '.join(DETECTORS)}), "
+          f"using hog", file=sys.stderr)
+    DEFAULT_DETECTOR = "hog"
+DEFAULT_REDETECT_INTERVAL = 5
+# Fraction of tracked points that must survive for a tracked box to be used
+MIN_TRACK_QUALITY = 0.6
+
+# Extra context kept around the detected box when cropping for the encoder,
+# as a fraction of the box size. The landmark model needs a little room
+# around the chin and forehead.
+CROP_MARGIN = 0.25
+
+def scale_box(box, factor, frame_shape):
+    top, right, bottom, left = box
+    height, width = frame_shape[:2]
+    return (max(0, int(round(top * factor))),
+            min(width, int(round(right * factor))),
+            min(height, int(round(bottom * factor))),
+            max(0, int(round(left * factor))))
+
+class FacePipeline:
+    def __init__(self, scale=DEFAULT_SCALE, detector=DEFAULT_DETECTOR, upsample=1,
+                 track=False, redetect_interval=DEFAULT_REDETECT_INTERVAL,
+                 min_track_quality=MIN_TRACK_QUALITY, metrics=None):
+        if not 0 < scale <= 1:
+            raise ValueError(f"scale must be in (0, 1], got {scale}")
+        if detector not in DETECTORS:
+            raise ValueError(f"detector must be one of {DETECTORS}, got {detector!r}")
+        self.scale = scale
+        self.detector = detector
+        self.upsample = upsample
+        self.redetect_interval = redetect_interval
+        self.min_track_quality = min_track_quality
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.tracker = None
+        if track:
+            from face_tracker import OpticalFlowTracker
+            self.tracker = OpticalFlowTracker()
+        self._batch_encoder = None
+        self.reset()
+        # Imported here so that loading this module does not pull in dlib
+        import face_recognition
+        self._fr = face_recognition
+
+    def reset(self):
+        # Forget tracked faces and counters, e.g. before a new authentication
+        self.frames = 0
+        self.detector_invocations = 0
+        self.tracked_frames = 0
+        self._since_detection = 0
+        self._tracking = False
+        if self.tracker is not None:
+            self.tracker.reset()
+
+    def detect(self, rgb_frame):
+        # Returns (top, right, bottom, left) boxes in full-resolution coordinates
+        self.frames += 1
+        if self.scale < 1:
+            small = cv2.resize(rgb_frame, (0, 0), fx=self.scale, fy=self.scale,
+                               interpolation=cv2.INTER_AREA)
+        else:
+            small = rgb_frame
+        gray = None
+        if self.tracker is not None:
+            gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+            if self._tracking and self._since_detection < self.redetect_interval:
+                with self.metrics.time("track"):
+                    boxes, quality = self.tracker.update(gray)
+                if boxes is not None and quality >= self.min_track_quality:
+                    self._since_detection += 1
+                    self.tracked_frames += 1
+                    return [scale_box(box, 1.0 / self.scale, rgb_frame.shape) for box in boxes]
+
+        with self.metrics.time("detect"):
+            boxes = self._fr.face_locations(small, self.upsample, self.detector)
+        self.detector_invocations += 1
+        if gray is not None:
+            with self.metrics.time("track"):
+                self._tracking = bool(boxes) and self.tracker.start(gray, boxes)
+            self._since_detection = 0
+        if self.scale == 1:
+            return boxes
+        return [scale_box(box, 1.0 / self.scale, rgb_frame.shape) for box in boxes]
+
+    def format_stats(self):
+        return (f"Detector: {self.detector_invocations} lần / {self.frames} khung hình"
+                f" ({self.tracked_frames} khung hình theo dõi)")
+
+    def _crop(self, rgb_frame, face_locations):
+        # Landmarks and the ResNet encoder only ever look at the face region,
+        # so hand dlib a crop that covers all boxes plus a margin instead of
+        # the whole frame
+        height, width = rgb_frame.shape[:2]
+        tops, rights, bottoms, lefts = zip(*face_locations)
+        margin_y = int((max(bottoms) - min(tops)) * CROP_MARGIN)
+        margin_x = int((max(rights) - min(lefts)) * CROP_MARGIN)
+        y0 = max(0, min(tops) - margin_y)
+        y1 = min(height, max(bottoms) + margin_y)
+        x0 = max(0, min(lefts) - margin_x)
+        x1 = min(width, max(rights) + margin_x)
+
+        crop = np.ascontiguousarray(rgb_frame[y0:y1, x0:x1])
+        local_locations = [(top - y0, right - x0, bottom - y0, left - x0)
+                           for (top, right, bottom, left) in face_locations]
+        return crop, local_locations
+
+    def encode(self, rgb_frame, face_locations):
+        if not face_locations:
+            return []
+        with self.metrics.time("encode"):
+            return self._fr.face_encodings(*self._crop(rgb_frame, face_locations))
+
+    def encode_batch(self, frames):
+        # frames is a list of (rgb_frame, face_locations); returns one list of
+        # encodings per frame. All crops go through the dlib encoder in a
+        # single call, which amortizes the per-call overhead over the batch.
+        if len(frames) == 1:
+            return [self.encode(*frames[0])]
+        crops = [self._crop(rgb_frame, locations) if locations else (None, [])
+                 for rgb_frame, locations in frames]
+        encoder = self._get_batch_encoder()
+        if encoder is None:
+            # Encode frame by frame (landmarks are included in the encode time)
+            with self.metrics.time("encode"):
+                return [self._fr.face_encodings(crop, local_locations) if local_locations else []
+                        for crop, local_locations in crops]
+        images, shapes = [], []
+        with self.metrics.time("landmarks"):
+            for crop, local_locations in crops:
+                if local_locations:
+                    images.append(crop)
+                    shapes.append(encoder.landmarks(crop, local_locations))
+        with self.metrics.time("encode"):
+            descriptors = iter(encoder.encode(images, shapes) if images else [])
+        return [[np.array(d) for d in next(descriptors)] if local_locations else []
+                for _, local_locations in crops]
+
+    def _get_batch_encoder(self):
+        # Checked on the first batch, once; None when batches cannot be encoded
+        if self._batch_encoder is None:
+            try:
+                self._batch_encoder = BatchEncoder(self._fr.api)
+            except (ImportError, AttributeError, TypeError) as e:
+                print(f"Warning: batch encoding is not available ({e}), encoding frame by frame")
+                self._batch_encoder = False
+        return self._batch_encoder or None
+
+class BatchEncoder:
+    # The 5-point landmark model and ResNet encoder face_recognition has
+    # already loaded (module attributes of face_recognition.api), driven
+    # directly so that a whole batch of crops goes through one
+    # compute_face_descriptor call
+    def __init__(self, api):
+        import dlib
+        self._dlib = dlib
+        self.pose_predictor = api.pose_predictor_5_point
+        self.encoder = api.face_encoder
+        # dlib builds without the batch overload raise TypeError here
+        self.encoder.compute_face_descriptor([], [], 1)
+
+    def landmarks(self, crop, face_locations):
+        detections = self._dlib.full_object_detections()
+        for top, right, bottom, left in face_locations:
+            detections.append(self.pose_predictor(crop, self._dlib.rectangle(left, top, right, bottom)))
+        return detections
+
+    def encode(self, images, shapes):
+        return self.encoder.compute_face_descriptor(images, shapes, 1)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# Cheap frame-to-frame face box tracking for FacePipeline.
+#
+# After a full detection, corner features inside each face box are followed
+# with pyramidal Lucas-Kanade optical flow. Each point is also tracked
+# backwards and kept only if it returns close to where it started
+# (forward-backward check). The box moves by the median point displacement
+# and scales by the median change of spread. The fraction of surviving
+# points is the tracking quality; when it drops, the caller runs the
+# detector again.
+import cv2
+import numpy as np
+
+class OpticalFlowTracker:
+    def __init__(self, max_corners=40, min_points=6, max_fb_error=1.0):
+        self.max_corners = max_corners
+        self.min_points = min_points
+        self.max_fb_error = max_fb_error
+        self.lk_params = dict(winSize=(15, 15), maxLevel=2,
+                              criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+        self.reset()
+
+    def reset(self):
+        self.prev_gray = None
+        self.tracks = []
+
+    def start(self, gray, boxes):
+        # Returns False when a box has too little texture to be tracked
+        self.reset()
+        tracks = []
+        for (top, right, bottom, left) in boxes:
+            # Shrink the box a little so background corners are not picked up
+            dy, dx = (bottom - top) // 8, (right - left) // 8
+            mask = np.zeros(gray.shape, dtype=np.uint8)
+            mask[max(0, top + dy):max(0, bottom - dy), max(0, left + dx):max(0, right - dx)] = 255
+            points = cv2.goodFeaturesToTrack(gray, self.max_corners, 0.01, 3, mask=mask)
+            if points is None or len(points) < self.min_points:
+                return False
+            tracks.append((np.array([top, right, bottom, left], dtype=np.float32), points))
+        self.prev_gray = gray
+        self.tracks = tracks
+        return bool(tracks)
+
+    def update(self, gray):
+        # Returns (boxes, quality); boxes is None when tracking was lost
+        if self.prev_gray is None or not self.tracks:
+            return None, 0.0
+        if gray.shape != self.prev_gray.shape:
+            # The camera changed resolution; the old points mean nothing
+            self.reset()
+            return None, 0.0
+        boxes = []
+        tracks = []
+        quality = 1.0
+        for box, points in self.tracks:
+            new_points, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, points, None, **self.lk_params)
+            back_points, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self.prev_gray, new_points, None,
+                                                                   **self.lk_params)
+            fb_error = np.linalg.norm((points - back_points).reshape(-1, 2), axis=1)
+            good = (status.ravel() == 1) & (back_status.ravel() == 1) & (fb_error < self.max_fb_error)
+            quality = min(quality, float(good.mean()))
+            if good.sum() < self.min_points:
+                self.reset()
+                return None, quality
+
+            old = points.reshape(-1, 2)[good]
+            new = new_points.reshape(-1, 2)[good]
+            dx, dy = np.median(new - old, axis=0)
+            old_spread = np.median(np.linalg.norm(old - np.median(old, axis=0), axis=1))
+            new_spread = np.median(np.linalg.norm(new - np.median(new, axis=0), axis=1))
+            scale = new_spread / old_spread if old_spread > 0 else 1.0
+
+            top, right, bottom, left = box
+            cy, cx = (top + bottom) / 2 + dy, (left + right) / 2 + dx
+            half_h, half_w = (bottom - top) / 2 * scale, (right - left) / 2 * scale
+            box = np.array([cy - half_h, cx + half_w, cy + half_h, cx - half_w], dtype=np.float32)
+            boxes.append(tuple(float(v) for v in box))
+            tracks.append((box, new.reshape(-1, 1, 2)))
+
+        self.prev_gray = gray
+        self.tracks = tracks
+        return boxes, quality
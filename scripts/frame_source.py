@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# Frame sources for authenticate_face and collect_faces.py.
+#
+# A source is a camera index (or device path / stream URL), a video file, a
+# directory of images or an in-memory generator. Replayed sources expose the
+# same read/grab/isOpened/release/pause/resume API as ThreadedCapture, so
+# the scripts, the service and the benchmark run unchanged on a machine
+# without a camera. Replay is deterministic: frames come out in the same
+# order every time, as fast as they are read unless fps is given.
+# RecordingSource saves the frames a live login actually processed, so a
+# failed login can be replayed later for profiling.
+import abc
+import os
+import time
+
+import cv2
+
+from camera import ThreadedCapture
+
+DEFAULT_SOURCE = os.environ.get("CAMERA_INDEX", "0")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+class FrameSource(abc.ABC):
+    def __init__(self, fps=None, loop=False):
+        self.fps = fps
+        self.loop = loop
+        self._frames = None
+        self._pending = None
+        self._next_due = 0.0
+        self._opened = False
+        # Frames taken from the current pass over the source; unlike the
+        # stats it is not reset between requests, so it decides whether the
+        # source can loop
+        self._pass_frames = 0
+        self.reset_stats()
+
+    @abc.abstractmethod
+    def _open(self):
+        # Returns an iterator over BGR frames
+        pass
+
+    def _start(self):
+        self._frames = self._open()
+        self._pass_frames = 0
+        self._opened = True
+
+    def reset_stats(self):
+        self.frames_delivered = 0
+        self.read_failures = 0
+
+    def _peek(self):
+        if self._pending is None and self._frames is not None:
+            self._pending = next(self._frames, None)
+            if self._pending is None and self.loop and self._pass_frames:
+                # Restart only a source that produced frames, so an empty
+                # one fails instead of reopening forever
+                self._start()
+                self._pending = next(self._frames, None)
+            if self._pending is not None:
+                self._pass_frames += 1
+        return self._pending
+
+    def read(self, timeout=1.0):
+        frame = self._peek()
+        if frame is None:
+            self.read_failures += 1
+            return False, None
+        self._pending = None
+        if self.fps:
+            # Pace the replay like a camera running at fps
+            delay = self._next_due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_due = max(self._next_due, time.monotonic()) + 1.0 / self.fps
+        self.frames_delivered += 1
+        return True, frame
+
+    def grab(self, timeout=1.0):
+        # Replayed frames are never stale, so grab does not consume one
+        return self._peek() is not None
+
+    def pause(self):
+        pass
+
+    def resume(self):
+        pass
+
+    def isOpened(self):
+        return self._opened
+
+    def release(self):
+        self._opened = False
+        self._frames = None
+        self._pending = None
+
+    def stats(self):
+        return {"frames_delivered": self.frames_delivered, "read_failures": self.read_failures}
+
+    def format_stats(self):
+        s = self.stats()
+        return f"replayed {s['frames_delivered']}, read failures {s['read_failures']}"
+
+class ImageDirectorySource(FrameSource):
+    # Images are replayed in file name order
+    def __init__(self, path, fps=None, loop=False):
+        super().__init__(fps, loop)
+        self.path = path
+        self.files = sorted(os.path.join(path, name) for name in os.listdir(path)
+                            if name.lower().endswith(IMAGE_EXTENSIONS))
+        if self.files:
+            self._start()
+
+    def _open(self):
+        for file in self.files:
+            frame = cv2.imread(file)
+            if frame is not None:
+                yield frame
+
+class VideoFileSource(FrameSource):
+    def __init__(self, path, fps=None, loop=False):
+        super().__init__(fps, loop)
+        self.path = path
+        self._cap = None
+        probe = cv2.VideoCapture(path)
+        if probe.isOpened():
+            self._start()
+        probe.release()
+
+    def _open(self):
+        if self._cap is not None:
+            self._cap.release()
+        self._cap = cv2.VideoCapture(self.path)
+        return self._read_all(self._cap)
+
+    def _read_all(self, cap):
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                return
+            yield frame
+
+    def release(self):
+        super().release()
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+class GeneratorSource(FrameSource):
+    # frames is an iterable of BGR frames, or a callable returning one (which
+    # allows loop=True to restart it)
+    def __init__(self, frames, fps=None, loop=False):
+        super().__init__(fps, loop)
+        self.frames = frames
+        self._start()
+
+    def _open(self):
+        return iter(self.frames() if callable(self.frames) else self.frames)
+
+class RecordingSource:
+    # Wraps another source and writes every frame handed out by read() to
+    # directory as a lossless PNG, numbered in delivery order, so the
+    # directory replays exactly what was processed
+    def __init__(self, source, directory):
+        self.source = source
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.frames_recorded = 0
+
+    def read(self, timeout=1.0):
+        ret, frame = self.source.read(timeout)
+        if ret:
+            cv2.imwrite(os.path.join(self.directory, f"frame_{self.frames_recorded:06d}.png"), frame)
+            self.frames_recorded += 1
+        return ret, frame
+
+    def grab(self, timeout=1.0):
+        return self.source.grab(timeout)
+
+    def pause(self):
+        self.source.pause()
+
+    def resume(self):
+        self.source.resume()
+
+    def isOpened(self):
+        return self.source.isOpened()
+
+    def release(self):
+        self.source.release()
+
+    def reset_stats(self):
+        self.source.reset_stats()
+
+    def stats(self):
+        return {**self.source.stats(), "frames_recorded": self.frames_recorded}
+
+    def format_stats(self):
+        return f"{self.source.format_stats()}, recorded {self.frames_recorded} to {self.directory}"
+
+# Not a subclass, since it has no frames of its own, but it offers the same
+# API (and stats) as every other FrameSource
+FrameSource.register(RecordingSource)
+
+def open_frame_source(source=DEFAULT_SOURCE, fps=None, loop=False):
+    # source: camera index (int or digit string), image directory, video
+    # file, device path / stream URL, or an iterable/callable of frames
+    if not isinstance(source, (int, str)):
+        return GeneratorSource(source, fps, loop)
+    if isinstance(source, int) or source.isdigit():
+        return ThreadedCapture(int(source))
+    if os.path.isdir(source):
+        return ImageDirectorySource(source, fps, loop)
+    if os.path.isfile(source):
+        return VideoFileSource(source, fps, loop)
+    # e.g. /dev/video2 or an rtsp:// stream: a live camera
+    return ThreadedCapture(source)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# Per-stage timing and counters for face_auth.py and train_model.py.
+#
+# Stages are timed with perf_counter around the code they cover and kept
+# in memory; flush() turns the samples collected since the last flush into
+# one record and writes it to the configured sink:
+#   *.prom   Prometheus text format (node_exporter textfile collector). The
+#            file is rewritten atomically with totals since the process
+#            started, so a long-running service keeps accumulating.
+#   other    JSON lines: one object per authentication attempt or training
+#            run, appended to the file.
+# The PAM module throws stderr away, so a file is the only way to see where
+# login time goes on a real machine.
+import contextlib
+import json
+import os
+import time
+from collections import defaultdict
+
+import numpy as np
+
+METRICS_PATH = os.environ.get("FACE_AUTH_METRICS", "")
+PROMETHEUS_EXTENSION = ".prom"
+
+class Metrics:
+    def __init__(self, path=None, prefix="face_auth"):
+        self.path = path
+        self.prefix = prefix
+        self.samples = defaultdict(list)
+        self.counters = defaultdict(int)
+        self.fields = {}
+        # Totals since start, for the Prometheus file
+        self.stage_sums = defaultdict(float)
+        self.stage_counts = defaultdict(int)
+        self.counter_totals = defaultdict(int)
+        self.result_totals = defaultdict(int)
+
+    def observe(self, stage, seconds):
+        self.samples[stage].append(seconds)
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def merge(self, other):
+        # Add the samples and counters of another Metrics, e.g. one that
+        # covered a single request of the service
+        for stage, samples in other.samples.items():
+            self.samples[stage].extend(samples)
+        for name, n in other.counters.items():
+            self.counters[name] += n
+
+    def annotate(self, **fields):
+        # Extra fields for the next record, e.g. the decision
+        self.fields.update(fields)
+
+    def summary(self):
+        stages = {}
+        for stage, samples in self.samples.items():
+            ms = np.asarray(samples) * 1000.0
+            stages[stage] = {"count": len(ms), "total_ms": round(float(ms.sum()), 3),
+                             "p50_ms": round(float(np.percentile(ms, 50)), 3),
+                             "p90_ms": round(float(np.percentile(ms, 90)), 3),
+                             "max_ms": round(float(ms.max()), 3)}
+        return {"stages": stages, "counters": dict(self.counters)}
+
+    def flush(self, **fields):
+        # Emit everything observed since the last flush, then start over
+        fields = {**self.fields, **fields}
+        record = {"time": round(time.time(), 3), **fields, **self.summary()}
+        for stage, samples in self.samples.items():
+            self.stage_sums[stage] += sum(samples)
+            self.stage_counts[stage] += len(samples)
+        for name, n in self.counters.items():
+            self.counter_totals[name] += n
+        if "result" in fields:
+            self.result_totals[fields["result"]] += 1
+        self.samples.clear()
+        self.counters.clear()
+        self.fields = {}
+
+        if self.path:
+            try:
+                if self.path.endswith(PROMETHEUS_EXTENSION):
+                    self._write_prometheus()
+                else:
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            except OSError as e:
+                print(f"Warning: Could not write metrics to {self.path}: {e}")
+        return record
+
+    def _write_prometheus(self):
+        lines = [f"# TYPE {self.prefix}_stage_seconds summary"]
+        for stage in sorted(self.stage_sums):
+            lines.append(f'{self.prefix}_stage_seconds_sum{{stage="{stage}"}} {self.stage_sums[stage]:.6f}')
+            lines.append(f'{self.prefix}_stage_seconds_count{{stage="{stage}"}} {self.stage_counts[stage]}')
+        for name in sorted(self.counter_totals):
+            lines.append(f"# TYPE {self.prefix}_{name}_total counter")
+            lines.append(f"{self.prefix}_{name}_total {self.counter_totals[name]}")
+        if self.result_totals:
+            lines.append(f"# TYPE {self.prefix}_results_total counter")
+            for result in sorted(self.result_totals):
+                lines.append(f'{self.prefix}_results_total{{result="{result}"}} {self.result_totals[result]}')
+        # Write and rename so the collector never reads a partial file
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.path)
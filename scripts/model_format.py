@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# Compact, versioned model file (.fam) used instead of pickle.
+#
+# Layout (little endian):
+#   header   magic "FACEAUTH", version u16, reserved u16, section count u32,
+#            embedding dim u32, user count u32, row count u64
+#   table    one entry per section: name (16 bytes, NUL padded), offset u64,
+#            size u64
+#   sections each aligned to 64 bytes:
+#            embeddings  float32 [rows, dim], grouped per user
+#            sq_norms    float32 [rows], squared norm of each row
+#            counts      int64   [users], rows per user, in the same order
+#            names       UTF-8 user names separated by NUL bytes
+#            meta        UTF-8 JSON with free-form metadata
+#            prototypes  float32 [prototypes, dim], per-user centroids or
+#                        medoids for coarse-to-fine matching, grouped per user
+#            proto_counts int64  [users], prototypes per user
+#
+# The float blocks are memory-mapped, not read, so load time and resident
+# memory do not grow with the number of enrolled users. Unknown sections
+# are ignored by readers, so new ones can be added without a version bump.
+import json
+import os
+import pickle
+import struct
+
+import numpy as np
+
+from embedding_index import EMBEDDING_DIM, PROTOTYPES_PER_USER, EmbeddingIndex, SingleUserModel
+
+MAGIC = b"FACEAUTH"
+FORMAT_VERSION = 1
+MODEL_EXTENSION = ".fam"
+
+# Sections written by save_model itself; anything else is carried over by
+# load_trained_model/save_trained_model
+STANDARD_SECTIONS = ("embeddings", "sq_norms", "counts", "names", "meta", "prototypes", "proto_counts")
+
+_HEADER = struct.Struct("<8sHHIIIQ")
+_SECTION = struct.Struct("<16sQQ")
+_ALIGN = 64
+
+class ModelFormatError(Exception):
+    pass
+
+def is_binary_model(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+def _align(offset):
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+def save_model(path, index, metadata=None, extra_sections=None):
+    # extra_sections maps section names to bytes or float32/int64 arrays
+    sections = [
+        ("embeddings", np.ascontiguousarray(index.embeddings, dtype="<f4").tobytes()),
+        ("sq_norms", np.ascontiguousarray(index.sq_norms, dtype="<f4").tobytes()),
+        ("counts", np.asarray(index.counts, dtype="<i8").tobytes()),
+        ("names", b"\0".join(user.encode("utf-8") for user in index.users)),
+        ("meta", json.dumps(metadata or {}).encode("utf-8")),
+    ]
+    prototypes, prototype_counts = index.prototypes()
+    sections += [
+        ("prototypes", np.ascontiguousarray(prototypes, dtype="<f4").tobytes()),
+        ("proto_counts", np.asarray(prototype_counts, dtype="<i8").tobytes()),
+    ]
+    for name, data in (extra_sections or {}).items():
+        sections.append((name, data if isinstance(data, bytes) else np.ascontiguousarray(data).tobytes()))
+
+    offset = _align(_HEADER.size + _SECTION.size * len(sections))
+    table = []
+    for name, data in sections:
+        table.append((name, offset, len(data)))
+        offset = _align(offset + len(data))
+
+    # Write to a temporary file and rename so a running service never sees
+    # a half-written model
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(sections), EMBEDDING_DIM,
+                             len(index.users), len(index.embeddings)))
+        for name, section_offset, size in table:
+            f.write(_SECTION.pack(name.encode("ascii"), section_offset, size))
+        for (name, data), (_, section_offset, _) in zip(sections, table):
+            f.seek(section_offset)
+            f.write(data)
+    os.replace(tmp_path, path)
+
+class ModelFile:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                raise ModelFormatError(f"{path}: file is truncated")
+            magic, version, _, section_count, dim, n_users, n_rows = _HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ModelFormatError(f"{path}: not a face_auth model file")
+            if version > FORMAT_VERSION:
+                raise ModelFormatError(f"{path}: format version {version} is newer than supported ({FORMAT_VERSION})")
+            if dim != EMBEDDING_DIM:
+                raise ModelFormatError(f"{path}: unexpected embedding size {dim}")
+            self.version = version
+            self.n_users = n_users
+            self.n_rows = n_rows
+            self.sections = {}
+            for _ in range(section_count):
+                name, offset, size = _SECTION.unpack(f.read(_SECTION.size))
+                self.sections[name.rstrip(b"\0").decode("ascii")] = (offset, size)
+            self._small = {name: self._read(f, name) for name in ("counts", "names", "meta")}
+
+    def _read(self, f, name):
+        offset, size = self.sections[name]
+        f.seek(offset)
+        return f.read(size)
+
+    def array(self, name, dtype, shape):
+        # Memory-mapped view of a section; nothing is read until it is used
+        if name not in self.sections:
+            return None
+        offset, size = self.sections[name]
+        if size == 0:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(self.path, dtype=dtype, mode="r", offset=offset, shape=shape)
+
+    def read_section(self, name):
+        if name not in self.sections:
+            return None
+        with open(self.path, "rb") as f:
+            return self._read(f, name)
+
+    @property
+    def users(self):
+        names = self._small["names"]
+        return names.decode("utf-8").split("\0") if self.n_users else []
+
+    @property
+    def counts(self):
+        return np.frombuffer(self._small["counts"], dtype="<i8")
+
+    @property
+    def metadata(self):
+        return json.loads(self._small["meta"].decode("utf-8") or "{}")
+
+    def index(self):
+        # Files written before prototypes existed get them computed on first use
+        prototypes = prototype_counts = None
+        per_user = PROTOTYPES_PER_USER
+        if "proto_counts" in self.sections:
+            prototype_counts = np.frombuffer(self.read_section("proto_counts"), dtype="<i8")
+            prototypes = self.array("prototypes", "<f4", (int(prototype_counts.sum()), EMBEDDING_DIM))
+            if len(prototype_counts):
+                per_user = int(prototype_counts.max())
+        return EmbeddingIndex(self.array("embeddings", "<f4", (self.n_rows, EMBEDDING_DIM)),
+                              self.users, self.counts,
+                              sq_norms=self.array("sq_norms", "<f4", (self.n_rows,)),
+                              prototypes=prototypes, prototype_counts=prototype_counts,
+                              prototypes_per_user=per_user)
+
+def load_model(path):
+    model = ModelFile(path)
+    return model.index(), model.metadata
+
+def load_pickled_model(path):
+    # (clf, face_encodings, face_names, metadata) from a .pkl model; files
+    # written before metadata was stored hold only the first three
+    with open(path, 'rb') as f:
+        model = pickle.load(f)
+    if len(model) == 3:
+        return (*model, {})
+    return tuple(model)
+
+def read_model_metadata(path):
+    if is_binary_model(path):
+        return ModelFile(path).metadata
+    return load_pickled_model(path)[3]
+
+def load_trained_model(path):
+    # (clf, face_encodings, face_names, metadata, extra_sections) for
+    # rewriting a model with save_trained_model. A .fam model is copied
+    # into memory, since the file is about to be replaced, and has no
+    # separate encodings; a pickle has no extra sections.
+    if is_binary_model(path):
+        model = ModelFile(path)
+        index = model.index()
+        extra = {name: model.read_section(name) for name in model.sections if name not in STANDARD_SECTIONS}
+        index = EmbeddingIndex(np.array(index.embeddings), index.users, index.counts,
+                               prototypes_per_user=index.prototypes_per_user)
+        return index, None, None, model.metadata, extra
+    clf, face_encodings, face_names, metadata = load_pickled_model(path)
+    return clf, list(face_encodings), list(face_names), metadata, None
+
+def save_trained_model(path, clf, face_encodings, face_names, metadata=None, extra_sections=None):
+    if path.endswith(MODEL_EXTENSION):
+        save_model(path, clf, metadata, extra_sections)
+    else:
+        # Write to a temporary file and rename so a running service never
+        # loads a half-written model
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((clf, face_encodings, face_names, metadata or {}), f)
+        os.replace(tmp_path, path)
+
+def build_classifier(face_encodings, face_names, classifier="svm", top_k=3, scoring="topk",
+                     prototypes=PROTOTYPES_PER_USER):
+    # The model train_model.py fits, and enroll.py refits from the stored
+    # encodings; sklearn is only imported once something is fitted
+    from sklearn import svm
+    from sklearn.neighbors import KNeighborsClassifier
+
+    unique_users = set(face_names)
+    try:
+        if classifier == "index":
+            # Nothing to fit: samples are matched directly and users can be
+            # added or removed later without retraining
+            print("Đang xây dựng chỉ mục embedding...")
+            clf = EmbeddingIndex.from_samples(face_encodings, face_names, prototypes)
+            # Per-user prototypes for coarse-to-fine matching are stored in the model
+            clf.prototypes()
+        elif len(unique_users) < 2:
+            print("Cảnh báo: Chỉ phát hiện một người dùng. SVM cần ít nhất 2 lớp.")
+            print("Sử dụng mô hình đặc biệt cho một người dùng...")
+            
+            clf = SingleUserModel(face_encodings, list(unique_users)[0], top_k, scoring)
+        else:
+            print("Đang huấn luyện mô hình SVM...")
+            clf = svm.SVC(gamma='scale', probability=True)
+            clf.fit(face_encodings, face_names)
+    except Exception as e:
+        print(f"Lỗi khi huấn luyện mô hình SVM: {e}")
+        print("Chuyển sang KNeighborsClassifier...")
+        clf = KNeighborsClassifier(n_neighbors=min(3, len(face_encodings)), metric='euclidean')
+        clf.fit(face_encodings, face_names)
+    return clf
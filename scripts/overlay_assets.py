@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# Precomputed UI assets.
+#
+# The face.png overlay is resized once per quantized size (HOG boxes are
+# square, so one side length is enough; the renderer builds all sizes when
+# its window opens, and get() builds any missing one) and stored with
+# premultiplied alpha as 8.8 fixed-point uint16, so blending it over a face
+# costs one multiply and one add per pixel in integer arithmetic. The tinted result icons for
+# show_auth_ui are built once per process and reused.
+import functools
+import os
+
+import cv2
+import numpy as np
+
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "images")
+FACE_IMAGE = os.path.join(IMAGES_DIR, "face.png")
+
+OVERLAY_OPACITY = 0.3  # Transparency factor of the face template
+SIZE_STEP = 16
+MIN_SIZE = 32
+MAX_SIZE = 480
+
+# Message, text colour and tint (RGB) for each authentication result
+RESULT_STYLES = {
+    "success": ("Authentication Successful", "green", (0, 255, 0)),
+    "not_recognized": ("Face Not Recognized", "orange", (255, 165, 0)),
+    "failure": ("Authentication Failed", "red", (255, 0, 0)),
+}
+
+def load_bgra(path=FACE_IMAGE):
+    image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        return None
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGRA)
+    elif image.shape[2] == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2BGRA)
+    return image
+
+class OverlayAssets:
+    def __init__(self, path=FACE_IMAGE, opacity=OVERLAY_OPACITY, step=SIZE_STEP,
+                 min_size=MIN_SIZE, max_size=MAX_SIZE):
+        self.opacity = opacity
+        self.step = step
+        self.min_size = min_size
+        self.max_size = max_size
+        self.sizes = {}
+        self.source = load_bgra(path)
+
+    def __bool__(self):
+        return self.source is not None
+
+    def _build(self, size):
+        resized = cv2.resize(self.source, (size, size), interpolation=cv2.INTER_AREA)
+        alpha = resized[:, :, 3:4].astype(np.float32) / 255.0 * self.opacity
+        # Integer weights that always sum to 256, so the blend cannot overflow
+        inverse = np.rint((1.0 - alpha) * 256).astype(np.uint16)
+        premultiplied = resized[:, :, :3].astype(np.uint16) * (256 - inverse)
+        return premultiplied, inverse
+
+    def precompute(self, sizes=None):
+        if self.source is None:
+            return
+        for size in sizes or range(self.min_size, self.max_size + 1, self.step):
+            self.get(size)
+
+    def get(self, size):
+        size = self.quantize(size)
+        if size not in self.sizes:
+            self.sizes[size] = self._build(size)
+        return size, self.sizes[size]
+
+    def quantize(self, size):
+        size = int(round(size / self.step)) * self.step
+        return min(max(size, self.min_size), self.max_size)
+
+    def blend(self, frame, top, right, bottom, left):
+        # Blend the overlay, in place, over a square of the nearest
+        # precomputed size centred on the face box
+        if self.source is None or right <= left or bottom <= top:
+            return
+        size, (premultiplied, inverse) = self.get(max(right - left, bottom - top))
+
+        y0 = (top + bottom - size) // 2
+        x0 = (left + right - size) // 2
+        # Clip against the frame edges
+        fy0, fx0 = max(y0, 0), max(x0, 0)
+        fy1 = min(y0 + size, frame.shape[0])
+        fx1 = min(x0 + size, frame.shape[1])
+        if fy1 <= fy0 or fx1 <= fx0:
+            return
+        oy, ox = fy0 - y0, fx0 - x0
+        h, w = fy1 - fy0, fx1 - fx0
+
+        roi = frame[fy0:fy1, fx0:fx1]
+        blended = roi * inverse[oy:oy + h, ox:ox + w] + premultiplied[oy:oy + h, ox:ox + w]
+        np.right_shift(blended, 8, out=blended)
+        roi[...] = blended
+
+@functools.lru_cache(maxsize=None)
+def result_icon(result, size=100):
+    # Tinted face.png (or a text fallback) for show_auth_ui, as a PIL image
+    from PIL import Image, ImageDraw
+
+    message, color, tint = RESULT_STYLES.get(result, RESULT_STYLES["failure"])
+    if not os.path.exists(FACE_IMAGE):
+        # Create a basic image with text
+        img = Image.new('RGB', (size, size), color=(255, 255, 255))
+        draw = ImageDraw.Draw(img)
+        label = {"success": "SUCCESS", "not_recognized": "NOT RECOGNIZED"}.get(result, "FAILURE")
+        draw.text((5 if result == "not_recognized" else 25, 40), label, fill=tint)
+        return img
+
+    img = Image.open(FACE_IMAGE).convert('RGBA').resize((size, size), Image.LANCZOS)
+    overlay = Image.new('RGBA', img.size, (*tint, 80))  # Semi-transparent color
+    return Image.alpha_composite(img, overlay)
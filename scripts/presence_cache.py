@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# Verified-presence cache for the service (face_auth.py --service
+# --presence-ttl N).
+#
+# After a successful verification the request's camera subscription is kept
+# open and watched at a low frame rate. While the verified user stays in
+# front of the camera, another prompt for the same user, from the same login
+# session and on the same camera, is answered at once. The entry is dropped
+# as soon as any of these happens:
+#   - the TTL runs out (counted from the verification, never extended)
+#   - max_absent_frames watched frames in a row show no face, or only faces
+#     that do not match the user
+#   - the camera delivers no frame for frame_timeout seconds
+# Requests whose login session is unknown are never cached. Without
+# --presence-ttl the service does not create a cache at all.
+import asyncio
+import time
+
+DEFAULT_MAX_ABSENT_FRAMES = 3
+FRAME_TIMEOUT = 2.0
+
+class PresenceCache:
+    def __init__(self, ttl, max_absent_frames=DEFAULT_MAX_ABSENT_FRAMES, frame_timeout=FRAME_TIMEOUT):
+        if ttl <= 0:
+            raise ValueError(f"ttl must be positive, got {ttl}")
+        self.ttl = ttl
+        self.max_absent_frames = max_absent_frames
+        self.frame_timeout = frame_timeout
+        # (username, session, camera) -> (expires_at, watcher task)
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, username, session, camera):
+        if session is None:
+            return False
+        entry = self._entries.get((username, session, camera))
+        if entry is None or time.monotonic() >= entry[0]:
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def remember(self, username, session, camera, subscription, still_present, release):
+        # Takes over subscription; still_present(result) tells whether a
+        # frame shows the verified user, release() ends the subscription.
+        # Returns False (and releases at once) if the request cannot be cached.
+        if session is None:
+            release()
+            return False
+        key = (username, session, camera)
+        self.invalidate(key)
+        expires_at = time.monotonic() + self.ttl
+        subscription.passive = True
+        task = asyncio.get_running_loop().create_task(
+            self._watch(key, expires_at, subscription, still_present, release))
+        self._entries[key] = (expires_at, task)
+        return True
+
+    async def _watch(self, key, expires_at, subscription, still_present, release):
+        absent = 0
+        reason = "expired"
+        try:
+            while True:
+                remaining = expires_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    result = await subscription.get(min(remaining, self.frame_timeout))
+                except asyncio.TimeoutError:
+                    if time.monotonic() < expires_at:
+                        reason = "no frames"
+                    break
+                if result is not None and still_present(result):
+                    absent = 0
+                    continue
+                absent += 1
+                if absent >= self.max_absent_frames:
+                    reason = "face left"
+                    break
+        finally:
+            release()
+            if self._entries.get(key, (None, None))[1] is asyncio.current_task():
+                del self._entries[key]
+        print(f"Presence of {key[0]} on camera {key[2]} ended: {reason}")
+
+    def invalidate(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry[1].cancel()
+
+    def clear(self):
+        for key in list(self._entries):
+            self.invalidate(key)
+
+    def format_stats(self):
+        return f"presence cache: {len(self._entries)} active, hits {self.hits}, misses {self.misses}"
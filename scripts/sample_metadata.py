@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# Sidecar metadata for enrollment images.
+#
+# collect_faces.py writes data/<user>/<name>.json next to each saved crop,
+# recording where the face sits inside the saved image. train_model.py then
+# passes that box to face_encodings as known_face_locations and skips the
+# HOG detector, which is both faster and does not lose samples on tight
+# crops where HOG fails to re-detect the face.
+#
+# dlib's landmark model is tuned to the boxes of its own detectors, which
+# authentication uses too, so only boxes from those (DLIB_DETECTORS) are
+# used as they are. Any other box, such as a Haar cascade box, is only a
+# hint: training runs HOG on the crop and takes the detection that overlaps
+# the hint, falling back to the hint when HOG finds nothing there.
+import json
+import os
+
+METADATA_VERSION = 1
+DLIB_DETECTORS = ("hog", "cnn")
+
+def metadata_path(img_path):
+    return os.path.splitext(img_path)[0] + ".json"
+
+def write_sample_metadata(img_path, face_location, detector, source_box=None, frame_size=None):
+    data = {
+        "version": METADATA_VERSION,
+        # (top, right, bottom, left) inside the saved image, as used by face_recognition
+        "face_location": [int(v) for v in face_location],
+        "detector": detector,
+    }
+    if source_box is not None:
+        data["source_box"] = [int(v) for v in source_box]
+    if frame_size is not None:
+        data["frame_size"] = [int(v) for v in frame_size]
+    with open(metadata_path(img_path), "w") as f:
+        json.dump(data, f)
+
+def read_face_box(img_path):
+    # (face_location, detector) from the sidecar, or (None, None) when there
+    # is no usable sidecar
+    try:
+        with open(metadata_path(img_path)) as f:
+            data = json.load(f)
+        top, right, bottom, left = data["face_location"]
+        detector = data.get("detector", "haar")
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None, None
+    if bottom <= top or right <= left:
+        return None, None
+    return (top, right, bottom, left), detector
+
+def box_overlap(a, b):
+    # Intersection over union of two (top, right, bottom, left) boxes
+    height = min(a[2], b[2]) - max(a[0], b[0])
+    width = min(a[1], b[1]) - max(a[3], b[3])
+    if height <= 0 or width <= 0:
+        return 0.0
+    area = lambda box: (box[2] - box[0]) * (box[1] - box[3])
+    return height * width / (area(a) + area(b) - height * width)
+
+def closest_box(boxes, reference):
+    # The box that overlaps reference most, or None if none overlaps it
+    best = max(boxes, key=lambda box: box_overlap(box, reference), default=None)
+    if best is None or box_overlap(best, reference) == 0:
+        return None
+    return best
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# Quality gate and pose coverage for collect_faces.py.
+#
+# Every candidate crop is scored before it is saved:
+#   size       the shorter side of the face box, in pixels
+#   sharpness  variance of the Laplacian of the crop, resized to a fixed
+#              width so that the value does not depend on the face size
+#   pose       yaw and pitch estimated from the eye positions found by the
+#              Haar eye cascade inside the face box; no eyes (profile,
+#              closed eyes, motion blur) means the crop is rejected
+#   novelty    cosine similarity of a small normalized thumbnail to the
+#              samples already kept; near-duplicates are rejected
+# Kept samples are assigned to a pose bin (centre, left, right, up, down) and
+# collection stops once every bin holds enough samples.
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+MIN_FACE_SIZE = 80
+MIN_SHARPNESS = 60.0
+MAX_SIMILARITY = 0.97
+SHARPNESS_WIDTH = 128
+THUMBNAIL_SIZE = 24
+
+# Eye midpoint offsets (fractions of the face box) that count as turned
+YAW_LIMIT = 0.08
+PITCH_LIMIT = 0.06
+# Where the eyes sit in a frontal Haar face box, from the top
+EYE_LINE = 0.38
+
+POSE_BINS = ("center", "left", "right", "up", "down")
+
+Assessment = namedtuple("Assessment", "accepted reason size sharpness pose similarity thumbnail")
+
+def sharpness(gray_crop):
+    scale = SHARPNESS_WIDTH / gray_crop.shape[1]
+    resized = cv2.resize(gray_crop, (SHARPNESS_WIDTH, max(1, int(gray_crop.shape[0] * scale))),
+                         interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(resized, cv2.CV_64F).var())
+
+def thumbnail(gray_crop):
+    small = cv2.resize(gray_crop, (THUMBNAIL_SIZE, THUMBNAIL_SIZE), interpolation=cv2.INTER_AREA)
+    vector = cv2.equalizeHist(small).astype(np.float32).ravel()
+    vector -= vector.mean()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+class SampleQuality:
+    def __init__(self, min_face_size=MIN_FACE_SIZE, min_sharpness=MIN_SHARPNESS, max_similarity=MAX_SIMILARITY,
+                 check_pose=True):
+        self.min_face_size = min_face_size
+        self.min_sharpness = min_sharpness
+        self.max_similarity = max_similarity
+        self.check_pose = check_pose
+        self.eye_cascade = None
+        if check_pose:
+            self.eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
+        # Thumbnails of kept samples, one row each
+        self.kept = np.empty((0, THUMBNAIL_SIZE * THUMBNAIL_SIZE), dtype=np.float32)
+
+    def pose(self, gray_face):
+        # (yaw, pitch) offsets of the eye midpoint from where a frontal face
+        # has it, or None if two eyes are not found in the upper half
+        h, w = gray_face.shape[:2]
+        eyes = self.eye_cascade.detectMultiScale(gray_face[:h * 6 // 10], 1.1, 5, minSize=(w // 8, w // 8))
+        if len(eyes) < 2:
+            return None
+        # The two largest detections are the eyes
+        eyes = sorted(eyes, key=lambda e: e[2] * e[3], reverse=True)[:2]
+        cx = np.mean([x + ew / 2 for x, y, ew, eh in eyes])
+        cy = np.mean([y + eh / 2 for x, y, ew, eh in eyes])
+        return (cx / w - 0.5, cy / h - EYE_LINE)
+
+    def pose_bin(self, pose):
+        yaw, pitch = pose if pose is not None else (0.0, 0.0)
+        if yaw < -YAW_LIMIT:
+            return "left"
+        if yaw > YAW_LIMIT:
+            return "right"
+        if pitch < -PITCH_LIMIT:
+            return "up"
+        if pitch > PITCH_LIMIT:
+            return "down"
+        return "center"
+
+    def assess(self, gray_frame, x, y, w, h):
+        size = min(w, h)
+        gray_face = gray_frame[y:y + h, x:x + w]
+        if size < self.min_face_size:
+            return Assessment(False, "quá nhỏ", size, None, None, None, None)
+        sharp = sharpness(gray_face)
+        if sharp < self.min_sharpness:
+            return Assessment(False, "bị mờ", size, sharp, None, None, None)
+        pose = None
+        if self.check_pose:
+            pose = self.pose(gray_face)
+            if pose is None:
+                return Assessment(False, "không thấy mắt", size, sharp, None, None, None)
+        thumb = thumbnail(gray_face)
+        similarity = float((self.kept @ thumb).max()) if len(self.kept) else 0.0
+        if similarity > self.max_similarity:
+            return Assessment(False, "trùng lặp", size, sharp, pose, similarity, thumb)
+        return Assessment(True, "", size, sharp, pose, similarity, thumb)
+
+    def keep(self, assessment):
+        self.kept = np.vstack((self.kept, assessment.thumbnail[None, :]))
+
+class PoseCoverage:
+    # Counts kept samples per pose bin; complete once each bin holds
+    # per_bin samples (only the centre bin is required without pose checks)
+    def __init__(self, per_bin=6, bins=POSE_BINS):
+        self.per_bin = per_bin
+        self.counts = {name: 0 for name in bins}
+
+    def add(self, pose_bin):
+        self.counts[pose_bin] += 1
+
+    def missing(self):
+        return [name for name, count in self.counts.items() if count < self.per_bin]
+
+    def complete(self):
+        return not self.missing()
+
+    def format(self):
+        return " ".join(f"{name}:{min(count, self.per_bin)}/{self.per_bin}" for name, count in self.counts.items())
@@ -1,11 +1,17 @@
 #!/usr/bin/env python3
 import os
 import sys
-import pickle
-import numpy as np
-from sklearn import svm
-from sklearn.neighbors import KNeighborsClassifier
+import multiprocessing
 import argparse
+import time
+from collections import deque
+
+from embedding_index import PROTOTYPES_PER_USER, SCORING_MODES, prune_outliers
+from model_format import MODEL_EXTENSION, build_classifier, save_trained_model
+from dataset_loader import CROP_SIZE, PREFETCH_DEPTH, DatasetLoader, decode_image, scan_training_images, to_image_location
+from encoding_cache import CACHE_FILENAME, EncodingCache, file_digest, model_signature
+from sample_metadata import DLIB_DETECTORS, closest_box, read_face_box
+from metrics import METRICS_PATH, Metrics
 
 print("Starting train_model.py")
 print("Python path:", sys.path)
@@ -68,7 +74,199 @@ except ImportError as e:
         print(f"Error installing face_recognition: {e}")
         sys.exit(1)
 
-def train_face_model(data_dir="data", model_output="models/face_auth_model.pkl"):
+def encode_face(image, face_location=None, timings=None, redetect=False):
+    # Encoding and box of the first face in the image, or (None, None).
+    # A known face_location (from the enrollment sidecar) skips detection;
+    # with redetect it is only a hint, replaced by the HOG box overlapping it.
+    # Stage durations in seconds are stored in timings if given.
+    if timings is None:
+        timings = {}
+    if face_location is None or redetect:
+        start = time.perf_counter()
+        locations = face_recognition.face_locations(image)
+        timings["detect"] = time.perf_counter() - start
+        if face_location is None:
+            if not locations:
+                return None, None
+            face_location = locations[0]
+        else:
+            face_location = closest_box(locations, face_location) or face_location
+    start = time.perf_counter()
+    encoding = face_recognition.face_encodings(image, [face_location])[0]
+    timings["encode"] = time.perf_counter() - start
+    return encoding, face_location
+
+def _init_worker():
+    # Load the dlib models once per worker process. With the default fork
+    # start method they are inherited from the parent and this is a no-op.
+    import face_recognition  # noqa: F401
+
+def _encode_task(task):
+    image, face_location, redetect = task
+    timings = {}
+    try:
+        return encode_face(image, face_location, timings, redetect), None, timings
+    except Exception as e:
+        return None, str(e), timings
+
+def _sample_result(sample, face_location, result):
+    # Result of _encode_task for a loaded sample, with the face box in the
+    # coordinates of the original image
+    entry, error, timings = result
+    timings["load"] = sample.seconds
+    if entry is not None and entry[1] is not None:
+        encoding, box = entry
+        if face_location is None or box != sample.location:
+            box = to_image_location(box, sample.scale, sample.origin)
+        else:
+            box = face_location
+        entry = (encoding, box)
+    return entry, error, timings
+
+def encode_images(tasks, workers=1):
+    # tasks are (img_path, face_location or None, redetect); yields (entry,
+    # error, stage timings) for each task, in input order. Images are decoded
+    # and cropped ahead of time by a DatasetLoader, so the encoder (or each
+    # worker process) always has the next crop ready.
+    loader = DatasetLoader([task[:2] for task in tasks], depth=max(2, min(PREFETCH_DEPTH, len(tasks))))
+    if workers <= 1 or len(tasks) < 2:
+        for sample, (_, face_location, redetect) in zip(loader, tasks):
+            if sample.error is not None:
+                result = (None, sample.error, {})
+            else:
+                result = _encode_task((sample.image, sample.location, redetect))
+            loader.release(sample.slot)
+            yield _sample_result(sample, face_location, result)
+        return
+    workers = min(workers, len(tasks))
+    # Two crops per worker in flight; the rest of the loader's buffers keep
+    # the prefetch going meanwhile. A buffer is reused only after its result
+    # came back, so it has been sent to the worker by then.
+    in_flight = min(2 * workers, loader.depth // 2)
+    pending = deque()
+    with multiprocessing.Pool(workers, initializer=_init_worker) as pool:
+        for sample, (_, face_location, redetect) in zip(loader, tasks):
+            if sample.error is not None:
+                result = None
+            else:
+                result = pool.apply_async(_encode_task, ((sample.image, sample.location, redetect),))
+            pending.append((sample, face_location, result))
+            while len(pending) > in_flight or (pending and pending[0][2] is None):
+                yield _finish(loader, *pending.popleft())
+        while pending:
+            yield _finish(loader, *pending.popleft())
+
+def _finish(loader, sample, face_location, result):
+    result = result.get() if result is not None else (None, sample.error, {})
+    loader.release(sample.slot)
+    return _sample_result(sample, face_location, result)
+
+def encode_image(img_path, face_location=None, timings=None):
+    # encode_face for a single image file, preprocessed like the training set
+    if timings is None:
+        timings = {}
+    entry, error, stage_timings = next(encode_images([(img_path, face_location, False)]))
+    timings.update(stage_timings)
+    if error is not None:
+        raise ValueError(error)
+    return entry
+
+def whole_image_location(img_path):
+    # Treat a legacy crop without sidecar as one face filling the image
+    image = decode_image(img_path)
+    return (0, image.shape[1], image.shape[0], 0)
+
+def list_training_images(data_dir, users=None):
+    return scan_training_images(data_dir, users)
+
+def open_encoding_cache(model_output, cache_path=""):
+    return EncodingCache(cache_path or os.path.join(os.path.dirname(model_output), CACHE_FILENAME),
+                         model_signature(f"hog:1:crop{CROP_SIZE}"))
+
+def encode_training_images(images, cache=None, workers=1, assume_cropped=False, metrics=None):
+    # Encodings and user names for (user, img_path) pairs, in input order;
+    # cached images are not encoded again
+    if metrics is None:
+        metrics = Metrics()
+    face_encodings = []
+    face_names = []
+    
+    # Lấy kết quả từ cache trước; chỉ ảnh mới/đã thay đổi mới được mã hóa
+    entries = [None] * len(images)
+    keys = [None] * len(images)
+    with metrics.time("sidecars"):
+        boxes = [read_face_box(img_path) for _, img_path in images]
+    locations = [location for location, _ in boxes]
+    # Boxes from other detectors (Haar) are re-detected with HOG around the box
+    redetect = [location is not None and detector not in DLIB_DETECTORS for location, detector in boxes]
+    skipped_detection = sum(location is not None for location in locations) - sum(redetect)
+    if skipped_detection:
+        print(f"{skipped_detection}/{len(images)} ảnh có sẵn vị trí khuôn mặt, bỏ qua bước phát hiện")
+    if any(redetect):
+        print(f"{sum(redetect)}/{len(images)} ảnh có vị trí từ Haar cascade, phát hiện lại bằng HOG quanh vị trí đó")
+    pending = []
+    with metrics.time("cache_lookup"):
+        for i, (user_dir, img_path) in enumerate(images):
+            if cache is not None:
+                try:
+                    # The result depends on the known box too, if there is one
+                    keys[i] = file_digest(img_path)
+                    if locations[i]:
+                        keys[i] += f":{'hint' if redetect[i] else ''}{locations[i]}"
+                except OSError as e:
+                    print(f"Lỗi khi xử lý ảnh {img_path}: {e}")
+                    continue
+                entries[i] = cache.get(keys[i])
+            if entries[i] is None:
+                pending.append(i)
+    metrics.count("cache_hits", len(images) - len(pending))
+    
+    if pending and workers > 1:
+        print(f"Đang mã hóa {len(pending)} ảnh với {workers} tiến trình...")
+    tasks = [(images[i][1], locations[i], redetect[i]) for i in pending]
+    encode_start = time.perf_counter()
+    for i, (entry, error, timings) in zip(pending, encode_images(tasks, workers)):
+        # Per-image stages are measured in the workers, so with several
+        # workers they add up to more than the wall time of "encode_all"
+        for stage, seconds in timings.items():
+            metrics.observe(stage, seconds)
+        if error is not None:
+            print(f"Lỗi khi xử lý ảnh {images[i][1]}: {error}")
+            metrics.count("errors")
+            continue
+        entries[i] = entry
+        metrics.count("encoded")
+        if cache is not None:
+            cache.put(keys[i], *entry)
+    metrics.observe("encode_all", time.perf_counter() - encode_start)
+    
+    if assume_cropped:
+        # Ảnh cũ không có sidecar và HOG không tìm thấy khuôn mặt: coi cả ảnh là khuôn mặt
+        for i, (user_dir, img_path) in enumerate(images):
+            if entries[i] is not None and entries[i][0] is None and locations[i] is None:
+                try:
+                    entries[i] = encode_image(img_path, whole_image_location(img_path))
+                except Exception as e:
+                    print(f"Lỗi khi xử lý ảnh {img_path}: {e}")
+    
+    for (user_dir, img_path), entry in zip(images, entries):
+        if entry is None:
+            continue
+        encoding, box = entry
+        if encoding is not None:
+            face_encodings.append(encoding)
+            face_names.append(user_dir)
+        else:
+            print(f"Không tìm thấy khuôn mặt trong ảnh: {img_path}")
+            metrics.count("no_face")
+    return face_encodings, face_names
+
+def train_face_model(data_dir="data", model_output="models/face_auth_model.pkl", classifier="svm",
+                     cache_path="", use_cache=True, workers=1, assume_cropped=False, top_k=3, scoring="topk",
+                     prune=0.0, metrics=None, prototypes=PROTOTYPES_PER_USER):
+    if metrics is None:
+        metrics = Metrics()
+
     # Kiểm tra thư mục dữ liệu
     if not os.path.exists(data_dir):
         print(f"Thư mục {data_dir} không tồn tại!")
@@ -79,90 +277,81 @@ def train_face_model(data_dir="data", model_output="models/face_auth_model.pkl")
     if not os.path.exists(model_dir):
         os.makedirs(model_dir)
     
-    # Chuẩn bị dữ liệu
-    face_encodings = []
-    face_names = []
+    # Cache mã hóa: chỉ mã hóa lại ảnh mới hoặc đã thay đổi
+    cache = open_encoding_cache(model_output, cache_path) if use_cache else None
+    
+    # Duyệt qua các thư mục người dùng theo thứ tự cố định để mô hình tái lập được
+    with metrics.time("scan"):
+        images = list_training_images(data_dir)
+    metrics.count("images", len(images))
     
-    # Duyệt qua các thư mục người dùng
-    for user_dir in os.listdir(data_dir):
-        user_path = os.path.join(data_dir, user_dir)
-        if os.path.isdir(user_path):
-            print(f"Đang xử lý dữ liệu cho người dùng: {user_dir}")
-            
-            # Duyệt qua các file ảnh trong thư mục người dùng
-            for img_file in os.listdir(user_path):
-                if img_file.endswith(".jpg") or img_file.endswith(".png"):
-                    img_path = os.path.join(user_path, img_file)
-                    
-                    # Đọc ảnh và tạo mã hóa khuôn mặt
-                    try:
-                        image = face_recognition.load_image_file(img_path)
-                        encodings = face_recognition.face_encodings(image)
-                        
-                        if len(encodings) > 0:
-                            face_encodings.append(encodings[0])
-                            face_names.append(user_dir)
-                        else:
-                            print(f"Không tìm thấy khuôn mặt trong ảnh: {img_path}")
-                    except Exception as e:
-                        print(f"Lỗi khi xử lý ảnh {img_path}: {e}")
+    face_encodings, face_names = encode_training_images(images, cache, workers, assume_cropped, metrics)
+    
+    if cache is not None:
+        cache.save()
+        print(cache.summary())
     
     if len(face_encodings) == 0:
         print("Không có dữ liệu khuôn mặt nào được tìm thấy!")
+        metrics.flush(result="failure", reason="no faces")
         return
     
+    if prune > 0:
+        face_encodings, face_names, removed = prune_outliers(face_encodings, face_names, prune)
+        print(f"Đã loại bỏ {removed} mẫu khuôn mặt bất thường")
+    
     # Check number of unique users
     unique_users = set(face_names)
     print(f"Số lượng người dùng phát hiện: {len(unique_users)}")
     
+    if model_output.endswith(MODEL_EXTENSION) and classifier != "index":
+        print(f"Định dạng {MODEL_EXTENSION} chỉ lưu các mẫu khuôn mặt, dùng chỉ mục embedding thay cho {classifier}")
+        classifier = "index"
+    
     # Train the model
-    try:
-        if len(unique_users) < 2:
-            print("Cảnh báo: Chỉ phát hiện một người dùng. SVM cần ít nhất 2 lớp.")
-            print("Sử dụng mô hình đặc biệt cho một người dùng...")
-            
-            # For a single user, we'll just store the encodings and user directly
-            # We'll create a custom predict_proba function for the model
-            class SingleUserModel:
-                def __init__(self, encodings, user):
-                    self.encodings = encodings
-                    self.user = user
-                    self.classes_ = np.array([user])
-                
-                def predict_proba(self, face_encoding):
-                    # Calculate distances to all stored encodings
-                    distances = np.linalg.norm(self.encodings - face_encoding, axis=1)
-                    # Convert distance to similarity score (1 / (1 + distance))
-                    similarities = 1 / (1 + distances)
-                    # Average similarity score
-                    avg_similarity = np.mean(similarities)
-                    # Return as a 2D array with shape (n_samples, n_classes)
-                    return np.array([[avg_similarity]])
-            
-            clf = SingleUserModel(np.array(face_encodings), list(unique_users)[0])
-        else:
-            print("Đang huấn luyện mô hình SVM...")
-            clf = svm.SVC(gamma='scale', probability=True)
-            clf.fit(face_encodings, face_names)
-    except Exception as e:
-        print(f"Lỗi khi huấn luyện mô hình SVM: {e}")
-        print("Chuyển sang KNeighborsClassifier...")
-        clf = KNeighborsClassifier(n_neighbors=min(3, len(face_encodings)), metric='euclidean')
-        clf.fit(face_encodings, face_names)
+    with metrics.time("fit"):
+        clf = build_classifier(face_encodings, face_names, classifier, top_k, scoring, prototypes)
     
     # Save model
-    with open(model_output, 'wb') as f:
-        pickle.dump((clf, face_encodings, face_names), f)
+    with metrics.time("save"):
+        save_trained_model(model_output, clf, face_encodings, face_names, {"classifier": classifier})
     
     print(f"Đã lưu mô hình vào {model_output}")
     print(f"Số lượng người dùng: {len(set(face_names))}")
     print(f"Tổng số mẫu khuôn mặt: {len(face_encodings)}")
+    metrics.count("faces", len(face_encodings))
+    metrics.flush(result="success", classifier=type(clf).__name__, users=len(set(face_names)))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Huấn luyện mô hình nhận diện khuôn mặt")
     parser.add_argument("--data-dir", default="data", help="Đường dẫn đến thư mục dữ liệu")
     parser.add_argument("--output", default="models/face_auth_model.pkl", help="Đường dẫn lưu mô hình")
+    parser.add_argument("--classifier", choices=["svm", "index"], default="svm",
+                        help="svm: huấn luyện SVC; index: chỉ mục embedding không cần huấn luyện lại khi thêm/xóa người dùng")
+    parser.add_argument("--cache", default="", help="Đường dẫn cache mã hóa (mặc định: encoding_cache.pkl cạnh mô hình)")
+    parser.add_argument("--no-cache", action="store_true", help="Mã hóa lại tất cả ảnh, không dùng cache")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Số tiến trình mã hóa song song (0 = số lõi CPU)")
+    parser.add_argument("--assume-cropped", action="store_true",
+                        help="Ảnh không có file .json và không phát hiện được khuôn mặt được coi là ảnh đã cắt sẵn")
+    parser.add_argument("--top-k", type=int, default=3,
+                        help="Mô hình một người dùng: số mẫu gần nhất dùng để tính điểm")
+    parser.add_argument("--scoring", choices=SCORING_MODES, default="topk",
+                        help="Mô hình một người dùng: topk (trung bình k mẫu gần nhất) hoặc centroid (so với mẫu trung bình)")
+    parser.add_argument("--prune-outliers", type=float, default=0.0,
+                        help="Loại bỏ mẫu cách tâm của người dùng hơn N độ lệch chuẩn (0 = tắt)")
+    parser.add_argument("--prototypes", type=int, default=PROTOTYPES_PER_USER,
+                        help="Chỉ mục embedding: số mẫu đại diện của mỗi người dùng dùng để lọc sơ bộ "
+                             "(1 = mẫu trung bình, >1 = medoid)")
+    parser.add_argument("--metrics", default=METRICS_PATH,
+                        help="Ghi số liệu thời gian từng bước vào file: .prom (Prometheus) hoặc JSON lines "
+                             "(mặc định: FACE_AUTH_METRICS)")
     args = parser.parse_args()
+    if args.top_k < 1:
+        parser.error("--top-k must be at least 1")
     
-    train_face_model(args.data_dir, args.output)
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    train_face_model(args.data_dir, args.output, args.classifier, args.cache, not args.no_cache, workers,
+                     args.assume_cropped, args.top_k, args.scoring, args.prune_outliers,
+                     Metrics(args.metrics, prefix="face_auth_train"), args.prototypes)
 
@@ -0,0 +1,65 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+from auth_service import FaceAuthServer, parse_request, request_authentication, send_request
+
+def test_parse_request():
+    assert parse_request("PING\n") == ("PING",)
+    assert parse_request("AUTH izzy\n") == ("AUTH", "izzy", None)
+    assert parse_request("AUTH izzy ir\n") == ("AUTH", "izzy", "ir")
+
+@pytest.mark.parametrize("line", ["", "AUTH", "AUTH a b c", "auth izzy", "AUTH ../etc", "AUTH " + "a" * 65, "PING x"])
+def test_parse_request_rejects_malformed(line):
+    assert parse_request(line) is None
+
+@pytest.fixture
+def server(tmp_path):
+    # Runs a FaceAuthServer on its own loop; accepts only "izzy"
+    calls = []
+
+    async def authenticate(username, camera, session):
+        calls.append((username, camera))
+        return username == "izzy"
+
+    socket_path = str(tmp_path / "run" / "face_auth.sock")
+    server = FaceAuthServer(socket_path, authenticate)
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(server.serve_forever())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    for _ in range(100):
+        if os.path.exists(socket_path):
+            break
+        threading.Event().wait(0.01)
+    yield socket_path, calls
+    loop.call_soon_threadsafe(task.cancel)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+
+def test_server_round_trip(server):
+    socket_path, calls = server
+    assert send_request("PING", socket_path, timeout=5) == "PONG"
+    assert request_authentication("izzy", socket_path, timeout=5)
+    assert not request_authentication("khoi", socket_path, timeout=5, camera="ir")
+    assert send_request("AUTH", socket_path, timeout=5) == "FAILURE"
+    assert calls == [("izzy", None), ("khoi", "ir")]
+
+def test_socket_directory_is_private(server):
+    socket_path, _ = server
+    assert os.stat(os.path.dirname(socket_path)).st_mode & 0o777 == 0o750
+    assert os.stat(socket_path).st_mode & 0o777 == 0o660
+
+def test_refuses_writable_socket_directory(tmp_path):
+    socket_dir = tmp_path / "shared"
+    socket_dir.mkdir()
+    os.chmod(socket_dir, 0o777)
+
+    async def authenticate(username, camera, session):
+        return True
+
+    server = FaceAuthServer(str(socket_dir / "face_auth.sock"), authenticate)
+    with pytest.raises(RuntimeError):
+        asyncio.run(server.serve_forever())
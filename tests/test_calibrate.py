@@ -0,0 +1,35 @@
+import numpy as np
+
+from calibrate import calibrate, choose_threshold, error_curves
+from embedding_index import EmbeddingIndex
+from model_format import load_trained_model, save_trained_model
+from test_embedding_index import gallery
+
+def save_index(path, encodings, names):
+    save_trained_model(str(path), EmbeddingIndex.from_samples(encodings, names), list(encodings), names)
+
+def stored_calibration(path):
+    return (load_trained_model(str(path))[3] or {}).get("calibration")
+
+def test_choose_threshold_meets_target():
+    thresholds, far, frr = error_curves(np.array([0.8, 0.9]), np.array([0.2, 0.3, 0.7]))
+    result = choose_threshold(thresholds, far, frr, target_far=0.0)
+    assert result["far"] == 0.0 and result["frr"] == 0.0
+    assert 0.7 < result["threshold"] <= 0.8
+
+def test_separated_users_store_threshold(tmp_path):
+    path = tmp_path / "model.pkl"
+    save_index(path, *gallery(users=3, per_user=5))
+    result = calibrate(str(path), "index", target_far=0.01, force=True)
+    assert result["frr"] < 1.0
+    assert stored_calibration(path)["index"]["threshold"] == result["threshold"]
+
+def test_threshold_that_rejects_everybody_is_never_stored(tmp_path):
+    # Two users with the same samples: only a threshold above every score
+    # keeps impostors out, and it rejects every genuine attempt too
+    encodings, names = gallery(users=1, per_user=5)
+    path = tmp_path / "model.pkl"
+    save_index(path, np.concatenate([encodings, encodings]), names + ["twin"] * len(names))
+    result = calibrate(str(path), "index", target_far=0.01, force=True)
+    assert result["frr"] == 1.0
+    assert stored_calibration(path) is None
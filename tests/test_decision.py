@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from decision import FAILURE, NOT_RECOGNIZED, SUCCESS, ConsecutiveMatchPolicy, MajorityVotePolicy, create_engine
+
+def feed(policy, frames):
+    # frames are (face_found, matched, confidence); returns the first verdict
+    for frame in frames:
+        verdict = policy.observe(*frame)
+        if verdict is not None:
+            return verdict[0], policy.frames
+    return None, policy.frames
+
+def test_majority_accepts_once_enough_frames_match():
+    policy = MajorityVotePolicy(max_frames=10, required_matches=6)
+    assert feed(policy, [(True, True, 0.7)] * 10) == (SUCCESS, 6)
+
+def test_majority_rejects_once_acceptance_is_impossible():
+    policy = MajorityVotePolicy(max_frames=10, required_matches=6)
+    assert feed(policy, [(True, False, 0.2)] * 10) == (FAILURE, 5)
+
+def test_majority_reports_missing_face():
+    policy = MajorityVotePolicy(max_frames=10, required_matches=6, no_face_limit=7)
+    assert feed(policy, [(False, False, None)] * 10) == (NOT_RECOGNIZED, 5)
+
+def test_consecutive_accepts_strong_streak():
+    policy = ConsecutiveMatchPolicy(required_consecutive=3, strong_confidence=0.8)
+    assert feed(policy, [(True, True, 0.9)] * 10) == (SUCCESS, 3)
+
+def test_consecutive_weak_matches_fall_back_to_majority():
+    policy = ConsecutiveMatchPolicy(required_consecutive=3, strong_confidence=0.8)
+    assert feed(policy, [(True, True, 0.7)] * 10) == (SUCCESS, 6)
+
+def test_engine_time_budget():
+    engine = create_engine("majority", time_budget=0.0)
+    engine.start()
+    decision = engine.observe(True, True, 0.9)
+    assert decision.result == FAILURE and "time budget" in decision.reason
+
+def test_engine_gives_up_on_missing_frames():
+    engine = create_engine("majority", max_frames=3)
+    engine.start()
+    assert engine.skip() is None and engine.skip() is None
+    assert engine.skip().result == FAILURE
+
+def test_majority_scales_required_matches_with_max_frames():
+    assert MajorityVotePolicy(max_frames=10).required_matches == 6
+    assert MajorityVotePolicy(max_frames=5).required_matches == 3
+    assert MajorityVotePolicy(max_frames=20).required_matches == 12
+    assert feed(MajorityVotePolicy(max_frames=5), [(True, True, 0.7)] * 5) == (SUCCESS, 3)
+
+@pytest.mark.parametrize("required", [0, 6])
+def test_majority_rejects_unreachable_requirements(required):
+    with pytest.raises(ValueError):
+        MajorityVotePolicy(max_frames=5, required_matches=required)
+
+def test_strong_cutoff_follows_classifier_threshold():
+    from face_auth import make_decision_engine, set_strong_cutoff
+
+    engine = make_decision_engine()
+    set_strong_cutoff(engine, 0.6)
+    assert engine.policy.strong_cutoff == pytest.approx(0.8)
+    assert feed(engine.policy, [(True, True, 0.85)] * 10) == (SUCCESS, 3)
+
+def test_strong_cutoff_follows_distance_scale():
+    from embedding_index import DISTANCE_THRESHOLD, EmbeddingIndex
+    from face_auth import make_decision_engine, set_strong_cutoff
+
+    engine = make_decision_engine()
+    index = EmbeddingIndex.from_samples(np.zeros((1, 128), dtype=np.float32), ["alice"])
+    set_strong_cutoff(engine, index.default_threshold, index)
+    # A genuine match at d = 0.4 scores 1 / 1.4, below the classifier-scale 0.8
+    confidence = 1.0 / 1.4
+    assert DISTANCE_THRESHOLD < engine.policy.strong_cutoff < confidence < 0.8
+    assert feed(engine.policy, [(True, True, confidence)] * 10) == (SUCCESS, 3)
+
+def test_strong_cutoff_follows_calibrated_threshold_and_override():
+    from face_auth import make_decision_engine, set_strong_cutoff
+
+    engine = make_decision_engine()
+    set_strong_cutoff(engine, 0.9)
+    assert engine.policy.strong_cutoff == pytest.approx(0.95)
+    engine = make_decision_engine(strong_confidence=0.7)
+    set_strong_cutoff(engine, 0.6)
+    assert engine.policy.strong_cutoff == 0.7
+    # Never below the threshold itself
+    set_strong_cutoff(engine, 0.75)
+    assert engine.policy.strong_cutoff == 0.75
+
+def test_consecutive_without_cutoff_only_uses_majority():
+    policy = ConsecutiveMatchPolicy(required_consecutive=3)
+    assert feed(policy, [(True, True, 0.99)] * 10) == (SUCCESS, 6)
@@ -0,0 +1,86 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from embedding_index import (EMBEDDING_DIM, ClaimVerifier, EmbeddingIndex, SingleUserModel, prune_outliers,
+                             user_prototypes)
+
+def gallery(users=3, per_user=5, seed=0):
+    # Users far apart, samples of one user close together
+    rng = np.random.default_rng(seed)
+    encodings, names = [], []
+    for u in range(users):
+        center = rng.normal(size=EMBEDDING_DIM)
+        encodings.extend(center + 0.01 * rng.normal(size=(per_user, EMBEDDING_DIM)))
+        names.extend([f"user{u}"] * per_user)
+    return np.array(encodings, dtype=np.float32), names
+
+def test_predict_matches_nearest_user():
+    encodings, names = gallery()
+    index = EmbeddingIndex.from_samples(encodings, names)
+    assert list(index.predict(encodings)) == names
+    scores = index.predict_proba(encodings)
+    assert scores.shape == (len(names), 3)
+    assert np.allclose(scores.max(axis=1), 1.0, atol=1e-2)
+
+def test_add_and_remove_user():
+    encodings, names = gallery()
+    index = EmbeddingIndex.from_samples(encodings, names)
+    index.add_user("new", encodings[:2] + 5.0)
+    assert index.users == ["user0", "user1", "user2", "new"]
+    index.remove_user("user1")
+    assert index.users == ["user0", "user2", "new"]
+    assert len(index) == 12
+    assert index.predict(encodings[-1:])[0] == "user2"
+
+def test_user_scores_only_reads_claimed_user():
+    encodings, names = gallery()
+    index = EmbeddingIndex.from_samples(encodings, names)
+    verifier = ClaimVerifier(index)
+    assert verifier.verify(encodings[:1], "user0")[0] > 0.99
+    assert verifier.verify(encodings[:1], "user1")[0] < 0.5
+    assert verifier.verify(encodings[:1], "nobody")[0] == 0
+    assert verifier.default_threshold == index.default_threshold
+
+def test_shortlist_matches_full_scan():
+    encodings, names = gallery(users=150, per_user=3)
+    index = EmbeddingIndex.from_samples(encodings, names)
+    full = np.minimum.reduceat(index.distances(encodings), index.starts, axis=1)
+    coarse = index.user_distances(encodings)
+    assert np.array_equal(coarse.argmin(axis=1), full.argmin(axis=1))
+    assert np.isinf(coarse).sum(axis=1).min() == 150 - index.shortlist
+
+def test_pickle_round_trip_keeps_prototypes():
+    encodings, names = gallery()
+    index = EmbeddingIndex.from_samples(encodings, names, prototypes_per_user=2)
+    restored = pickle.loads(pickle.dumps(index))
+    assert np.array_equal(restored.prototypes()[0], index.prototypes()[0])
+    assert np.allclose(restored.predict_proba(encodings), index.predict_proba(encodings))
+
+def test_user_prototypes():
+    encodings, _ = gallery(users=1, per_user=6)
+    assert np.allclose(user_prototypes(encodings, 1), encodings.mean(axis=0, keepdims=True))
+    assert len(user_prototypes(encodings, 3)) == 3
+
+def test_single_user_model_scores():
+    encodings, _ = gallery(users=1, per_user=6)
+    for scoring in ("topk", "centroid"):
+        model = SingleUserModel(encodings, "izzy", top_k=3, scoring=scoring)
+        assert model.predict_proba(encodings).shape == (6, 1)
+        assert model.predict_proba(encodings[:1] + 1.0)[0, 0] < model.predict_proba(encodings[:1])[0, 0]
+    with pytest.raises(ValueError):
+        SingleUserModel(encodings, "izzy", scoring="mean")
+    with pytest.raises(ValueError):
+        SingleUserModel(encodings, "izzy", top_k=0)
+    assert SingleUserModel.default_threshold == EmbeddingIndex.default_threshold
+
+def test_prune_outliers():
+    encodings, names = gallery(users=1, per_user=10)
+    encodings[3] += 3.0
+    kept, kept_names, removed = prune_outliers(encodings, names, 3.0)
+    assert removed == 1 and len(kept) == 9 and len(kept_names) == 9
+
+def test_distance_scores_default_to_face_recognition_tolerance():
+    # 1 / (1 + 0.6): a score of 0.6 would accept distances up to 0.67
+    assert EmbeddingIndex.default_threshold == pytest.approx(0.625)
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from frame_source import FrameSource, GeneratorSource, RecordingSource
+
+def frames(count):
+    return [np.full((4, 4, 3), i, dtype=np.uint8) for i in range(count)]
+
+def test_frame_source_requires_open():
+    with pytest.raises(TypeError):
+        FrameSource()
+
+def test_looping_source_restarts_after_reset_stats():
+    source = GeneratorSource(lambda: frames(2), loop=True)
+    assert [source.read()[1][0, 0, 0] for _ in range(2)] == [0, 1]
+    # A new request resets the stats just before the source runs out
+    source.reset_stats()
+    assert [source.read()[1][0, 0, 0] for _ in range(3)] == [0, 1, 0]
+    assert source.stats() == {"frames_delivered": 3, "read_failures": 0}
+
+def test_empty_looping_source_fails():
+    source = GeneratorSource(lambda: [], loop=True)
+    assert source.read() == (False, None)
+    assert source.read_failures == 1
+
+def test_source_without_loop_runs_out():
+    source = GeneratorSource(frames(1))
+    assert source.read()[0]
+    assert source.read() == (False, None)
+
+def test_recording_source_records_delivered_frames(tmp_path):
+    source = RecordingSource(GeneratorSource(frames(2)), str(tmp_path))
+    assert isinstance(source, FrameSource)
+    assert source.read()[0] and source.read()[0]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["frame_000000.png", "frame_000001.png"]
+    assert source.stats()["frames_recorded"] == 2
@@ -0,0 +1,52 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from embedding_index import EmbeddingIndex
+from model_format import (ModelFile, ModelFormatError, is_binary_model, load_model, load_pickled_model,
+                          read_model_metadata, save_model)
+from test_embedding_index import gallery
+
+def test_fam_round_trip(tmp_path):
+    encodings, names = gallery()
+    index = EmbeddingIndex.from_samples(encodings, names, prototypes_per_user=2)
+    path = str(tmp_path / "model.fam")
+    save_model(path, index, {"classifier": "index"}, {"extra": b"kept"})
+    assert is_binary_model(path)
+
+    loaded, metadata = load_model(path)
+    assert metadata == {"classifier": "index"}
+    assert loaded.users == index.users
+    assert np.array_equal(loaded.counts, index.counts)
+    assert np.array_equal(loaded.embeddings, index.embeddings)
+    assert np.array_equal(loaded.prototypes()[0], index.prototypes()[0])
+    assert np.allclose(loaded.predict_proba(encodings), index.predict_proba(encodings))
+    assert ModelFile(path).read_section("extra") == b"kept"
+    assert read_model_metadata(path) == {"classifier": "index"}
+
+def test_empty_index_round_trip(tmp_path):
+    path = str(tmp_path / "empty.fam")
+    save_model(path, EmbeddingIndex())
+    loaded, _ = load_model(path)
+    assert len(loaded) == 0 and loaded.users == []
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "model.fam"
+    path.write_bytes(b"not a model at all" * 10)
+    assert not is_binary_model(str(path))
+    with pytest.raises(ModelFormatError):
+        ModelFile(str(path))
+
+def test_pickled_model_round_trip(tmp_path):
+    encodings, names = gallery()
+    index = EmbeddingIndex.from_samples(encodings, names)
+    old = tmp_path / "old.pkl"
+    old.write_bytes(pickle.dumps((index, list(encodings), names)))
+    assert load_pickled_model(str(old))[3] == {}
+
+    new = tmp_path / "new.pkl"
+    new.write_bytes(pickle.dumps((index, list(encodings), names, {"classifier": "index"})))
+    clf, _, loaded_names, metadata = load_pickled_model(str(new))
+    assert loaded_names == names and metadata == {"classifier": "index"}
+    assert read_model_metadata(str(new)) == {"classifier": "index"}